@@ -0,0 +1,116 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import sys
+import random
+import shutil
+import argparse
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magus.helpers import sequenceutils
+
+'''
+Regression check for adding sequences to a finished run (--addsequences).
+Some sequences are held out of the example/ subalignments and backbones, MAGUS aligns the rest, and then the held-out sequences are added.
+MAGUS also aligns the full example from scratch, with the same backbones.
+For both alignments, the check measures the share of new residues that land in columns holding at least one old residue.
+It fails (exit code 1) if the added alignment's share is more than --tolerance below the from-scratch share.
+
+Example:
+python3 benchmarks/check_add_sequences.py -o add_check -np 4
+'''
+
+def main():
+    args = parseArgs()
+    outputDir = os.path.abspath(args.output)
+    rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    exampleDir = os.path.join(rootDir, "example")
+    if os.path.exists(outputDir):
+        shutil.rmtree(outputDir)
+    os.makedirs(outputDir)
+
+    subalignmentPaths = listFiles(os.path.join(exampleDir, "subalignments"))
+    backbonePaths = listFiles(os.path.join(exampleDir, "backbones"))[:args.numbackbones]
+    sequences = {}
+    for path in subalignmentPaths:
+        sequences.update(sequenceutils.readFromFasta(path, removeDashes = True))
+    random.seed(args.seed)
+    newTaxa = set(random.sample(sorted(sequences), args.numsequences))
+
+    inputDir = os.path.join(outputDir, "inputs")
+    baseSubalignments = [removeTaxa(path, newTaxa, os.path.join(inputDir, "subalignments")) for path in subalignmentPaths]
+    baseBackbones = [removeTaxa(path, newTaxa, os.path.join(inputDir, "backbones")) for path in backbonePaths]
+    newPath = os.path.join(inputDir, "new_sequences.txt")
+    sequenceutils.writeFasta(sequences, newPath, sorted(newTaxa))
+
+    fullPath = os.path.join(outputDir, "full.txt")
+    addPath = os.path.join(outputDir, "added.txt")
+    runMagus(rootDir, os.path.join(outputDir, "full"), subalignmentPaths, backbonePaths, fullPath, args.numprocs)
+    runMagus(rootDir, os.path.join(outputDir, "add"), baseSubalignments, baseBackbones, os.path.join(outputDir, "base.txt"), args.numprocs)
+    runMagus(rootDir, os.path.join(outputDir, "add"), baseSubalignments, baseBackbones, addPath, args.numprocs, newPath)
+
+    fullShare, addShare = sharedResidueShare(fullPath, newTaxa), sharedResidueShare(addPath, newTaxa)
+    report("New residues in shared columns: {:.4f} from scratch, {:.4f} added".format(fullShare, addShare))
+    if addShare < fullShare - args.tolerance:
+        report("FAILED: the added alignment is more than {} below the from-scratch alignment".format(args.tolerance))
+        sys.exit(1)
+    report("OK")
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description = "Check MAGUS --addsequences against a from-scratch run on the example")
+    parser.add_argument("-o", "--output", type = str, required = True,
+                        help = "Output directory for the runs and the alignments")
+    parser.add_argument("--numsequences", type = int, default = 10,
+                        help = "Number of example sequences to hold out and add")
+    parser.add_argument("--numbackbones", type = int, default = 3,
+                        help = "Number of example backbones to use in both runs")
+    parser.add_argument("--tolerance", type = float, default = 0.02,
+                        help = "Largest allowed drop in the share of new residues in shared columns")
+    parser.add_argument("--seed", type = int, default = 1,
+                        help = "Random seed for picking the held-out sequences")
+    parser.add_argument("-np", "--numprocs", type = int, default = 1,
+                        help = "Number of cores for each MAGUS run")
+    return parser.parse_args()
+
+def listFiles(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if not name.startswith("."))
+
+def removeTaxa(alignmentPath, taxa, outputDir):
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    alignment = sequenceutils.PackedAlignment.fromFasta(alignmentPath)
+    rows = [i for i, tag in enumerate(alignment.tags) if tag not in taxa]
+    if len(rows) == 0:
+        raise Exception("Every sequence of {} was held out, use fewer held-out sequences".format(alignmentPath))
+    alignment = sequenceutils.PackedAlignment([alignment.tags[i] for i in rows], alignment.matrix[rows])
+    outputPath = os.path.join(outputDir, os.path.basename(alignmentPath))
+    alignment.selectColumns(np.flatnonzero(alignment.letterCounts() > 0)).writeFasta(outputPath)
+    return outputPath
+
+def runMagus(rootDir, workingDir, subalignmentPaths, backbonePaths, outputPath, numCores, addSequencesPath = None):
+    args = [sys.executable, "-m", "magus.main", "-d", workingDir, "-s"] + subalignmentPaths + ["-b"] + backbonePaths
+    args.extend(["-o", outputPath, "-np", str(numCores)])
+    if addSequencesPath is not None:
+        args.extend(["--addsequences", addSequencesPath])
+    report("Running MAGUS, output {}".format(outputPath))
+    with open(os.path.join(os.path.dirname(outputPath), "{}.log".format(os.path.basename(outputPath))), 'w') as logFile:
+        subprocess.run(args, cwd = rootDir, stdout = logFile, stderr = subprocess.STDOUT, check = True)
+
+def sharedResidueShare(alignmentPath, newTaxa):
+    alignment = sequenceutils.PackedAlignment.fromFasta(alignmentPath)
+    isNew = np.array([tag in newTaxa for tag in alignment.tags])
+    letters = ~alignment.gapMask()
+    sharedColumns = letters[~isNew].any(axis = 0)
+    newLetters = letters[isNew]
+    return newLetters[:, sharedColumns].sum() / max(1, newLetters.sum())
+
+def report(msg):
+    print(msg, flush = True)
+
+if __name__ == '__main__':
+    main()
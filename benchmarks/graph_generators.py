@@ -0,0 +1,107 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import json
+import numpy as np
+
+from magus.configuration import Configs
+from magus.align.alignment_context import AlignmentContext
+from magus.align.merge.alignment_graph import AlignmentGraph
+from magus.align.merge.graph_build.graph_builder import buildGraph
+
+'''
+Alignment graphs for the benchmarks.
+Synthetic graphs simulate backbones over a hidden true alignment: each subalignment's columns are a sorted sample of the true columns.
+Each backbone includes each subalignment with probability "density", and misplaces each column by a column or two with probability "noise".
+Columns that land on the same true column in a backbone get an edge, so edge weights count the supporting backbones.
+The reference graph is built from the example/ subalignments and backbones, exactly as MAGUS would build it.
+Prepared graphs are stored as a graph.bin checkpoint, plus graph.json with the subalignment lengths and generator parameters.
+'''
+
+SYNTHETIC_DEFAULTS = {"subalignments" : 10, "length" : 200, "noise" : 0.05, "density" : 0.5, "backbones" : 10, "seed" : 1}
+
+def benchmarkContext(workingDir, numSubalignments):
+    context = AlignmentContext(workingDir = workingDir, outputFile = os.path.join(workingDir, "alignment.txt"))
+    context.subalignments = [[] for i in range(numSubalignments)]
+    return context
+
+def parseGraphSpec(spec):
+    if spec == "example":
+        return "example", {}
+    name, sep, params = spec.partition(":")
+    if name != "synthetic":
+        raise Exception("Unknown graph spec {}, expected example or synthetic[:key=value,...]".format(spec))
+    args = dict(SYNTHETIC_DEFAULTS)
+    for token in params.split(","):
+        if token != "":
+            key, value = token.split("=")
+            if key not in args:
+                raise Exception("Unknown synthetic graph parameter {}".format(key))
+            args[key] = type(SYNTHETIC_DEFAULTS[key])(value)
+    graphName = "synthetic_k{}_l{}_n{}_d{}_b{}_s{}".format(args["subalignments"], args["length"], args["noise"],
+                                                          args["density"], args["backbones"], args["seed"])
+    return graphName, args
+
+def prepareGraph(spec, outputDir, exampleDir):
+    graphName, args = parseGraphSpec(spec)
+    graphDir = os.path.join(outputDir, graphName)
+    infoPath = os.path.join(graphDir, "graph.json")
+    if os.path.exists(infoPath):
+        return graphName, graphDir
+
+    if graphName == "example":
+        graph = buildExampleGraph(graphDir, exampleDir)
+    else:
+        graph = buildSyntheticGraph(graphDir, **args)
+    graph.writeGraphCheckpoint(os.path.join(graphDir, "graph.bin"))
+    with open(infoPath, 'w') as infoFile:
+        json.dump({"name" : graphName, "params" : args, "subalignmentLengths" : graph.subalignmentLengths,
+                   "numNodes" : graph.matrixSize, "numEdges" : graph.matrix.numEdges()}, infoFile)
+    return graphName, graphDir
+
+def buildExampleGraph(graphDir, exampleDir):
+    listFiles = lambda d: sorted(os.path.join(d, f) for f in os.listdir(d) if not f.startswith("."))
+    subalignmentPaths = listFiles(os.path.join(exampleDir, "subalignments"))
+    context = AlignmentContext(workingDir = os.path.join(graphDir, "build"), outputFile = os.path.join(graphDir, "alignment.txt"),
+                               subalignmentPaths = subalignmentPaths, subsetPaths = subalignmentPaths,
+                               backbonePaths = listFiles(os.path.join(exampleDir, "backbones")))
+    Configs.constrain = True
+    buildGraph(context)
+    return context.graph
+
+def buildSyntheticGraph(graphDir, subalignments, length, noise, density, backbones, seed):
+    rng = np.random.default_rng(seed)
+    trueLength = int(length * 1.5)
+    lengths = rng.integers(max(1, int(length * 0.8)), length + 1, subalignments)
+    trueColumns = [np.sort(rng.choice(trueLength, size = int(l), replace = False)) for l in lengths]
+
+    graph = AlignmentGraph(benchmarkContext(graphDir, subalignments))
+    graph.initializeMatrix(lengths)
+    for b in range(backbones):
+        included = np.flatnonzero(rng.random(subalignments) < density)
+        if len(included) < 2:
+            continue
+        nodes = np.concatenate([graph.subsetMatrixIdx[i] + np.arange(lengths[i]) for i in included])
+        columns = np.concatenate([trueColumns[i] for i in included])
+        shifts = rng.choice([-2, -1, 1, 2], size = len(columns)) * (rng.random(len(columns)) < noise)
+        graph.addEdges(*backboneEdges(graph, nodes, columns + shifts))
+    return graph
+
+def backboneEdges(graph, nodes, columns):
+    order = np.argsort(columns, kind = "stable")
+    nodes, columns = nodes[order], columns[order]
+    rows, cols = [], []
+    for d in range(1, len(nodes)):
+        same = columns[d:] == columns[:-d]
+        if not same.any():
+            break
+        a, b = nodes[:-d][same], nodes[d:][same]
+        cross = graph.nodeSubalignments[a] != graph.nodeSubalignments[b]
+        rows.extend([a[cross], b[cross]])
+        cols.extend([b[cross], a[cross]])
+    if len(rows) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    return rows, cols, np.ones(len(rows), dtype = np.int64)
@@ -0,0 +1,195 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magus.configuration import Configs
+from magus.align.merge.graph_cluster.clusterer import clusterGraph
+from magus.align.merge.graph_trace.tracer import findTrace
+from magus.align.merge.graph_trace import kernels, fm, rg_fast_search
+from magus.align.merge.alignment_graph import AlignmentGraph
+from magus.align.merge import checkpoint
+import graph_generators
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+'''
+Benchmark harness for the graph clustering and trace methods.
+Every graph is prepared once, then each clustering method runs on it, and each trace method runs on each clustering.
+Every run happens in its own spawned process, so the peak memory is measured per run and slow runs can be timed out.
+Each run reports its wall time, peak RSS (including external tools like mcl) and the MWT cut cost from computeClusteringCost.
+The compiled trace kernels are warmed up on a tiny graph before the timer starts, and the warm-up time is reported separately.
+Results are written to results.csv and results.json in the output directory.
+
+Example:
+python3 benchmarks/run_benchmarks.py -o bench_out --graphs example synthetic:subalignments=25,length=500,noise=0.1 --tracemethods minclusters mwtgreedy
+'''
+
+CLUSTER_METHODS = ["mcl", "mclnative", "mclwindowed", "mlrmcl", "rg", "none"]
+TRACE_METHODS = ["minclusters", "fm", "mwtgreedy", "mwtsearch", "rg", "rgfast", "naive"]
+DEFAULT_GRAPHS = ["example", "synthetic", "synthetic:subalignments=25,length=300,noise=0.15,density=0.3"]
+RESULT_FIELDS = ["graph", "clusterMethod", "traceMethod", "status", "seconds", "warmupSeconds", "peakRssMb", "loadRssMb", "cost", "numClusters", "error"]
+
+def main():
+    args = parseArgs()
+    outputDir = os.path.abspath(args.output)
+    exampleDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example")
+    Configs.workingDir = outputDir
+    Configs.numCores = args.numprocs
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+
+    results = []
+    for spec in args.graphs:
+        graphName, graphDir = graph_generators.prepareGraph(spec, outputDir, exampleDir)
+        with open(os.path.join(graphDir, "graph.json")) as infoFile:
+            info = json.load(infoFile)
+        report("Graph {}: {} nodes, {} edges".format(graphName, info["numNodes"], info["numEdges"]))
+
+        for clusterMethod in args.clustermethods:
+            clusterDir = os.path.join(graphDir, clusterMethod)
+            job = {"graphDir" : graphDir, "workingDir" : clusterDir, "clusterMethod" : clusterMethod, "traceMethod" : None,
+                   "lengths" : info["subalignmentLengths"], "numCores" : args.numprocs, "inflation" : args.inflationfactor}
+            result = runJob(job, args.timeout)
+            results.append(dict(result, graph = graphName, clusterMethod = clusterMethod, traceMethod = ""))
+            report(formatResult(results[-1]))
+            if result["status"] != "ok":
+                continue
+
+            for traceMethod in args.tracemethods:
+                job = dict(job, workingDir = os.path.join(clusterDir, traceMethod), traceMethod = traceMethod)
+                result = runJob(job, args.timeout)
+                results.append(dict(result, graph = graphName, clusterMethod = clusterMethod, traceMethod = traceMethod))
+                report(formatResult(results[-1]))
+
+    writeResults(outputDir, results)
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description = "Benchmark MAGUS graph clustering and trace methods")
+    parser.add_argument("-o", "--output", type = str, required = True,
+                        help = "Output directory for the prepared graphs and the results")
+    parser.add_argument("--graphs", type = str, nargs = "+", default = DEFAULT_GRAPHS,
+                        help = "Graphs to benchmark: example, or synthetic[:subalignments=N,length=N,noise=F,density=F,backbones=N,seed=N]")
+    parser.add_argument("--clustermethods", type = str, nargs = "+", default = CLUSTER_METHODS,
+                        help = "Graph clustering methods to run")
+    parser.add_argument("--tracemethods", type = str, nargs = "+", default = TRACE_METHODS,
+                        help = "Graph trace methods to run on each clustering")
+    parser.add_argument("--timeout", type = float, default = 600,
+                        help = "Time limit for each run, in seconds")
+    parser.add_argument("-np", "--numprocs", type = int, default = 1,
+                        help = "Number of cores available to each run")
+    parser.add_argument("-f", "--inflationfactor", type = float, default = 4,
+                        help = "MCL inflation factor")
+    return parser.parse_args()
+
+def runJob(job, timeout):
+    mpContext = multiprocessing.get_context("spawn")
+    queue = mpContext.Queue()
+    process = mpContext.Process(target = runBenchmark, args = (job, queue))
+    startTime = time.time()
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {"status" : "timeout", "seconds" : time.time() - startTime}
+    if queue.empty():
+        return {"status" : "crashed", "seconds" : time.time() - startTime, "error" : "exit code {}".format(process.exitcode)}
+    return queue.get()
+
+def runBenchmark(job, queue):
+    try:
+        if os.path.exists(job["workingDir"]):
+            shutil.rmtree(job["workingDir"])
+        os.makedirs(job["workingDir"])
+        logFile = open(os.path.join(job["workingDir"], "log.txt"), 'w')
+        os.dup2(logFile.fileno(), sys.stdout.fileno())
+        os.dup2(logFile.fileno(), sys.stderr.fileno())
+        Configs.workingDir = job["workingDir"]
+        Configs.numCores = job["numCores"]
+        Configs.mclInflationFactor = job["inflation"]
+        Configs.graphClusterMethod = job["clusterMethod"]
+        Configs.graphTraceMethod = job["traceMethod"]
+
+        lengths = job["lengths"]
+        graph = AlignmentGraph(graph_generators.benchmarkContext(job["workingDir"], len(lengths)))
+        graph.initializeMatrix(lengths)
+        graph.readGraphCheckpoint(os.path.join(job["graphDir"], "graph.bin"))
+        graph.matrix.getCsr()
+        clusterDir = os.path.join(job["graphDir"], job["clusterMethod"])
+        if job["traceMethod"] is not None:
+            graph.readClustersCheckpoint(os.path.join(clusterDir, "clusters.bin"))
+        loadRss = peakRss()[0]
+        warmupSeconds = warmUpKernels(graph, job["workingDir"]) if job["traceMethod"] is not None else 0
+
+        startTime = time.time()
+        if job["traceMethod"] is None:
+            clusterGraph(graph)
+        else:
+            findTrace(graph)
+        seconds = time.time() - startTime
+
+        if job["traceMethod"] is None:
+            checkpoint.writeCheckpoint(os.path.join(clusterDir, "clusters.bin"), "clusters", lengths,
+                                       checkpoint.clustersToCheckpointArrays(graph.clusters))
+        queue.put({"status" : "ok", "seconds" : seconds, "warmupSeconds" : warmupSeconds, "peakRssMb" : max(peakRss()), "loadRssMb" : loadRss,
+                   "cost" : graph.computeClusteringCost(graph.clusters), "numClusters" : len(graph.clusters)})
+    except Exception as exc:
+        queue.put({"status" : "failed", "error" : "{}: {}".format(type(exc).__name__, exc)})
+
+def warmUpKernels(graph, workingDir):
+    if not kernels.kernelsEnabled():
+        return 0
+    startTime = time.time()
+    tinyGraph = AlignmentGraph(graph_generators.benchmarkContext(os.path.join(workingDir, "warmup"), 2))
+    tinyGraph.initializeMatrix([2, 2])
+    tinyCsr = []
+    for template, values in zip(graph.matrix.getCsr(), ([0, 1, 2, 3, 4], [2, 3, 0, 1], [1, 1, 1, 1])):
+        array = np.array(values, dtype = template.dtype)
+        array.flags.writeable = template.flags.writeable
+        tinyCsr.append(array)
+    tinyGraph.matrix.setCsr(*tinyCsr)
+    tinyGraph.buildNodeEdgeDataStructure()
+    fm.fmFindBestCutCompiled(tinyGraph, [0, 0], [2, 2], [1, 1], None)
+    rg_fast_search.initialSplitExpansionCompiled(tinyGraph, [0, 0], [2, 2], 0, 2)
+    return time.time() - startTime
+
+def peakRss():
+    if resource is None:
+        return 0, 0
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+def formatResult(result):
+    name = "{} / {} / {}".format(result["graph"], result["clusterMethod"], result["traceMethod"] or "-")
+    if result["status"] != "ok":
+        return "{:<70} {} {}".format(name, result["status"], result.get("error", ""))
+    return "{:<70} {:>10.2f} sec {:>10.1f} MB   cost {}".format(name, result["seconds"], result["peakRssMb"], result["cost"])
+
+def report(msg):
+    print(msg, flush = True)
+
+def writeResults(outputDir, results):
+    with open(os.path.join(outputDir, "results.json"), 'w') as jsonFile:
+        json.dump(results, jsonFile, indent = 1)
+    with open(os.path.join(outputDir, "results.csv"), 'w', newline = '') as csvFile:
+        writer = csv.DictWriter(csvFile, fieldnames = RESULT_FIELDS, extrasaction = "ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    report("Wrote results to {}".format(os.path.join(outputDir, "results.csv")))
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,16 @@ Created on May 29, 2020
 '''
 
 import os
+import math
 import shutil
 
 from .alignment_context import AlignmentContext
 from .decompose.decomposer import decomposeSequences
 from .merge.merger import mergeSubalignments
+from .merge.sequence_adder import preparePreviousRun, addSequences
 from ..tools import external_tools
 from ..configuration import Configs
-from ..helpers import sequenceutils
+from ..helpers import sequenceutils, profiler
 from ..tasks import task
 
 '''
@@ -29,27 +31,46 @@ def mainAlignmentTask():
     task.submitTask()
     task.awaitTask()
     
-def createAlignmentTask(args):
-    return task.Task(taskType = "runAlignmentTask", outputFile = args["outputFile"], taskArgs = args)
+def createAlignmentTask(args, cost = 0):
+    return task.Task(taskType = "runAlignmentTask", outputFile = args["outputFile"], taskArgs = args, cost = cost)
+
+def estimateAlignmentCost(sequencesPath, numSequences, mafftThreshold):
+    '''
+    Recursive alignment tasks sit on the critical path: their whole recursion has to finish before the parent can merge.
+    So their cost is the input size, scaled by the expected number of recursion levels below them.
+    '''
+    
+    levels = max(1, math.ceil(math.log(numSequences / mafftThreshold, max(2, Configs.decompositionMaxNumSubsets))))
+    return task.estimateFileCost(sequencesPath) * (levels + 1)
 
 def runAlignmentTask(**kwargs):
     '''
     The standard MAGUS task: 
     decompose the data into subsets, align each subset, and merge the subalignments.
+    When adding sequences, the top level instead reuses the finished run in its working directory.
     '''
     
     with AlignmentContext(**kwargs) as context:
         if context.sequencesPath is not None:
             Configs.log("Aligning sequences {}".format(context.sequencesPath))
+        addingSequences = Configs.addSequencesPath is not None and context.workingDir == Configs.workingDir
+        if addingSequences:
+            preparePreviousRun(context)
         
-        decomposeSequences(context)
+        with profiler.stage("decomposition", context.workingDir):
+            decomposeSequences(context)
         if Configs.onlyGuideTree:
             Configs.log("Outputting only the guide tree, as requested..")
             shutil.copyfile(os.path.join(context.workingDir, "decomposition", "initial_tree", "initial_tree.tre"), context.outputFile)
             return
         
-        alignSubsets(context)
-        mergeSubalignments(context)
+        with profiler.stage("subalignment submission", context.workingDir):
+            alignSubsets(context)
+        if addingSequences:
+            with profiler.stage("sequence addition", context.workingDir):
+                addSequences(context)
+        else:
+            mergeSubalignments(context)
 
 def alignSubsets(context):
     if len(context.subalignmentPaths) > 0:
@@ -80,7 +101,8 @@ def alignSubsets(context):
             Configs.log("Subset has {}/{} sequences, recursively subaligning with MAGUS..".format(len(subset), mafftThreshold))
             subalignmentDir = os.path.join(subalignDir, os.path.splitext(os.path.basename(subalignmentPath))[0])
             subalignmentTask = createAlignmentTask({"outputFile" : subalignmentPath, "workingDir" : subalignmentDir, 
-                                                    "sequencesPath" : file, "guideTree" : Configs.recurseGuideTree})   
+                                                    "sequencesPath" : file, "guideTree" : Configs.recurseGuideTree},
+                                                   estimateAlignmentCost(file, len(subset), mafftThreshold))   
             context.subalignmentTasks.append(subalignmentTask)
                 
     task.submitTasks(context.subalignmentTasks)
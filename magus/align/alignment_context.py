@@ -5,7 +5,7 @@ Created on Dec 4, 2020
 '''
 
 import os
-from ..helpers import sequenceutils
+from ..helpers import sequenceutils, profiler
 from ..tasks import task, manager
 from ..configuration import Configs
 
@@ -49,10 +49,13 @@ class AlignmentContext:
             os.makedirs(self.workingDir)
     
     def awaitSubalignments(self):
-        task.awaitTasks(self.subalignmentTasks)
+        with profiler.stage("subalignment wait", self.workingDir):
+            task.awaitTasks(self.subalignmentTasks)
     
     def initializeSequences(self):
         self.unalignedSequences = {}
+        self.subsets, self.subalignments = [], []
+        self.taxonSubsetMap, self.taxonSubalignmentMap = {}, {}
         for i, subsetPath in enumerate(self.subsetPaths):
             self.subsets.append([])
             subset = sequenceutils.readFromFastaOrdered(subsetPath, removeDashes=True)
@@ -82,9 +85,8 @@ class AlignmentContext:
         
         if Configs.constrain:
             for i, subalignPath in enumerate(self.subalignmentPaths):
-                subalignment = sequenceutils.readFromFasta(subalignPath, removeDashes=False)
-                for taxon in backboneSubsetTaxonMap.get(i, []):
-                    self.backboneSubalignment[taxon] = subalignment[taxon]
+                taxa = backboneSubsetTaxonMap.get(i, [])
+                self.backboneSubalignment.update(sequenceutils.readFromFastaIndexed(subalignPath, taxa))
         else:
             self.backboneSubalignment = self.unalignedSequences
     
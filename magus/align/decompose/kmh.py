@@ -90,9 +90,8 @@ def reassignTaxons(subsetsDir, subsetSeedPaths, sequences, unusedTaxa):
     for taxon, hmmPath in taxonHmmMap.items():
         subsetTaxons[hmmPath].append(taxon)
     for subsetPath, hmmPath in hmmMap.items():
-        subset = sequenceutils.readFromFasta(subsetPath)
-        for taxon in subset:
-            subsetTaxons[hmmPath].append(taxon)
+        for sequence in sequenceutils.iterateFasta(subsetPath):
+            subsetTaxons[hmmPath].append(sequence.tag)
     
     subsetPaths = []    
     i = 1
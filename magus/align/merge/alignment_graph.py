@@ -5,9 +5,13 @@ Created on Apr 14, 2020
 '''
 
 import os
+import bisect
+import numpy as np
 
 from ...helpers import sequenceutils
 from ...configuration import Configs
+from .sparse_matrix import SparseMatrix
+from . import checkpoint
 import threading
 
 
@@ -15,7 +19,12 @@ import threading
 Data structure for dealing with alignment graphs.
 Subalignment columns are mapped to graph nodes, represented by integers.
 Integer nodes can be converted back to corresponding subalignment columns.
-Reads/writes graph and cluster files.
+The graph itself is a CSR sparse matrix, and nodes map to (subalignment, position) through NumPy arrays.
+Reads/writes graph and cluster files, as text or as binary checkpoints.
+The trace methods read cross-subalignment edges through nodeEdges, a NodeEdgeIndex over the CSR arrays.
+Each node's edges are sorted by neighbor, and nodes are numbered by subalignment and position, 
+so the edges into subalignment i within [lo, hi) are a slice found by bisection, in O(log degree).
+nodeEdges[a][i] still gives the (neighbor, weight) list of node a into subalignment i.
 '''
 
 class AlignmentGraph:
@@ -26,23 +35,31 @@ class AlignmentGraph:
         self.graphPath = os.path.join(self.workingDir, "graph.txt")
         self.clusterPath = os.path.join(self.workingDir, "clusters.txt")
         self.tracePath = os.path.join(self.workingDir, "trace.txt")
+        self.graphCheckpointPath = os.path.join(self.workingDir, "graph.bin")
+        self.clusterCheckpointPath = os.path.join(self.workingDir, "clusters.bin")
+        self.traceCheckpointPath = os.path.join(self.workingDir, "trace.bin")
         if not os.path.exists(self.workingDir):
             os.makedirs(self.workingDir)
         
         self.subalignmentLengths = []
         self.subsetMatrixIdx = []
         self.matSubPosMap = []
+        self.nodeSubalignments = None
+        self.nodePositions = None
         
         self.matrixSize = 0
         self.matrix = None
         self.matrixLock = threading.Lock()
         self.nodeEdges = None
+        self.costTracker = None
         
         self.clusters = []
         self.insertions = set()
         
-    def initializeMatrix(self):
-        if Configs.constrain:
+    def initializeMatrix(self, subalignmentLengths = None):
+        if subalignmentLengths is not None:
+            self.subalignmentLengths = [int(l) for l in subalignmentLengths]
+        elif Configs.constrain:
             self.subalignmentLengths = [sequenceutils.readSequenceLengthFromFasta(file) for file in self.context.subalignmentPaths]
         else:
             self.subalignmentLengths = [len(self.context.unalignedSequences[s[0]].seq) for s in self.context.subalignments]
@@ -52,30 +69,52 @@ class AlignmentGraph:
         for k in range(1, len(self.subalignmentLengths)):        
             self.subsetMatrixIdx[k] = self.subsetMatrixIdx[k-1] + self.subalignmentLengths[k-1]
         
-        self.matSubPosMap = [0] * self.matrixSize
-        i = 0
-        for k in range(len(self.subalignmentLengths)):
-            for j in range(self.subalignmentLengths[k]):
-                self.matSubPosMap[i] = (k, j)
-                i = i + 1
+        lengths = np.array(self.subalignmentLengths, dtype = np.int64)
+        self.nodeSubalignments = np.repeat(np.arange(len(lengths), dtype = np.int32), lengths)
+        self.nodePositions = (np.arange(self.matrixSize, dtype = np.int64) - np.repeat(np.array(self.subsetMatrixIdx, dtype = np.int64), lengths)).astype(np.int32)
+        self.matSubPosMap = SubPosMap(self.subsetMatrixIdx, self.matrixSize)
         
-        self.matrix = [{} for i in range(self.matrixSize)]
+        self.matrix = SparseMatrix(self.matrixSize)
+    
+    def addEdges(self, rows, cols, weights):
+        self.matrix.addEdges(rows, cols, weights)
     
     def writeGraphToFile(self, filePath):
+        rows, cols, weights = self.matrix.getEdgeArrays()
+        chunkSize = 1000000
         with open(filePath, 'w') as textFile:
-            for i in range(len(self.matrix)):
-                for k in self.matrix[i]:
-                    textFile.write("{} {} {}\n".format(i, k, self.matrix[i][k]))
+            for i in range(0, len(rows), chunkSize):
+                chunk = np.column_stack((rows[i : i + chunkSize], cols[i : i + chunkSize], weights[i : i + chunkSize])).ravel().tolist()
+                textFile.write(("%d %d %d\n" * (len(chunk) // 3)) % tuple(chunk))
         Configs.log("Wrote matrix to {}".format(filePath))
 
     def readGraphFromFile(self, filePath):
-        self.matrix = [{} for i in range(self.matrixSize)]
-        with open(filePath) as f:
-            for line in f:
-                tokens = [int(token) for token in line.strip().split()]
-                self.matrix[tokens[0]][tokens[1]] = tokens[2]
+        self.matrix = SparseMatrix(self.matrixSize)
+        tokens = np.fromfile(filePath, dtype = np.int64, sep = " ").reshape(-1, 3)
+        self.matrix.setEdges(tokens[:, 0], tokens[:, 1], tokens[:, 2])
         Configs.log("Read matrix from {}".format(filePath))
     
+    def writeGraphCheckpoint(self, filePath):
+        indptr, indices, weights = self.matrix.getCsr()
+        arrays = {"indptr" : indptr, "indices" : indices, "weights" : weights}
+        checkpoint.writeCheckpoint(filePath, "graph", self.subalignmentLengths, arrays)
+        Configs.log("Wrote matrix checkpoint to {}".format(filePath))
+    
+    def readGraphCheckpoint(self, filePath, verify = False):
+        arrays = checkpoint.readCheckpoint(filePath, "graph", self.subalignmentLengths, verify)
+        self.matrix = SparseMatrix(self.matrixSize)
+        self.matrix.setCsr(arrays["indptr"], arrays["indices"], arrays["weights"])
+        Configs.log("Read matrix checkpoint from {}".format(filePath))
+    
+    def writeClustersCheckpoint(self, filePath):
+        arrays = checkpoint.clustersToCheckpointArrays(self.clusters)
+        checkpoint.writeCheckpoint(filePath, "clusters", self.subalignmentLengths, arrays)
+    
+    def readClustersCheckpoint(self, filePath, verify = False):
+        arrays = checkpoint.readCheckpoint(filePath, "clusters", self.subalignmentLengths, verify)
+        self.clusters = [cluster for cluster in checkpoint.checkpointArraysToClusters(arrays) if len(cluster) > 1]
+        Configs.log("Found {} clusters..".format(len(self.clusters)))
+    
     def writeClustersToFile(self, filePath):
         with open(filePath, 'w') as textFile:
             for cluster in self.clusters:
@@ -92,42 +131,36 @@ class AlignmentGraph:
     
     def buildNodeEdgeDataStructure(self):
         Configs.log("Preparing node edge data structure..")
-        k = len(self.subalignmentLengths)
-        self.nodeEdges = {}
-        
-        for a in range(self.matrixSize):
-            asub, apos = self.matSubPosMap[a]
-            self.nodeEdges[a] = [[] for i in range(k)]
-            for b, value in self.matrix[a].items():
-                bsub, bpos = self.matSubPosMap[b] 
-                if asub == bsub:
-                    continue
-                self.nodeEdges[a][bsub].append((b, value))
-            for i in range(k):
-                self.nodeEdges[a][i].sort(key = lambda pair: pair[0])
+        indptr, indices, weights = self.getCrossEdgeCsr()
+        self.nodeEdges = NodeEdgeIndex(indptr, indices, weights, self.subsetMatrixIdx, self.matrixSize)
         Configs.log("Prepared node edge data structure..")
     
     def buildNodeEdgeDataStructureFromClusters(self):
         Configs.log("Preparing node edge data structure..")
-        k = len(self.subalignmentLengths)
-        self.nodeEdges = {}
-        
         Configs.log("Using {} pre-existing clusters to simplify alignment graph..".format(len(self.clusters)))
-        for a in range(self.matrixSize):
-            self.nodeEdges[a] = [[] for i in range(k)]
         
-        for cluster in self.clusters:
-            for a in cluster:
-                asub, apos = self.matSubPosMap[a]
-                for b in cluster:
-                    bsub, bpos = self.matSubPosMap[b]
-                    if asub == bsub or b not in self.matrix[a]:
-                        continue
-                    value = self.matrix[a][b]
-                    self.nodeEdges[a][bsub].append((b, value))
-                for i in range(k):
-                    self.nodeEdges[a][i].sort(key = lambda pair: pair[0])
+        indptr, indices, weights = self.getCrossEdgeCsr()
+        rows = np.repeat(np.arange(self.matrixSize, dtype = np.int64), np.diff(indptr))
+        nodeClusters = np.full(self.matrixSize, -1, dtype = np.int64)
+        nodes, clusterIdxs = clustersToArrays(self.clusters)
+        nodeClusters[nodes] = clusterIdxs
+        keep = (nodeClusters[rows] >= 0) & (nodeClusters[rows] == nodeClusters[indices])
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows[keep], minlength = self.matrixSize)))).astype(np.int64)
+        self.nodeEdges = NodeEdgeIndex(indptr, indices[keep], weights[keep], self.subsetMatrixIdx, self.matrixSize)
         Configs.log("Prepared node edge data structure..")
+    
+    def getCrossEdgeArrays(self):
+        rows, cols, weights = self.matrix.getEdgeArrays()
+        keep = self.nodeSubalignments[rows] != self.nodeSubalignments[cols]
+        return rows[keep], cols[keep], weights[keep]
+    
+    def getCrossEdgeCsr(self):
+        indptr, indices, weights = self.matrix.getCsr()
+        rows = np.repeat(np.arange(self.matrixSize, dtype = np.int64), np.diff(indptr))
+        keep = self.nodeSubalignments[rows] != self.nodeSubalignments[indices]
+        counts = np.bincount(rows[keep], minlength = self.matrixSize)
+        crossIndptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return crossIndptr, indices[keep], weights[keep]
 
     def cutString(self, cut):
         stringCut = list(cut)
@@ -136,27 +169,16 @@ class AlignmentGraph:
         return stringCut
 
     def computeClusteringCost(self, clusters):
-        cutCost = 0
-        nodeClusters = {}
+        if self.costTracker is not None and self.costTracker.trackedClusters is clusters:
+            return self.costTracker.cost
+        nodeClusters = np.arange(self.matrixSize, dtype = np.int64) + len(clusters)
+        nodes, clusterIdxs = clustersToArrays(clusters)
+        nodeClusters[nodes] = clusterIdxs
         
-        for n, cluster in enumerate(clusters):
-            for a in cluster:
-                nodeClusters[a] = n
-                
-        clusterCounter = len(clusters)
-        for a in range(self.matrixSize):
-            if a not in nodeClusters:
-                nodeClusters[a] = clusterCounter
-                clusterCounter = clusterCounter + 1
-                 
-        for a in range(self.matrixSize):
-            asub, apos = self.matSubPosMap[a]
-            for b, value in self.matrix[a].items():
-                bsub, bpos = self.matSubPosMap[b] 
-                if asub != bsub and nodeClusters[a] != nodeClusters[b]:
-                    cutCost = cutCost + value
-    
-        return int(cutCost/2) 
+        rows, cols, weights = self.getCrossEdgeArrays()
+        cut = nodeClusters[rows] != nodeClusters[cols]
+        cutCost = int(weights[cut].sum(dtype = np.int64))
+        return cutCost // 2
     
     def addSingletonClusters(self):
         newClusters = []
@@ -175,7 +197,79 @@ class AlignmentGraph:
                 newClusters.append([node])
         self.clusters = newClusters
         return newClusters
+
+
+class SubPosMap:
+    
+    def __init__(self, subsetMatrixIdx, matrixSize):
+        self.subsetMatrixIdx = subsetMatrixIdx
+        self.matrixSize = matrixSize
+    
+    def __len__(self):
+        return self.matrixSize
+    
+    def __getitem__(self, node):
+        sub = bisect.bisect_right(self.subsetMatrixIdx, node) - 1
+        return sub, node - self.subsetMatrixIdx[sub]
+
+class NodeEdgeIndex:
+    
+    def __init__(self, indptr, indices, weights, subsetMatrixIdx, matrixSize):
+        self.indptr = indptr
+        self.indices = np.ascontiguousarray(indices)
+        self.weights = np.ascontiguousarray(weights)
+        self.subBounds = list(subsetMatrixIdx) + [matrixSize]
+        self.indptrView = memoryview(self.indptr)
+        self.indicesView = memoryview(self.indices)
+    
+    def __len__(self):
+        return self.subBounds[-1]
+    
+    def __iter__(self):
+        return iter(range(len(self)))
     
+    def __getitem__(self, node):
+        return NodeEdgeRow(self, node)
     
+    def rangeBounds(self, node, lo, hi):
+        start, end = self.indptrView[node], self.indptrView[node + 1]
+        if start == end or lo >= hi:
+            return start, start
+        first = bisect.bisect_left(self.indicesView, lo, start, end)
+        return first, bisect.bisect_left(self.indicesView, hi, first, end)
     
+    def edgesInRange(self, node, lo, hi):
+        first, last = self.rangeBounds(node, lo, hi)
+        if first == last:
+            return []
+        return list(zip(self.indices[first : last].tolist(), self.weights[first : last].tolist()))
     
+    def subalignmentEdges(self, node, i):
+        return self.edgesInRange(node, self.subBounds[i], self.subBounds[i + 1])
+    
+    def degree(self, node):
+        return self.indptrView[node + 1] - self.indptrView[node]
+    
+
+class NodeEdgeRow:
+    
+    def __init__(self, index, node):
+        self.index = index
+        self.node = node
+    
+    def __len__(self):
+        return len(self.index.subBounds) - 1
+    
+    def __iter__(self):
+        return (self.index.subalignmentEdges(self.node, i) for i in range(len(self)))
+    
+    def __getitem__(self, i):
+        return self.index.subalignmentEdges(self.node, i)
+
+def clustersToArrays(clusters):
+    sizes = [len(cluster) for cluster in clusters]
+    if sum(sizes) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    nodes = np.fromiter((a for cluster in clusters for a in cluster), dtype = np.int64, count = sum(sizes))
+    clusterIdxs = np.repeat(np.arange(len(clusters), dtype = np.int64), sizes)
+    return nodes, clusterIdxs
@@ -7,13 +7,16 @@ Created on Jan 6, 2021
 import os
 import shutil
 import heapq
+import numpy as np
 from ...configuration import Configs
 from ...helpers import sequenceutils
 from ...tasks import task
+from .alignment_graph import clustersToArrays
 
 '''
 This is where a trace is converted into a final alignment.
 If necessary, the trace is compressed first.
+The alignment is streamed to the output file one sequence at a time, and is gzip/bz2/xz compressed if the output path ends with .gz/.bz2/.xz.
 '''
 
 def writeAlignment(context):
@@ -58,21 +61,26 @@ def buildInducedSubalignment(**kwargs):
             tokens = set([int(token) for token in line.strip().split()])
             alignColumns.append(tokens) 
     
-    subsetAlign = sequenceutils.readFromFasta(subalignmentPath, removeDashes=False)
-    inducedAlign = {taxon : ['-'] * len(alignColumns) for taxon in subsetAlign}
-        
-    for idx, column in enumerate(alignColumns):
-        for taxon in subsetAlign:
-            for c in column:
-                letter = subsetAlign[taxon].seq[c]
-                if letter != '-':
-                    letter = letter.lower() if c in insertIdxs else letter
-                    assert inducedAlign[taxon][idx] == '-'
-                    inducedAlign[taxon][idx] = letter
-
-    for s in inducedAlign:
-        inducedAlign[s] = sequenceutils.Sequence(s, "".join(inducedAlign[s]))
-    sequenceutils.writeFasta(inducedAlign, tempInducedAlignPath)
+    outIdxs = np.array([idx for idx, column in enumerate(alignColumns) for c in column], dtype = np.int64)
+    subIdxs = np.array([c for column in alignColumns for c in column], dtype = np.int64)
+    inserts = np.isin(subIdxs, list(insertIdxs))
+    firstOutIdxs, firsts = np.unique(outIdxs, return_index = True)
+    extras = np.setdiff1d(np.arange(len(outIdxs)), firsts)
+    
+    index = sequenceutils.FastaIndex(subalignmentPath)
+    with sequenceutils.openTextOutput(tempInducedAlignPath) as textFile:
+        for tag in index.tags:
+            row = np.frombuffer(index.getBytes(tag), dtype = np.uint8)
+            letters = row[subIdxs]
+            letters[inserts] = sequenceutils.PackedAlignment.lowerTable[letters[inserts]]
+            
+            inducedRow = np.full(len(alignColumns), sequenceutils.PackedAlignment.gapChar, dtype = np.uint8)
+            inducedRow[firstOutIdxs] = letters[firsts]
+            for j in extras[letters[extras] != sequenceutils.PackedAlignment.gapChar].tolist():
+                assert inducedRow[outIdxs[j]] == sequenceutils.PackedAlignment.gapChar
+                inducedRow[outIdxs[j]] = letters[j]
+            textFile.write('>' + tag + '\n' + inducedRow.tobytes().decode() + '\n')
+    index.close()
     shutil.move(tempInducedAlignPath, inducedAlignPath)
     
 def writeUnpackedAlignment(context):
@@ -109,18 +117,20 @@ def writeUnpackedAlignment(context):
         
         inducedAlignPath = os.path.join(graph.workingDir, "induced_{}".format(os.path.basename(subalignPath)))
         args = {"alignmentColumnsPath" : alignmentColumnsPath, "subalignmentPath" : subalignPath, "outputFile" : inducedAlignPath}
-        inducedTask = task.Task(taskType = "buildInducedSubalignment", outputFile = args["outputFile"], taskArgs = args)
+        inducedTask = task.Task(taskType = "buildInducedSubalignment", outputFile = args["outputFile"], taskArgs = args, 
+                                cost = task.estimateFileCost(subalignPath))
         inducedSubalignTasks.append(inducedTask)
         #inducedTask.submitTask()
     
-    task.submitTasks(inducedSubalignTasks)            
-    for inducedTask in task.asCompleted(inducedSubalignTasks):
-        inducedAlign = sequenceutils.readFromFasta(inducedTask.outputFile, removeDashes=False)
-        Configs.log("Appending induced alignment, {} sequences of length {}..".format(len(inducedAlign), len(next(iter(inducedAlign.values())).seq)))
-        sequenceutils.writeFasta(inducedAlign, filePath, append = True)   
-        
-        os.remove(inducedTask.taskArgs["alignmentColumnsPath"])
-        os.remove(inducedTask.outputFile)
+    task.submitTasks(inducedSubalignTasks)
+    with sequenceutils.openTextOutput(filePath) as outputFile:
+        for inducedTask in task.asCompleted(inducedSubalignTasks):
+            Configs.log("Appending induced alignment {}..".format(inducedTask.outputFile))
+            with open(inducedTask.outputFile) as inducedFile:
+                shutil.copyfileobj(inducedFile, outputFile, sequenceutils.WRITE_BUFFER_SIZE)
+            
+            os.remove(inducedTask.taskArgs["alignmentColumnsPath"])
+            os.remove(inducedTask.outputFile)
 
     Configs.log("Wrote final alignment to {}".format(filePath))        
     #Configs.log("Wrote out {} clusters..".format(len(graph.clusters)))
@@ -137,7 +147,8 @@ def buildCompressions(context):
     for subalignPath in context.subalignmentPaths:        
         compressPath = os.path.join(context.graph.workingDir, "compression_{}".format(os.path.basename(subalignPath)))
         args = {"subalignmentPath" : subalignPath, "outputFile" : compressPath}
-        compressionTask = task.Task(taskType = "compressSubalignment", outputFile = args["outputFile"], taskArgs = args)
+        compressionTask = task.Task(taskType = "compressSubalignment", outputFile = args["outputFile"], taskArgs = args, 
+                                    cost = task.estimateFileCost(subalignPath))
         compressionTasks.append(compressionTask)
     task.submitTasks(compressionTasks)
     
@@ -352,25 +363,15 @@ def compressSubalignment(**kwargs):
     outputPath = kwargs["outputFile"]
     tempOutputPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     
-    subsetAlign = sequenceutils.readFromFasta(subalignmentPath, removeDashes=False)
-    subsetLen = len(next(iter(subsetAlign.values())).seq)
+    subsetAlign = sequenceutils.PackedAlignment.fromFasta(subalignmentPath)
+    numLetters = subsetAlign.letterCounts().tolist()
     
-    numLetters = []    
-    compressions = []
-    lastIdx = {s : -1 for s in subsetAlign} 
-    for i in range(subsetLen):
-        notGaps = []
-        for s,v in subsetAlign.items():
-            if v.seq[i] != '-':
-                notGaps.append(s) 
-        
-        numLetters.append(len(notGaps))
-        dest = set()
-        for s in notGaps:
-            if lastIdx[s] != -1:
-                dest.add(lastIdx[s])
-            lastIdx[s] = i
-        compressions.append(dest)
+    taxa, columns = np.nonzero(~subsetAlign.gapMask())
+    sameTaxon = taxa[1:] == taxa[:-1]
+    pairs = np.unique(columns[1:][sameTaxon] * subsetAlign.numColumns() + columns[:-1][sameTaxon])
+    compressions = [[] for i in range(subsetAlign.numColumns())]
+    for c, dest in zip((pairs // subsetAlign.numColumns()).tolist(), (pairs % subsetAlign.numColumns()).tolist()):
+        compressions[c].append(dest)
             
     with open(tempOutputPath, 'w') as textFile:
         textFile.write("{}\n".format(" ".join([str(c) for c in numLetters])))
@@ -380,20 +381,17 @@ def compressSubalignment(**kwargs):
 
 def writeUnconstrainedAlignment(context):
     graph = context.graph
-    alignment = {}
-    for taxon in context.unalignedSequences:            
-        alignment[taxon] = sequenceutils.Sequence(taxon, ['-'] * len(graph.clusters))
-
-    curIdxes = {taxon : 0 for taxon in context.unalignedSequences}
-    for idx, cluster in enumerate(graph.clusters):
-        for b in cluster:
-            bsub, bpos = graph.matSubPosMap[b]
-            taxon = context.subalignments[bsub][0]
-            alignment[taxon].seq[idx] = context.unalignedSequences[taxon].seq[curIdxes[taxon]]
-            curIdxes[taxon] = curIdxes[taxon] + 1
-
-    for taxon in alignment:
-        alignment[taxon].seq = "".join(alignment[taxon].seq)   
-                            
-    sequenceutils.writeFasta(alignment, context.outputFile)  
+    nodes, clusterIdxs = clustersToArrays(graph.clusters)
+    nodeSubs = graph.nodeSubalignments[nodes]
+    order = np.argsort(nodeSubs, kind = "stable")
+    subStarts = np.searchsorted(nodeSubs[order], np.arange(len(context.subalignments) + 1))
+    
+    with sequenceutils.openTextOutput(context.outputFile) as textFile:
+        for bsub, subalignment in enumerate(context.subalignments):
+            taxon = subalignment[0]
+            columns = clusterIdxs[order[subStarts[bsub] : subStarts[bsub + 1]]]
+            letters = np.frombuffer(context.unalignedSequences[taxon].seq.encode(), dtype = np.uint8)
+            row = np.full(len(graph.clusters), sequenceutils.PackedAlignment.gapChar, dtype = np.uint8)
+            row[columns] = letters[:len(columns)]
+            textFile.write('>' + taxon + '\n' + row.tobytes().decode() + '\n')
     Configs.log("Wrote final alignment to {}".format(context.outputFile)) 
@@ -0,0 +1,91 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import json
+import zlib
+import numpy as np
+
+'''
+Binary checkpoints for the alignment graph, clusters and trace.
+A checkpoint file is a magic string, a JSON header and a sequence of raw 64-byte aligned arrays.
+The header holds the subalignment lengths, the array layout and a CRC32 checksum of the array data.
+Arrays are memory-mapped on load, so a large graph can be resumed without parsing anything.
+The checksum reads every array, so it is only checked when asked for (verify = True), e.g. before the add-sequences mode rewrites a run.
+Graphs are stored as CSR arrays, cluster lists as (clusterPtr, nodes) arrays.
+'''
+
+MAGIC = b"MAGUSCKP"
+VERSION = 1
+ALIGNMENT = 64
+
+def writeCheckpoint(filePath, kind, subalignmentLengths, arrays):
+    arrays = {name : np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    checksum = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype" : array.dtype.str, "shape" : list(array.shape), "offset" : offset}
+        offset = offset + padLength(array.nbytes)
+        checksum = zlib.crc32(memoryview(array).cast("B"), checksum)
+
+    header = {"version" : VERSION, "kind" : kind, "subalignmentLengths" : [int(l) for l in subalignmentLengths],
+              "arrays" : layout, "checksum" : checksum}
+    headerBytes = json.dumps(header).encode()
+    headerBytes = headerBytes + b" " * (padLength(len(MAGIC) + 8 + len(headerBytes)) - len(MAGIC) - 8 - len(headerBytes))
+
+    tempPath = filePath + ".tmp"
+    with open(tempPath, 'wb') as file:
+        file.write(MAGIC)
+        file.write(np.uint64(len(headerBytes)).tobytes())
+        file.write(headerBytes)
+        for name, array in arrays.items():
+            file.write(memoryview(array).cast("B"))
+            file.write(b"\0" * (padLength(array.nbytes) - array.nbytes))
+    os.replace(tempPath, filePath)
+
+def readCheckpoint(filePath, kind, subalignmentLengths, verify = False):
+    with open(filePath, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise Exception("{} is not a MAGUS checkpoint file".format(filePath))
+        headerLength = int(np.frombuffer(file.read(8), dtype = np.uint64)[0])
+        header = json.loads(file.read(headerLength).decode())
+    dataOffset = len(MAGIC) + 8 + headerLength
+
+    if header["version"] != VERSION or header["kind"] != kind:
+        raise Exception("Checkpoint {} has version {} and kind {}, expected version {} and kind {}".format(
+            filePath, header["version"], header["kind"], VERSION, kind))
+    if header["subalignmentLengths"] != [int(l) for l in subalignmentLengths]:
+        raise Exception("Checkpoint {} was written for different subalignments".format(filePath))
+
+    arrays = {}
+    checksum = 0
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        if int(np.prod(shape)) == 0:
+            array = np.zeros(shape, dtype = np.dtype(entry["dtype"]))
+        else:
+            array = np.memmap(filePath, dtype = np.dtype(entry["dtype"]), mode = 'r', offset = dataOffset + entry["offset"], shape = shape)
+        if verify:
+            checksum = zlib.crc32(memoryview(array).cast("B"), checksum)
+        arrays[name] = array
+
+    if verify and checksum != header["checksum"]:
+        raise Exception("Checkpoint {} failed its checksum, the file may be corrupted".format(filePath))
+    return arrays
+
+def clustersToCheckpointArrays(clusters):
+    sizes = np.array([len(cluster) for cluster in clusters], dtype = np.int64)
+    clusterPtr = np.zeros(len(clusters) + 1, dtype = np.int64)
+    np.cumsum(sizes, out = clusterPtr[1:])
+    nodes = np.fromiter((a for cluster in clusters for a in cluster), dtype = np.int64, count = int(clusterPtr[-1]))
+    return {"clusterPtr" : clusterPtr, "nodes" : nodes}
+
+def checkpointArraysToClusters(arrays):
+    nodes = np.asarray(arrays["nodes"]).tolist()
+    clusterPtr = np.asarray(arrays["clusterPtr"]).tolist()
+    return [nodes[clusterPtr[i] : clusterPtr[i+1]] for i in range(len(clusterPtr) - 1)]
+
+def padLength(length):
+    return (length + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,55 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import numpy as np
+
+from .alignment_graph import clustersToArrays
+
+'''
+Incremental tracking of the clustering (MWT) cost, the total weight of the cross-subalignment edges cut by a clustering.
+The full cost is computed once, then every node move or cluster split updates it in O(degree) of the moved nodes.
+Node -> cluster assignments are kept in an array; nodes outside of the clusters are singletons, with ids -1-node.
+Cluster ids are whatever the caller uses (e.g. cluster indices), newCluster() hands out unused ones.
+A tracker left in graph.costTracker, with trackedClusters set to the finished cluster list, 
+answers graph.computeClusteringCost for that list without another full scan.
+'''
+
+class ClusteringCostTracker:
+
+    def __init__(self, graph, clusters):
+        self.indptr, self.indices, self.weights = graph.getCrossEdgeCsr()
+        self.nodeClusters = -1 - np.arange(graph.matrixSize, dtype = np.int64)
+        nodes, clusterIdxs = clustersToArrays(clusters)
+        self.nodeClusters[nodes] = clusterIdxs
+        self.nextCluster = len(clusters)
+        self.trackedClusters = None
+
+        rows = np.repeat(np.arange(graph.matrixSize, dtype = np.int64), np.diff(self.indptr))
+        cut = self.nodeClusters[rows] != self.nodeClusters[self.indices]
+        self.cost = int(self.weights[cut].sum(dtype = np.int64)) // 2
+
+    def newCluster(self):
+        self.nextCluster = self.nextCluster + 1
+        return self.nextCluster - 1
+
+    def moveNode(self, node, dest):
+        src = self.nodeClusters[node]
+        if src == dest:
+            return
+        start, end = self.indptr[node], self.indptr[node + 1]
+        nbrClusters = self.nodeClusters[self.indices[start : end]]
+        weights = self.weights[start : end]
+        self.cost = self.cost + int(weights[nbrClusters == src].sum()) - int(weights[nbrClusters == dest].sum())
+        self.nodeClusters[node] = dest
+        if dest >= self.nextCluster:
+            self.nextCluster = dest + 1
+
+    def moveNodes(self, nodes, dest):
+        for node in nodes:
+            self.moveNode(node, dest)
+
+    def splitCluster(self, nodes):
+        dest = self.newCluster()
+        self.moveNodes(nodes, dest)
+        return dest
@@ -7,29 +7,41 @@ Created on Apr 14, 2020
 import os
 import time
 import random
+import multiprocessing
+import concurrent.futures
+import numpy as np
 
 from ..alignment_graph import AlignmentGraph
+from ..sparse_matrix import sumDuplicateEdges
+from .. import shared_arrays
 from ....helpers import sequenceutils, hmmutils
 from ....tasks import task
-from ....configuration import Configs
+from ....configuration import Configs, configsSnapshot, initializeWorker
 from ....tools import external_tools
 
 '''
 Building a MAGUS alignment graph from backbone alignments. 
-The graph is a sparse matrix, stored as a weighted adjacency list.
+The graph is a sparse matrix, stored in compressed sparse row (CSR) form.
 Backbone alignment tasks are run in parallel, and can begin before the subalignments are finished.
 When subalignments finish, we can initialize the alignment graph. 
 Backbones are added to this graph as they complete.
-Graph is written to file in MCL-compliant format.
+Each backbone taxon's residues are mapped to graph nodes once, into flat arrays (BackboneMapping), and every backbone reuses them.
+With multiple cores and enough backbone data (see PARALLEL_BUILD_MIN_BYTES), worker processes turn backbones into partial graphs.
+The workers read the mapping arrays from shared memory, and their partial graphs are merged into the matrix as they arrive.
+Graph is checkpointed in a binary CSR format, the MCL-compliant text format is only written when MCL needs it.
 '''
 
+PARALLEL_BUILD_MIN_BYTES = 20000000
+
 def buildGraph(context):
     time1 = time.time() 
     
     context.graph = AlignmentGraph(context)
     context.initializeSequences()
     
-    if os.path.exists(context.graph.graphPath):
+    if os.path.exists(context.graph.graphCheckpointPath):
+        Configs.log("Found existing graph checkpoint {}".format(context.graph.graphCheckpointPath))
+    elif os.path.exists(context.graph.graphPath):
         Configs.log("Found existing graph file {}".format(context.graph.graphPath))
     else:
         requestBackboneTasks(context)
@@ -37,12 +49,15 @@ def buildGraph(context):
     context.awaitSubalignments()
     context.graph.initializeMatrix()
     
-    if os.path.exists(context.graph.graphPath):
+    if os.path.exists(context.graph.graphCheckpointPath):
+        context.graph.readGraphCheckpoint(context.graph.graphCheckpointPath)
+    elif os.path.exists(context.graph.graphPath):
         context.graph.readGraphFromFile(context.graph.graphPath)
+        context.graph.writeGraphCheckpoint(context.graph.graphCheckpointPath)
     else:
         context.initializeBackboneSequenceMapping()
         buildMatrix(context)
-        context.graph.writeGraphToFile(context.graph.graphPath)
+        context.graph.writeGraphCheckpoint(context.graph.graphCheckpointPath)
        
     time2 = time.time()
     Configs.log("Built the alignment graph in {} sec..".format(time2-time1))
@@ -93,15 +108,52 @@ def requestMafftBackbones(context):
     task.submitTasks(context.backboneTasks)    
                 
 def buildMatrix(context):
+    backboneFiles = [backboneTask.outputFile for backboneTask in context.backboneTasks]
+    backboneFiles = backboneFiles + [f for f in context.backbonePaths if f not in set(backboneFiles)]
+    mapping = BackboneMapping.fromContext(context)
+    numWorkers = min(Configs.numCores, len(backboneFiles))
+    if numWorkers <= 1 or not shared_arrays.available() or estimateBackboneBytes(context) < PARALLEL_BUILD_MIN_BYTES:
+        for backboneFile in iterateBackbones(context):
+            addAlignmentFileToGraph(context, mapping, backboneFile)
+        return
+    
+    Configs.log("Feeding {} backbones to the graph with {} worker processes..".format(len(backboneFiles), numWorkers))
+    blocks, specs = shared_arrays.shareArrays(mapping.arrays())
+    mappingInfo = (mapping.taxa, mapping.matrixSize, mapping.restrict, specs)
+    try:
+        mpContext = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers = numWorkers, mp_context = mpContext, 
+                                                    initializer = initializeBuildWorker, initargs = (configsSnapshot(), mappingInfo)) as pool:
+            futures = []
+            for backboneFile in iterateBackbones(context):
+                extensionFiles = extendBackbone(context, backboneFile)
+                futures.append(pool.submit(buildPartialGraph, None, backboneFile, extensionFiles))
+            for future in concurrent.futures.as_completed(futures):
+                rows, cols, weights = future.result()
+                with context.graph.matrixLock:
+                    context.graph.addEdges(rows, cols, weights)
+    finally:
+        shared_arrays.releaseArrays(blocks)
+    Configs.log("Fed {} backbones to the graph.".format(len(futures)))
+
+def estimateBackboneBytes(context):
+    taskFiles = set(backboneTask.outputFile for backboneTask in context.backboneTasks)
+    numBytes = sum(backboneTask.cost for backboneTask in context.backboneTasks)
+    numBytes = numBytes + task.estimateFileCost(*[f for f in context.backbonePaths if f not in taskFiles])
+    if len(context.backboneExtend) > 0:
+        numBytes = numBytes + len(context.backboneExtend) * sum(len(sequence.seq) for sequence in context.unalignedSequences.values())
+    return numBytes
+
+def iterateBackbones(context):
     addedBackbones = set()
     for backboneTask in task.asCompleted(context.backboneTasks):
-        addAlignmentFileToGraph(context, backboneTask.outputFile)
         addedBackbones.add(backboneTask.outputFile)
+        yield backboneTask.outputFile
     
     for backboneFile in context.backbonePaths:
         if backboneFile not in addedBackbones:
-            addAlignmentFileToGraph(context, backboneFile)  
-    
+            yield backboneFile
+
 def assignBackboneTaxa(context, numTaxa, unalignedFile):
     backbone = {}
     for subset in context.subsets:
@@ -111,70 +163,107 @@ def assignBackboneTaxa(context, numTaxa, unalignedFile):
     sequenceutils.writeFasta(backbone, unalignedFile)
     return backbone
     
-def addAlignmentFileToGraph(context, alignedFile):
+def addAlignmentFileToGraph(context, mapping, alignedFile):
     Configs.log("Feeding backbone {} to the graph..".format(alignedFile))
-    backboneAlign = sequenceutils.readFromFasta(alignedFile)  
-    alignmentLength = len(next(iter(backboneAlign.values())).seq)
-     
-    if alignedFile in context.backboneExtend:
-        extensionTasks = requestHmmExtensionTasks(context, backboneAlign, alignedFile)
-        task.submitTasks(extensionTasks)
-        for extensionTask in task.asCompleted(extensionTasks):
-            backboneAlign.update(sequenceutils.readFromStockholm(extensionTask.outputFile, includeInsertions=True))
-    
-    alignmap = backboneToAlignMap(context, backboneAlign, alignmentLength)
-    Configs.log("Constructed backbone alignment map from {}".format(alignedFile))
-    
-    graph = context.graph  
+    extensionFiles = extendBackbone(context, alignedFile)
+    rows, cols, weights = buildPartialGraph(mapping, alignedFile, extensionFiles)
+    
+    graph = context.graph
     with graph.matrixLock:
-        for l in range(alignmentLength):  
-            for a, avalue in alignmap[l].items():
-                for b, bvalue in alignmap[l].items():
-                    
-                    if Configs.graphBuildRestrict:
-                        asub, apos = graph.matSubPosMap[a] 
-                        bsub, bpos = graph.matSubPosMap[b] 
-                        if asub == bsub and apos != bpos:
-                            continue
-                                
-                    graph.matrix[a][b] = graph.matrix[a].get(b,0) + avalue * bvalue         
+        graph.addEdges(rows, cols, weights)
     Configs.log("Fed backbone {} to the graph.".format(alignedFile))
 
-def backboneToAlignMap(context, backboneAlign, alignmentLength):
-    alignmap = [{} for i in range(alignmentLength)]
-    t = 0
+def extendBackbone(context, alignedFile):
+    if alignedFile not in context.backboneExtend:
+        return []
+    backboneAlign = sequenceutils.readFromFasta(alignedFile)
+    extensionTasks = requestHmmExtensionTasks(context, backboneAlign, alignedFile)
+    task.submitTasks(extensionTasks)
+    task.awaitTasks(extensionTasks)
+    return [extensionTask.outputFile for extensionTask in extensionTasks]
+
+def initializeBuildWorker(configs, mappingInfo):
+    global workerMapping
+    initializeWorker(configs)
+    workerMapping = BackboneMapping.fromSharedArrays(*mappingInfo)
+
+def buildPartialGraph(mapping, alignedFile, extensionFiles):
+    mapping = workerMapping if mapping is None else mapping
+    backboneAlign = sequenceutils.readFromFasta(alignedFile)
+    for extensionFile in extensionFiles:
+        backboneAlign.update(sequenceutils.readFromStockholm(extensionFile, includeInsertions=True))
+    
+    columns, nodes = backboneToPositionArrays(mapping, backboneAlign)
+    return columnPositionsToEdges(mapping, columns, nodes)
+
+def backboneToPositionArrays(mapping, backboneAlign):
+    columnArrays, nodeArrays = [], []
     
     for taxon in backboneAlign:
-        subsetIdx = context.taxonSubalignmentMap[taxon]
-        subsetseq = context.backboneSubalignment[taxon].seq
-        unalignedseq = context.unalignedSequences[taxon].seq     
+        i = mapping.taxonIdxs[taxon]
+        unaligned = mapping.letters[mapping.offsets[i] : mapping.offsets[i+1]]
+        taxonNodes = mapping.nodes[mapping.offsets[i] : mapping.offsets[i+1]]
         backboneseq = backboneAlign[taxon].seq   
         
-        i = 0
-        posarray = [0] * len(unalignedseq)
-        for n in range(len(subsetseq)):
-            if subsetseq[n] == unalignedseq[i]:
-                posarray[i] = n 
-                i = i + 1
-                if i == len(unalignedseq):
-                    break
+        backbone = np.frombuffer(backboneseq.encode(), dtype = np.uint8)
+        upper = np.frombuffer(backboneseq.upper().encode(), dtype = np.uint8)
         
-        i = 0
-        n = 0
-        for c in backboneseq:
+        residues = (upper != ord('-')) & (upper != ord('.'))
+        residueIdxs = np.cumsum(residues) - 1
+        columnIdxs = np.cumsum((backbone == upper) & (backbone != ord('.'))) - 1
+        residues = residues & (residueIdxs < len(unaligned))
+        
+        chars = backbone[residues]
+        idxs = residueIdxs[residues]
+        matched = chars == unaligned[idxs]
+        columnArrays.append(columnIdxs[residues][matched])
+        nodeArrays.append(taxonNodes[idxs[matched]])
+    
+    if len(columnArrays) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    return np.concatenate(columnArrays).astype(np.int64), np.concatenate(nodeArrays).astype(np.int64)
+
+def subalignmentPositions(subsetseq, unalignedseq):
+    subset = np.frombuffer(subsetseq.encode(), dtype = np.uint8)
+    unaligned = np.frombuffer(unalignedseq.encode(), dtype = np.uint8)
+    if len(subset) == len(unaligned) and np.array_equal(subset, unaligned):
+        return np.arange(len(unaligned), dtype = np.int64)
+    
+    posarray = np.flatnonzero(subset != ord('-'))
+    if len(posarray) == len(unaligned) and np.array_equal(subset[posarray], unaligned):
+        return posarray
+    
+    i = 0
+    posarray = [0] * len(unalignedseq)
+    for n in range(len(subsetseq)):
+        if subsetseq[n] == unalignedseq[i]:
+            posarray[i] = n 
+            i = i + 1
             if i == len(unalignedseq):
                 break
-            if c == unalignedseq[i]:
-                position = int(context.graph.subsetMatrixIdx[subsetIdx] + posarray[i])
-                alignmap[n][position] = alignmap[n].get(position, 0) + 1
-            if c.upper() == unalignedseq[i]:
-                i = i + 1
-            if c == c.upper() and c != '.':
-                n = n + 1
-                
-        t = t + 1
-            
-    return alignmap
+    return np.array(posarray, dtype = np.int64)
+
+def columnPositionsToEdges(mapping, columns, nodes):
+    if len(nodes) == 0:
+        empty = np.zeros(0, dtype = np.int64)
+        return empty, empty, empty
+    
+    keys, counts = np.unique(columns * mapping.matrixSize + nodes, return_counts = True)
+    columns, nodes = keys // mapping.matrixSize, keys % mapping.matrixSize
+    starts = np.flatnonzero(np.concatenate(([True], columns[1:] != columns[:-1])))
+    sizes = np.diff(np.append(starts, len(columns)))
+    
+    entrySizes = np.repeat(sizes, sizes)
+    entryStarts = np.repeat(starts, sizes)
+    rowIdxs = np.repeat(np.arange(len(nodes)), entrySizes)
+    blockStarts = np.repeat(np.cumsum(entrySizes) - entrySizes, entrySizes)
+    colIdxs = np.repeat(entryStarts, entrySizes) + np.arange(len(rowIdxs)) - blockStarts
+    
+    rows, cols, weights = nodes[rowIdxs], nodes[colIdxs], counts[rowIdxs] * counts[colIdxs]
+    if mapping.restrict:
+        keep = (mapping.nodeSubalignments[rows] != mapping.nodeSubalignments[cols]) | (rows == cols)
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    return sumDuplicateEdges(rows, cols, weights, mapping.matrixSize)
         
 def requestHmmExtensionTasks(context, backbone, alignedFile):
     baseName = os.path.basename(alignedFile)
@@ -193,5 +282,43 @@ def requestHmmExtensionTasks(context, backbone, alignedFile):
     buildTask = hmmutils.buildHmmOverAlignment(alignedFile, hmmPath)
     buildTask.run()
     alignTasks = hmmutils.hmmAlignQueries(hmmPath, extensionUnalignedFile)
-    return alignTasks 
+    return alignTasks
+
+
+class BackboneMapping:
+    
+    def __init__(self, taxa, offsets, nodes, letters, nodeSubalignments, matrixSize, restrict):
+        self.taxa = taxa
+        self.taxonIdxs = {taxon : i for i, taxon in enumerate(taxa)}
+        self.offsets = offsets
+        self.nodes = nodes
+        self.letters = letters
+        self.nodeSubalignments = nodeSubalignments
+        self.matrixSize = matrixSize
+        self.restrict = restrict
     
+    @staticmethod
+    def fromContext(context):
+        taxa = list(context.backboneSubalignment)
+        offsets = np.zeros(len(taxa) + 1, dtype = np.int64)
+        nodeArrays, letterArrays = [np.zeros(0, dtype = np.int64)], [np.zeros(0, dtype = np.uint8)]
+        for i, taxon in enumerate(taxa):
+            unalignedseq = context.unalignedSequences[taxon].seq
+            posarray = subalignmentPositions(context.backboneSubalignment[taxon].seq, unalignedseq)
+            nodeArrays.append(context.graph.subsetMatrixIdx[context.taxonSubalignmentMap[taxon]] + posarray)
+            letterArrays.append(np.frombuffer(unalignedseq.encode(), dtype = np.uint8))
+            offsets[i+1] = offsets[i] + len(unalignedseq)
+        return BackboneMapping(taxa, offsets, np.concatenate(nodeArrays).astype(np.int64), np.concatenate(letterArrays), 
+                               context.graph.nodeSubalignments, context.graph.matrixSize, Configs.graphBuildRestrict)
+    
+    @staticmethod
+    def fromSharedArrays(taxa, matrixSize, restrict, specs):
+        blocks, arrays = shared_arrays.attachArrays(specs)
+        mapping = BackboneMapping(taxa, *arrays, matrixSize, restrict)
+        mapping.blocks = blocks
+        return mapping
+    
+    def arrays(self):
+        return [self.offsets, self.nodes, self.letters, self.nodeSubalignments]
+
+workerMapping = None
@@ -4,7 +4,23 @@ Created on Aug 23, 2020
 @author: Vlad
 '''
 
+import concurrent.futures
+import numpy as np
+
 from ....configuration import Configs
+from ..alignment_graph import clustersToArrays
+
+'''
+Cleaning up clusters before tracing: dropping duplicate clusters, and resolving "violations".
+A cluster violates the trace constraints if it holds two columns from the same subalignment (column violation),
+and a column violates them if it sits in more than one cluster (row violation).
+Each element (cluster, column) is scored by its edge weight into the rest of its cluster, 
+and the weakest violating elements are removed first, until no violations are left.
+Elements are handled as flat arrays: scores come from CSR lookups over chunks of elements, scored in parallel,
+and only elements that start out in a violation are ever considered for removal.
+'''
+
+SCORE_CHUNK_EDGES = 4000000
 
 def purgeDuplicateClusters(graph):
     uniqueClusters = set()
@@ -19,40 +35,53 @@ def purgeDuplicateClusters(graph):
     Configs.log("Purged duplicate clusters. Found {} unique clusters..".format(len(graph.clusters)))
 
 def purgeClusterViolations(graph):
-    redundantCols = {}
-    redundantRows = {}
-    elementScores = {}
-    for a, cluster in enumerate(graph.clusters):
-        for b in cluster:
-            bsub, bpos = graph.matSubPosMap[b] 
-            redundantCols[a, bsub] = redundantCols.get((a, bsub), []) + [(a, b)] 
-            redundantRows[b] = redundantRows.get(b, []) + [(a, b)]
-            
-            scoresum = 0
-            for c in cluster:
-                csub, cpos = graph.matSubPosMap[c]
-                if bsub != csub:
-                    scoresum  = scoresum  + graph.matrix[b].get(c,0)
-            elementScores[a, b] = scoresum 
+    nodes, clusterIdxs = clustersToArrays(graph.clusters)
+    k = len(graph.subalignmentLengths)
+    colIdxs, colCounts = np.unique(clusterIdxs * k + graph.nodeSubalignments[nodes], return_inverse = True, return_counts = True)[1:]
+    rowCounts = np.bincount(nodes, minlength = graph.matrixSize)
+    Configs.log("Found {} row violations and {} column violations..".format(np.count_nonzero(rowCounts > 1), np.count_nonzero(colCounts > 1)))
     
-    problemCols = [(a,b) for a,b in redundantCols if len(redundantCols[a,b]) > 1]
-    problemRows = [a for a in redundantRows if len(redundantRows[a]) > 1]
-    Configs.log("Found {} row violations and {} column violations..".format(len(problemRows), len(problemCols)))
+    scores = computeElementScores(graph, nodes, clusterIdxs)
+    order = np.argsort(scores, kind = "stable")
+    violating = (colCounts[colIdxs] > 1) | (rowCounts[nodes] > 1)
+    keep = np.ones(len(nodes), dtype = bool)
+    colCounts, rowCounts = colCounts.tolist(), rowCounts.tolist()
+    candidates = order[violating[order]]
+    for e, c, b in zip(candidates.tolist(), colIdxs[candidates].tolist(), nodes[candidates].tolist()):
+        if colCounts[c] > 1 or rowCounts[b] > 1:
+            keep[e] = False
+            colCounts[c] = colCounts[c] - 1
+            rowCounts[b] = rowCounts[b] - 1
     
-    sortedScores = list(elementScores.keys())
-    sortedScores.sort(key = lambda x : elementScores[x])
+    Configs.log("Finished violations sweep. Now {} row violations and {} column violations..".format(sum(1 for r in rowCounts if r > 1), sum(1 for c in colCounts if c > 1)))
     
-    for a,b in sortedScores:
-        bsub, bpos = graph.matSubPosMap[b] 
-        if len(redundantCols[a, bsub]) > 1 or len(redundantRows[b]) > 1:
-            graph.clusters[a].remove(b)
-            redundantCols[a, bsub].remove((a,b))
-            redundantRows[b].remove((a,b))                
-    
-    problemCols = [(a,b) for a,b in redundantCols if len(redundantCols[a,b]) > 1]
-    problemRows = [a for a in redundantRows if len(redundantRows[a]) > 1]
-    Configs.log("Finished violations sweep. Now {} row violations and {} column violations..".format(len(problemRows), len(problemCols)))
-    
-    graph.clusters = [cluster for cluster in graph.clusters if len(cluster) > 1]
+    sizes = np.bincount(clusterIdxs[keep], minlength = len(graph.clusters))
+    clusters = np.split(nodes[keep], np.cumsum(sizes)[:-1]) if len(graph.clusters) > 0 else []
+    graph.clusters = [cluster.tolist() for cluster in clusters if len(cluster) > 1]
     Configs.log("Purged cluster violations. Found {} clean clusters..".format(len(graph.clusters)))
+
+def computeElementScores(graph, nodes, clusterIdxs):
+    indptr, indices, weights = graph.matrix.getCsr()
+    memberKeys = np.sort(clusterIdxs * graph.matrixSize + nodes)
+    degrees = indptr[nodes + 1] - indptr[nodes]
+    edgeCounts = np.cumsum(degrees)
+    bounds = np.searchsorted(edgeCounts, np.arange(SCORE_CHUNK_EDGES, edgeCounts[-1] if len(nodes) > 0 else 0, SCORE_CHUNK_EDGES))
+    chunks = list(zip(np.concatenate(([0], bounds)).tolist(), np.concatenate((bounds, [len(nodes)])).tolist()))
+    
+    def scoreChunk(chunk):
+        start, end = chunk
+        chunkDegrees = degrees[start : end]
+        elements = np.repeat(np.arange(start, end), chunkDegrees)
+        offsets = np.arange(len(elements)) - np.repeat(np.cumsum(chunkDegrees) - chunkDegrees, chunkDegrees)
+        edges = np.repeat(indptr[nodes[start : end]], chunkDegrees) + offsets
+        nbrs = indices[edges]
+        nbrKeys = clusterIdxs[elements] * graph.matrixSize + nbrs
+        found = np.minimum(np.searchsorted(memberKeys, nbrKeys), len(memberKeys) - 1)
+        counted = (memberKeys[found] == nbrKeys) & (graph.nodeSubalignments[nbrs] != graph.nodeSubalignments[nodes[elements]])
+        return np.bincount(elements[counted] - start, weights = weights[edges[counted]], minlength = end - start)
     
+    scores = np.zeros(len(nodes), dtype = np.int64)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, Configs.numCores)) as pool:
+        for (start, end), chunkScores in zip(chunks, pool.map(scoreChunk, chunks)):
+            scores[start : end] = np.rint(chunkScores).astype(np.int64)
+    return scores
@@ -10,29 +10,42 @@ import time
 from ....configuration import Configs
 
 from .mcl import runMclClustering
+from .mcl_native import runNativeMclClustering
+from .mcl_windowed import runWindowedMclClustering
 from .mlr_mcl import runMlrMclClustering
 from .rg import rgClustering
 
 '''
 The alignment graph is clustered, the clusters are written out as an array of node arrays.
 MCL is the main way to do this, but rg could be used if there are scalability issues.
+mclnative runs MCL in-process on the sparse graph, without the text graph or the mcl binary.
+mclwindowed runs it on overlapping windows of the graph, for long alignments.
 '''
 
 def clusterGraph(graph):
     time1 = time.time()
     
-    if os.path.exists(graph.clusterPath):
+    if os.path.exists(graph.clusterCheckpointPath):
+        Configs.log("Found existing cluster checkpoint {}".format(graph.clusterCheckpointPath))
+        graph.readClustersCheckpoint(graph.clusterCheckpointPath)
+    
+    elif os.path.exists(graph.clusterPath):
         Configs.log("Found existing cluster file {}".format(graph.clusterPath))
         graph.readClustersFromFile(graph.clusterPath)
+        graph.writeClustersCheckpoint(graph.clusterCheckpointPath)
         
-    elif Configs.graphClusterMethod == "mcl":
-        runMclClustering(graph)      
-        
-    elif Configs.graphClusterMethod == "mlrmcl":
-        runMlrMclClustering(graph)
-        
-    elif Configs.graphClusterMethod == "rg":
-        rgClustering(graph)
+    elif Configs.graphClusterMethod in ("mcl", "mclnative", "mclwindowed", "mlrmcl", "rg"):
+        if Configs.graphClusterMethod == "mcl":
+            runMclClustering(graph)      
+        elif Configs.graphClusterMethod == "mclnative":
+            runNativeMclClustering(graph)
+        elif Configs.graphClusterMethod == "mclwindowed":
+            runWindowedMclClustering(graph)
+        elif Configs.graphClusterMethod == "mlrmcl":
+            runMlrMclClustering(graph)
+        elif Configs.graphClusterMethod == "rg":
+            rgClustering(graph)
+        graph.writeClustersCheckpoint(graph.clusterCheckpointPath)
         
     else:
         Configs.log("No alignment graph clustering requested..")
@@ -4,12 +4,16 @@ Created on Apr 14, 2020
 @author: Vlad
 '''
 
+import os
+
 from ....configuration import Configs
 from ....tools import external_tools
 
 
 def runMclClustering(graph):  
     Configs.log("Running MCL alignment graph clustering..")
+    if not os.path.exists(graph.graphPath):
+        graph.writeGraphToFile(graph.graphPath)
     external_tools.runMcl(graph.graphPath, Configs.mclInflationFactor, graph.workingDir, graph.clusterPath).run()
     graph.readClustersFromFile(graph.clusterPath)
     
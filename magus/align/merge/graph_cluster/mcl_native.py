@@ -0,0 +1,120 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import concurrent.futures
+import numpy as np
+
+from ....configuration import Configs
+
+try:
+    import scipy.sparse
+    from scipy.sparse import csgraph
+except ImportError:
+    scipy = None
+
+'''
+In-process Markov clustering, run directly on the alignment graph's CSR arrays.
+Avoids writing the graph as text, calling the mcl binary and parsing its output.
+We keep the transposed (row-stochastic) matrix, since the graph is symmetric.
+Each iteration expands with a threaded sparse multiply over row blocks, pruning each block as it is computed to bound memory,
+then inflates with Configs.mclInflationFactor.
+Needs SciPy for the sparse matrix products.
+'''
+
+PRUNE_THRESHOLD = 1.0 / 4000
+PRUNE_SELECTION = 500
+CHAOS_THRESHOLD = 0.001
+MAX_ITERATIONS = 100
+BLOCK_NONZEROS = 1000000
+
+def runNativeMclClustering(graph):
+    Configs.log("Running native MCL alignment graph clustering..")
+    if scipy is None:
+        raise Exception("Native MCL clustering requires SciPy, please install it or use --graphclustermethod mcl")
+
+    indptr, indices, weights = graph.matrix.getCsr()
+    matrix = scipy.sparse.csr_matrix((np.array(weights, dtype = np.float64), np.array(indices), np.array(indptr)),
+                                     shape = (graph.matrixSize, graph.matrixSize))
+    matrix = markovCluster(matrix, Configs.mclInflationFactor, Configs.numCores)
+    graph.clusters = [cluster for cluster in interpretClusters(matrix) if len(cluster) > 1]
+    Configs.log("Found {} clusters..".format(len(graph.clusters)))
+
+def markovCluster(matrix, inflation, numThreads):
+    matrix = addLoops(matrix)
+    matrix = normalizeRows(matrix)
+    for i in range(MAX_ITERATIONS):
+        matrix = expand(matrix, numThreads)
+        matrix = inflate(matrix, inflation)
+        chaos = computeChaos(matrix)
+        Configs.debug("MCL iteration {}, {} nonzeros, chaos {}".format(i + 1, matrix.nnz, chaos))
+        if chaos < CHAOS_THRESHOLD:
+            break
+    return matrix
+
+def addLoops(matrix):
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    matrix.data[rows == matrix.indices] = 0
+    matrix.eliminate_zeros()
+    loops = matrix.max(axis = 1).toarray().ravel()
+    loops[loops == 0] = 1
+    return (matrix + scipy.sparse.diags(loops)).tocsr()
+
+def normalizeRows(matrix):
+    sums = np.asarray(matrix.sum(axis = 1)).ravel()
+    sums[sums == 0] = 1
+    matrix.data = matrix.data / np.repeat(sums, np.diff(matrix.indptr))
+    return matrix
+
+def expand(matrix, numThreads):
+    numBlocks = max(numThreads * 4, int(matrix.nnz // BLOCK_NONZEROS) + 1)
+    bounds = np.linspace(0, matrix.shape[0], numBlocks + 1).astype(np.int64)
+    ranges = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+    expandBlock = lambda r: prune((matrix[r[0] : r[1]] @ matrix).tocsr(), PRUNE_THRESHOLD, PRUNE_SELECTION)
+    if numThreads <= 1:
+        blocks = [expandBlock(r) for r in ranges]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = numThreads) as pool:
+            blocks = list(pool.map(expandBlock, ranges))
+    return scipy.sparse.vstack(blocks, format = "csr")
+
+def prune(matrix, threshold, selection):
+    rowMaxs = matrix.max(axis = 1).toarray().ravel()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    matrix.data[(matrix.data < threshold) & (matrix.data < rowMaxs[rows])] = 0
+    matrix.eliminate_zeros()
+    
+    rowLengths = np.diff(matrix.indptr)
+    if len(rowLengths) == 0 or rowLengths.max() <= selection:
+        return matrix
+    
+    longRows = np.flatnonzero(rowLengths > selection)
+    positions = np.concatenate([np.arange(matrix.indptr[r], matrix.indptr[r + 1]) for r in longRows])
+    rows = np.repeat(longRows, rowLengths[longRows])
+    order = np.lexsort((-matrix.data[positions], rows))
+    starts = np.repeat(np.cumsum(rowLengths[longRows]) - rowLengths[longRows], rowLengths[longRows])
+    dropped = positions[order[np.arange(len(order)) - starts >= selection]]
+    matrix.data[dropped] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+def inflate(matrix, inflation):
+    matrix.data = np.power(matrix.data, inflation)
+    return normalizeRows(matrix)
+
+def computeChaos(matrix):
+    if matrix.nnz == 0:
+        return 0
+    maxs = matrix.max(axis = 1).toarray().ravel()
+    squares = np.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel()
+    nonEmpty = squares > 0
+    return float(np.max(maxs[nonEmpty] / squares[nonEmpty] - 1))
+
+def interpretClusters(matrix):
+    numClusters, labels = csgraph.connected_components(matrix, directed = True, connection = "weak")
+    order = np.argsort(labels, kind = "stable")
+    bounds = np.searchsorted(labels[order], np.arange(numClusters + 1))
+    nodes = order.tolist()
+    clusters = [nodes[bounds[i] : bounds[i + 1]] for i in range(numClusters)]
+    clusters.sort(key = lambda cluster: cluster[0])
+    return clusters
@@ -0,0 +1,88 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import math
+import concurrent.futures
+import numpy as np
+
+from ....configuration import Configs
+from . import mcl_native
+
+'''
+Windowed MCL, for long alignments where clustering the whole graph at once needs too much memory.
+The alignment graph is nearly banded: edges mostly connect columns at similar relative positions in their subalignments.
+So we split the nodes into overlapping windows of relative position, using the subsetMatrixIdx layout,
+and run native MCL on each window's induced subgraph in parallel.
+Each node takes its cluster from the window whose core contains it.
+Across an overlap, nodes that both windows put together have their clusters joined.
+'''
+
+WINDOW_OVERLAP = 0.25
+
+def runWindowedMclClustering(graph):
+    Configs.log("Running windowed MCL alignment graph clustering..")
+    if mcl_native.scipy is None:
+        raise Exception("Windowed MCL clustering requires SciPy, please install it or use --graphclustermethod mcl")
+
+    indptr, indices, weights = graph.matrix.getCsr()
+    matrix = mcl_native.scipy.sparse.csr_matrix((np.array(weights, dtype = np.float64), np.array(indices), np.array(indptr)),
+                                                shape = (graph.matrixSize, graph.matrixSize))
+
+    numWindows = max(1, math.ceil(max(graph.subalignmentLengths) / Configs.mclWindowSize))
+    lengths = np.array(graph.subalignmentLengths, dtype = np.float64)
+    relativePositions = (graph.nodePositions + 0.5) / lengths[graph.nodeSubalignments]
+    owners = np.minimum((relativePositions * numWindows).astype(np.int64), numWindows - 1)
+    Configs.log("Clustering {} overlapping windows..".format(numWindows))
+
+    windows = []
+    for w in range(numWindows):
+        start, end = (w - WINDOW_OVERLAP) / numWindows, (w + 1 + WINDOW_OVERLAP) / numWindows
+        windows.append(np.flatnonzero((relativePositions >= start) & (relativePositions < end)))
+
+    clusterWindow = lambda nodes: mcl_native.markovCluster(matrix[nodes][:, nodes], Configs.mclInflationFactor, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, Configs.numCores)) as pool:
+        windowLabels = [componentLabels(m) for m in pool.map(clusterWindow, windows)]
+
+    graph.clusters = [cluster for cluster in reconcileWindows(graph.matrixSize, windows, windowLabels, owners) if len(cluster) > 1]
+    Configs.log("Found {} clusters..".format(len(graph.clusters)))
+
+def componentLabels(matrix):
+    numComponents, labels = mcl_native.csgraph.connected_components(matrix, directed = True, connection = "weak")
+    return labels
+
+def reconcileWindows(matrixSize, windows, windowLabels, owners):
+    offsets = np.cumsum([0] + [labels.max() + 1 if len(labels) > 0 else 0 for labels in windowLabels])
+    parents = np.arange(offsets[-1])
+
+    def find(x):
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    globalLabels = [labels + offsets[w] for w, labels in enumerate(windowLabels)]
+    ownerLabels = np.zeros(matrixSize, dtype = np.int64)
+    for w, nodes in enumerate(windows):
+        owned = owners[nodes] == w
+        ownerLabels[nodes[owned]] = globalLabels[w][owned]
+
+    for w in range(1, len(windows)):
+        shared, prevIdxs, curIdxs = np.intersect1d(windows[w-1], windows[w], assume_unique = True, return_indices = True)
+        groups = {}
+        for node, a, b in zip(shared.tolist(), globalLabels[w-1][prevIdxs].tolist(), globalLabels[w][curIdxs].tolist()):
+            groups.setdefault((a, b), []).append(ownerLabels[node])
+        for labels in groups.values():
+            root = find(labels[0])
+            for label in labels[1:]:
+                other = find(label)
+                if other != root:
+                    parents[other] = root
+
+    roots = np.array([find(label) for label in ownerLabels.tolist()], dtype = np.int64)
+    order = np.argsort(roots, kind = "stable")
+    bounds = np.flatnonzero(np.concatenate(([True], roots[order][1:] != roots[order][:-1], [True])))
+    nodes = order.tolist()
+    clusters = [nodes[bounds[i] : bounds[i + 1]] for i in range(len(bounds) - 1)]
+    clusters.sort(key = lambda cluster: cluster[0])
+    return clusters
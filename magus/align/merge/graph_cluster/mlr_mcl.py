@@ -21,7 +21,6 @@ def runMlrMclClustering(graph):
         external_tools.runMlrMcl(graphPath, 30000, 0.5, 4, graph.workingDir, clusterPath).run()
 
     graph.clusters = readClustersFromFile(clusterPath)
-    graph.writeClustersToFile(graph.clusterPath)
     
 def writeGraphToFile(graph, filePath):
     Configs.log("Writing MLR-MCL graph file to {}".format(filePath))
@@ -15,7 +15,6 @@ def rgClustering(graph):
     lowerBound = [graph.subsetMatrixIdx[i] for i in range(k)]
     upperBound = [graph.subsetMatrixIdx[i] + graph.subalignmentLengths[i] for i in range(k)] 
     graph.clusters =  rgCluster(graph, lowerBound, upperBound, False)
-    graph.writeClustersToFile(graph.clusterPath)
 
 def rgFastClustering(graph):
     Configs.log("Building a fast region-growing graph clustering..")
@@ -24,4 +23,3 @@ def rgFastClustering(graph):
     lowerBound = [graph.subsetMatrixIdx[i] for i in range(k)]
     upperBound = [graph.subsetMatrixIdx[i] + graph.subalignmentLengths[i] for i in range(k)] 
     graph.clusters =  rgFastCluster(graph, lowerBound, upperBound, False)
-    graph.writeClustersToFile(graph.clusterPath)
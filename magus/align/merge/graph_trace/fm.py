@@ -7,18 +7,33 @@ Created on Jun 15, 2020
 import heapq
 import time 
 import random
+import multiprocessing
+import concurrent.futures
+import numpy as np
 
-from ....configuration import Configs
+from ....configuration import Configs, configsSnapshot, initializeWorker
+from .. import shared_arrays
+from ..alignment_graph import NodeEdgeIndex, SubPosMap
+from . import kernels
     
 '''
 Fiduccia-Mattheyses implementation for clustering and/or tracing. 
 Currently not recommended, slower and less accurate than minclusters or mwtgreedy.
+With numba installed, each cut search runs as a compiled kernel (kernels.fmFindBestCut), with identical results.
+With multiple cores, the recursion tree runs in worker processes, since the two sides of every cut are independent.
+The graph's edge arrays are shared with the workers through shared memory, and the main process hands out
+one cut search per task, so idle workers pick up the next region as soon as it is split.
+Regions below a size share (see FM_TASKS_PER_WORKER) are partitioned completely within one task.
+The clusters, costs and cuts are merged back in tree order, so the results match the sequential recursion.
 '''
 
+PARALLEL_FM_MIN_NODES = 10000
+FM_TASKS_PER_WORKER = 8
+
 def fmAlgorithm(graph):
     Configs.log("Finding graph trace with FM Algorithm..")
     
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     lowerBound = [graph.subsetMatrixIdx[i] for i in range(k)]
     upperBound = [graph.subsetMatrixIdx[i] + graph.subalignmentLengths[i] for i in range(k)]  
     
@@ -26,7 +41,10 @@ def fmAlgorithm(graph):
         graph.buildNodeEdgeDataStructure()
     else:
         graph.buildNodeEdgeDataStructureFromClusters()
-    clusters, totalCost, cuts = fmPartition(graph, lowerBound, upperBound)
+    if Configs.numCores > 1 and shared_arrays.available() and graph.matrixSize >= PARALLEL_FM_MIN_NODES:
+        clusters, totalCost, cuts = fmParallelPartition(graph, lowerBound, upperBound)
+    else:
+        clusters, totalCost, cuts = fmPartition(graph, lowerBound, upperBound)
     
     graph.clusters = clusters
                     
@@ -41,7 +59,7 @@ def fmPartitionWithCuts(graph, lowerBound, upperBound, cuts):
     return clusters, cost, cuts
     
 def fmPartition(graph, lowerBound, upperBound, iterate = True):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     
     finished = True
     cluster = []
@@ -54,8 +72,7 @@ def fmPartition(graph, lowerBound, upperBound, iterate = True):
     if finished:
         return [cluster], 0, []   
     
-    startingCut = [int((lowerBound[i] + upperBound[i])*0.5) for i in range(k)]    
-    bestCut, bestCutCost = fmFindBestCut(graph, lowerBound, upperBound, startingCut, None)    
+    bestCut, bestCutCost = fmBisect(graph, lowerBound, upperBound)
         
     lowerClusters, lowerCost, lowerCuts = fmPartition(graph, lowerBound, bestCut)
     upperClusters, upperCost, upperCuts = fmPartition(graph, bestCut, upperBound)
@@ -65,12 +82,78 @@ def fmPartition(graph, lowerBound, upperBound, iterate = True):
 
     return clusters, totalCost, totalCuts
 
+def fmBisect(graph, lowerBound, upperBound):
+    k = len(graph.subalignmentLengths)
+    startingCut = [int((lowerBound[i] + upperBound[i])*0.5) for i in range(k)]    
+    return fmFindBestCut(graph, lowerBound, upperBound, startingCut, None)    
+
+def fmParallelPartition(graph, lowerBound, upperBound):
+    numWorkers = Configs.numCores
+    edges = graph.nodeEdges
+    blocks, specs = shared_arrays.shareArrays([edges.indptr, edges.indices, edges.weights, graph.nodeSubalignments])
+    graphInfo = (graph.subalignmentLengths, graph.subsetMatrixIdx, graph.matrixSize, specs)
+    taskSize = max(len(graph.subalignmentLengths), regionSize(lowerBound, upperBound) / (numWorkers * FM_TASKS_PER_WORKER))
+    Configs.log("Running the FM recursion with {} worker processes..".format(numWorkers))
+    
+    regions = [(lowerBound, upperBound)]
+    splits, solved = {}, {}
+    try:
+        mpContext = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers = numWorkers, mp_context = mpContext, 
+                                                    initializer = initializeFmWorker, initargs = (configsSnapshot(), graphInfo)) as pool:
+            pending = {pool.submit(fmPartitionTask, lowerBound, upperBound, taskSize) : 0}
+            while len(pending) > 0:
+                done, notDone = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    idx = pending.pop(future)
+                    clusters, cost, cuts = future.result()
+                    if clusters is not None:
+                        solved[idx] = (clusters, cost, cuts)
+                        continue
+                    
+                    lower, upper = regions[idx]
+                    cut = cuts[0]
+                    splits[idx] = (len(regions), len(regions) + 1, cut, cost)
+                    for childLower, childUpper in ((lower, cut), (cut, upper)):
+                        pending[pool.submit(fmPartitionTask, childLower, childUpper, taskSize)] = len(regions)
+                        regions.append((childLower, childUpper))
+    finally:
+        shared_arrays.releaseArrays(blocks)
+    
+    Configs.log("Merging {} FM regions..".format(len(regions)))
+    return mergePartitions(0, splits, solved)
+
+def mergePartitions(idx, splits, solved):
+    if idx in solved:
+        return solved[idx]
+    lowerIdx, upperIdx, bestCut, bestCutCost = splits[idx]
+    lowerClusters, lowerCost, lowerCuts = mergePartitions(lowerIdx, splits, solved)
+    upperClusters, upperCost, upperCuts = mergePartitions(upperIdx, splits, solved)
+    return lowerClusters + upperClusters, bestCutCost + lowerCost + upperCost, lowerCuts + [bestCut] + upperCuts
+
+def initializeFmWorker(configs, graphInfo):
+    global workerGraph
+    initializeWorker(configs)
+    workerGraph = FmWorkerGraph(*graphInfo)
+
+def fmPartitionTask(lowerBound, upperBound, taskSize):
+    if regionSize(lowerBound, upperBound) <= taskSize:
+        return fmPartition(workerGraph, lowerBound, upperBound)
+    bestCut, bestCutCost = fmBisect(workerGraph, lowerBound, upperBound)
+    return None, bestCutCost, [bestCut]
+
+def regionSize(lowerBound, upperBound):
+    return sum(u - l for l, u in zip(lowerBound, upperBound))
+
 def fmFindBestCut(graph, lowerBound, upperBound, startingCut, widthSumLimit):
     #Configs.log("Finding FM partition..")
     #Configs.log("    Lower bound: {}".format(graph.cutString(lowerBound)))
     #Configs.log("    Upper bound: {}".format(graph.cutString(upperBound)))
     #Configs.log("    Startng cut: {}".format(graph.cutString(startingCut)))
-    k = len(graph.context.subalignments)
+    if kernels.kernelsEnabled():
+        return fmFindBestCutCompiled(graph, lowerBound, upperBound, startingCut, widthSumLimit)
+    
+    k = len(graph.subalignmentLengths)
     bestCut = startingCut
     bestCutGains, bestCutCost = populateGains(graph, lowerBound, upperBound, bestCut)
     
@@ -139,8 +222,18 @@ def fmFindBestCut(graph, lowerBound, upperBound, startingCut, widthSumLimit):
     Configs.log("    Partition cost: {}".format(bestCutCost))  
     return bestCut, bestCutCost
 
+def fmFindBestCutCompiled(graph, lowerBound, upperBound, startingCut, widthSumLimit):
+    edges = graph.nodeEdges
+    bestCut, bestCutCost = kernels.fmFindBestCut(edges.indptr, edges.indices, edges.weights, graph.nodeSubalignments,
+                                                 np.array(lowerBound, dtype = np.int64), np.array(upperBound, dtype = np.int64),
+                                                 np.array(startingCut, dtype = np.int64), -1 if widthSumLimit is None else widthSumLimit)
+    bestCut, bestCutCost = bestCut.tolist(), int(bestCutCost)
+    Configs.log("Found FM partition {}".format(graph.cutString(bestCut)))
+    Configs.log("    Partition cost: {}".format(bestCutCost))  
+    return bestCut, bestCutCost
+
 def populateGains(graph, lowerBound, upperBound, cut):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     gains = {}
     cutCost = 0
     
@@ -148,12 +241,7 @@ def populateGains(graph, lowerBound, upperBound, cut):
         for node in range(lowerBound[j], upperBound[j]):
             gain = 0
             for i in range(k):
-                for nbr, value in graph.nodeEdges[node][i]:
-                    if nbr < lowerBound[i]:
-                        continue
-                    if nbr >= upperBound[i]:
-                        break
-                    
+                for nbr, value in graph.nodeEdges.edgesInRange(node, lowerBound[i], upperBound[i]):
                     if (nbr < cut[i] and node < cut[j]) or (nbr >= cut[i] and node >= cut[j]):
                         gain = gain - value
                     else:
@@ -163,7 +251,7 @@ def populateGains(graph, lowerBound, upperBound, cut):
     return gains, int(cutCost/2)               
 
 def findNewBounds(graph, lowerBound, upperBound, cut, widthSumLimit):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     lowerSize = sum([cut[i] - lowerBound[i] for i in range(k)])
     upperSize = sum([upperBound[i] - cut[i] for i in range(k)])
     portionWidth = getPortionWidth(lowerBound, upperBound)
@@ -204,7 +292,7 @@ def findNewBounds(graph, lowerBound, upperBound, cut, widthSumLimit):
     return newLowerBound, newUpperBound
 
 def updateGains(graph, lowerBound, upperBound, cut, gains, movedNodes, lowerUpdateBound, upperUpdateBound):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
         
     for node in movedNodes:
         gains[node] = -1 * gains[node]
@@ -213,12 +301,7 @@ def updateGains(graph, lowerBound, upperBound, cut, gains, movedNodes, lowerUpda
         upperUpdateBound[asub] = cut[asub]
         
         for i in range(k):
-            for nbr, value in graph.nodeEdges[node][i]:
-                if nbr < lowerBound[i]:
-                    continue
-                if nbr >= upperBound[i]:
-                    break
-                
+            for nbr, value in graph.nodeEdges.edgesInRange(node, lowerBound[i], upperBound[i]):
                 if (nbr < cut[i] and node < cut[asub]) or (nbr >= cut[i] and node >= cut[asub]):
                     gains[nbr] = gains[nbr] - 2 * value
                 else:
@@ -230,7 +313,7 @@ def updateGains(graph, lowerBound, upperBound, cut, gains, movedNodes, lowerUpda
                     upperUpdateBound[i] = min(upperUpdateBound[i], nbr)
 
 def getHeapGainUpdateList(graph, newLowerBound, newUpperBound, lowerUpdateBound, upperUpdateBound):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     updateList = [[] for i in range(k)]      
     
     for i in range(k):
@@ -243,7 +326,7 @@ def getHeapGainUpdateList(graph, newLowerBound, newUpperBound, lowerUpdateBound,
     return updateList
 
 def updateHeapGainList(graph, cut, updateList, gains, heapGains, heapGainsVersions, heap, locked):
-    k = len(graph.context.subalignments)      
+    k = len(graph.subalignmentLengths)      
     
     for i in range(k):
         for j in updateList[i]:
@@ -263,18 +346,27 @@ def getPortionWidth(lowerBound, upperBound):
     return max([u-l for u,l in zip(upperBound, lowerBound)])
 
 def computeCutCost(graph, lowerBound, upperBound, cut):
-    k = len(graph.context.subalignments)
+    k = len(graph.subalignmentLengths)
     cutCost = 0
     
     for j in range(k):
         for node in range(lowerBound[j], upperBound[j]):
             for i in range(j, k):
-                for nbr, value in graph.nodeEdges[node][i]:
-                    if nbr < lowerBound[i]:
-                        continue
-                    if nbr >= upperBound[i]:
-                        break
-                    
+                for nbr, value in graph.nodeEdges.edgesInRange(node, lowerBound[i], upperBound[i]):
                     if (nbr >= cut[i] and node < cut[j]) or (nbr < cut[i] and node >= cut[j]):
                         cutCost = cutCost + value
     return cutCost 
+
+
+class FmWorkerGraph:
+    
+    def __init__(self, subalignmentLengths, subsetMatrixIdx, matrixSize, specs):
+        self.subalignmentLengths = subalignmentLengths
+        self.subsetMatrixIdx = subsetMatrixIdx
+        self.matrixSize = matrixSize
+        self.matSubPosMap = SubPosMap(subsetMatrixIdx, matrixSize)
+        self.blocks, (indptr, indices, weights, self.nodeSubalignments) = shared_arrays.attachArrays(specs)
+        self.nodeEdges = NodeEdgeIndex(indptr, indices, weights, subsetMatrixIdx, matrixSize)
+    
+    def cutString(self, cut):
+        return [value - self.subsetMatrixIdx[i] for i, value in enumerate(cut)]
@@ -0,0 +1,341 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import heapq
+import numpy as np
+
+from ....configuration import Configs
+
+try:
+    import numba
+    from numba import types
+    from numba.typed import Dict
+except ImportError:
+    numba = None
+
+'''
+Compiled inner loops for the graph trace methods, used when numba is installed (pip install magus-msa[native]).
+They work on the CSR edge arrays and plain integer arrays instead of dicts, sets and tuples,
+and repeat the pure-Python loops step for step, so the traces come out identical.
+Without numba, or with --graphtracekernels false, the trace methods run their pure-Python versions.
+Compiled functions are cached on disk, so only the first run pays for compiling them.
+
+fmFindBestCut: one full FM cut search (fm.fmFindBestCut), including the gains and the gain heap.
+rgInitialSplitExpansion: the heap-driven cluster growing of rg_fast_search.initialSplitExpansion.
+'''
+
+def kernelsEnabled():
+    return numba is not None and Configs.graphTraceKernels
+
+def compiled(function):
+    if numba is None:
+        return function
+    return numba.njit(cache = True, nogil = True)(function)
+
+@compiled
+def regionOffsets(lowerBound, upperBound):
+    k = len(lowerBound)
+    offsets = np.zeros(k + 1, dtype = np.int64)
+    for i in range(k):
+        offsets[i + 1] = offsets[i] + upperBound[i] - lowerBound[i]
+    return offsets
+
+@compiled
+def fmFindBestCut(indptr, indices, weights, nodeSubs, lowerBound, upperBound, startingCut, widthSumLimit):
+    k = len(lowerBound)
+    offsets = regionOffsets(lowerBound, upperBound)
+    size = offsets[k]
+    shift = np.zeros(k, dtype = np.int64)
+    for i in range(k):
+        shift[i] = offsets[i] - lowerBound[i]
+
+    bestCut = startingCut.copy()
+    bestCutGains, bestCutCost = fmPopulateGains(indptr, indices, weights, nodeSubs, lowerBound, upperBound, bestCut, shift, size)
+
+    heap = [(np.int64(0), np.int64(0), np.int64(0))]
+    heapGains = np.zeros(size, dtype = np.int64)
+    versions = np.zeros(size, dtype = np.int64)
+    locked = np.zeros(size, dtype = np.bool_)
+    newLowerBound = np.zeros(k, dtype = np.int64)
+    newUpperBound = np.zeros(k, dtype = np.int64)
+    oldBestCut = bestCut.copy()
+    firstPass = True
+    while firstPass or not np.array_equal(bestCut, oldBestCut):
+        firstPass = False
+        if bestCutCost == 0:
+            break
+
+        oldBestCut = bestCut.copy()
+        cutCost = bestCutCost
+        cut = bestCut.copy()
+        gains = bestCutGains.copy()
+        heap.clear()
+        versions[:] = 0
+        locked[:] = False
+        lowerUpdateBound = cut.copy()
+        upperUpdateBound = cut.copy()
+
+        while True:
+            fmFindNewBounds(lowerBound, upperBound, cut, widthSumLimit, newLowerBound, newUpperBound)
+            for i in range(k):
+                for j in range(lowerUpdateBound[i] - 1, newLowerBound[i] - 1, -1):
+                    fmUpdateHeapGain(j, i, cut, shift, gains, heapGains, versions, locked, heap)
+                for j in range(upperUpdateBound[i], newUpperBound[i]):
+                    fmUpdateHeapGain(j, i, cut, shift, gains, heapGains, versions, locked, heap)
+
+            found = False
+            reinsert = []
+            node, asub, gain = 0, 0, 0
+            while len(heap) > 0:
+                item = heapq.heappop(heap)
+                gain, node, gainVersion = item
+                asub = nodeSubs[node]
+                local = node + shift[asub]
+                if locked[local] or gainVersion != versions[local]:
+                    continue
+                if node < newLowerBound[asub] or node >= newUpperBound[asub]:
+                    reinsert.append(item)
+                    continue
+                found = True
+                break
+
+            if not found:
+                break
+            for item in reinsert:
+                heapq.heappush(heap, item)
+
+            locked[node + shift[asub]] = True
+            gain = -gain
+            if node >= cut[asub]:
+                movedStart, movedEnd = cut[asub], node + 1
+                cut[asub] = node + 1
+            else:
+                movedStart, movedEnd = node, cut[asub]
+                cut[asub] = node
+
+            for moved in range(movedStart, movedEnd):
+                fmUpdateGains(indptr, indices, weights, nodeSubs, lowerBound, upperBound, cut, shift, gains,
+                              moved, lowerUpdateBound, upperUpdateBound)
+
+            cutCost = cutCost - gain
+            if cutCost < bestCutCost:
+                bestCut = cut.copy()
+                bestCutGains = gains.copy()
+                bestCutCost = cutCost
+
+    return bestCut, bestCutCost
+
+@compiled
+def fmPopulateGains(indptr, indices, weights, nodeSubs, lowerBound, upperBound, cut, shift, size):
+    gains = np.zeros(size, dtype = np.int64)
+    cutCost = 0
+    for j in range(len(lowerBound)):
+        for node in range(lowerBound[j], upperBound[j]):
+            gain = 0
+            for e in range(indptr[node], indptr[node + 1]):
+                nbr, value = indices[e], np.int64(weights[e])
+                i = nodeSubs[nbr]
+                if nbr < lowerBound[i] or nbr >= upperBound[i]:
+                    continue
+                if (nbr < cut[i] and node < cut[j]) or (nbr >= cut[i] and node >= cut[j]):
+                    gain = gain - value
+                else:
+                    gain = gain + value
+                    cutCost = cutCost + value
+            gains[node + shift[j]] = gain
+    return gains, cutCost // 2
+
+@compiled
+def fmFindNewBounds(lowerBound, upperBound, cut, widthSumLimit, newLowerBound, newUpperBound):
+    k = len(lowerBound)
+    lowerSize, upperSize, portionWidth = 0, 0, 0
+    for i in range(k):
+        lowerSize = lowerSize + cut[i] - lowerBound[i]
+        upperSize = upperSize + upperBound[i] - cut[i]
+        portionWidth = max(portionWidth, upperBound[i] - lowerBound[i])
+
+    limit = min(k, lowerSize + upperSize - 1)
+    lowerMargin = int((lowerSize - upperSize + limit) * 0.5)
+    upperMargin = int((upperSize - lowerSize + limit) * 0.5)
+    for i in range(k):
+        newLowerBound[i] = max(cut[i] - lowerMargin, lowerBound[i], upperBound[i] - portionWidth + 1)
+        newUpperBound[i] = min(cut[i] + upperMargin, upperBound[i], lowerBound[i] + portionWidth - 1)
+
+    if widthSumLimit >= 0:
+        l1, l2, u1, u2 = -1, -1, -1, -1
+        for i in range(k):
+            l, u = cut[i] - lowerBound[i], upperBound[i] - cut[i]
+            if l1 == -1 or l > cut[l1] - lowerBound[l1]:
+                l1, l2 = i, l1
+            elif l2 == -1 or l > cut[l2] - lowerBound[l2]:
+                l2 = i
+            if u1 == -1 or u > upperBound[u1] - cut[u1]:
+                u1, u2 = i, u1
+            elif u2 == -1 or u > upperBound[u2] - cut[u2]:
+                u2 = i
+
+        for i in range(k):
+            if i == l1:
+                newLowerBound[i] = max(newLowerBound[i], cut[l2] - lowerBound[l2] + upperBound[i] - widthSumLimit)
+            else:
+                newLowerBound[i] = max(newLowerBound[i], cut[l1] - lowerBound[l1] + upperBound[i] - widthSumLimit)
+            if i == u1:
+                newUpperBound[i] = min(newUpperBound[i], widthSumLimit + lowerBound[i] + cut[u2] - upperBound[u2])
+            else:
+                newUpperBound[i] = min(newUpperBound[i], widthSumLimit + lowerBound[i] + cut[u1] - upperBound[u1])
+
+@compiled
+def fmUpdateHeapGain(j, i, cut, shift, gains, heapGains, versions, locked, heap):
+    local = j + shift[i]
+    versions[local] = versions[local] + 1
+    if j > cut[i]:
+        heapGains[local] = heapGains[local - 1] + gains[local]
+    elif j == cut[i] or j == cut[i] - 1:
+        heapGains[local] = gains[local]
+    else:
+        heapGains[local] = heapGains[local + 1] + gains[local]
+    if not locked[local]:
+        heapq.heappush(heap, (-heapGains[local], np.int64(j), versions[local]))
+
+@compiled
+def fmUpdateGains(indptr, indices, weights, nodeSubs, lowerBound, upperBound, cut, shift, gains,
+                  node, lowerUpdateBound, upperUpdateBound):
+    asub = nodeSubs[node]
+    gains[node + shift[asub]] = -gains[node + shift[asub]]
+    lowerUpdateBound[asub] = cut[asub]
+    upperUpdateBound[asub] = cut[asub]
+
+    for e in range(indptr[node], indptr[node + 1]):
+        nbr, value = indices[e], np.int64(weights[e])
+        i = nodeSubs[nbr]
+        if nbr < lowerBound[i] or nbr >= upperBound[i]:
+            continue
+        if (nbr < cut[i] and node < cut[asub]) or (nbr >= cut[i] and node >= cut[asub]):
+            gains[nbr + shift[i]] = gains[nbr + shift[i]] - 2 * value
+        else:
+            gains[nbr + shift[i]] = gains[nbr + shift[i]] + 2 * value
+
+        if nbr < cut[i]:
+            lowerUpdateBound[i] = max(lowerUpdateBound[i], nbr + 1)
+        else:
+            upperUpdateBound[i] = min(upperUpdateBound[i], nbr)
+
+@compiled
+def rgInitialSplitExpansion(indptr, indices, weights, nodeSubs, lowerBound, upperBound, baseIdx, baseLength):
+    k = len(lowerBound)
+    offsets = regionOffsets(lowerBound, upperBound)
+    size = offsets[k]
+    shift = np.zeros(k, dtype = np.int64)
+    for i in range(k):
+        shift[i] = offsets[i] - lowerBound[i]
+
+    idxSets = np.full((baseLength, k), -1, dtype = np.int64)
+    for i in range(baseLength):
+        idxSets[i, baseIdx] = lowerBound[baseIdx] + i
+    usedNodes = np.zeros(size, dtype = np.bool_)
+    weightMap = Dict.empty(key_type = types.int64, value_type = types.int64)
+    boundsLower = Dict.empty(key_type = types.int64, value_type = types.int64)
+    boundsUpper = Dict.empty(key_type = types.int64, value_type = types.int64)
+    for i in range(k):
+        for idx in (0, baseLength - 1):
+            boundsLower[idx * k + i] = lowerBound[i] - 1
+            boundsUpper[idx * k + i] = upperBound[i]
+
+    heap = [(np.int64(0), np.int64(0), np.int64(0), np.int64(0))]
+    heap.clear()
+    for node in range(lowerBound[baseIdx], upperBound[baseIdx]):
+        for e in range(indptr[node], indptr[node + 1]):
+            nbr, value = np.int64(indices[e]), np.int64(weights[e])
+            i = nodeSubs[nbr]
+            if nbr < lowerBound[i] or nbr >= upperBound[i]:
+                continue
+            idx = np.int64(node - lowerBound[baseIdx])
+            if idxSets[idx, i] >= 0:
+                continue
+            heapq.heappush(heap, (-value, np.int64(node), nbr, idx))
+            weightMap[idx * size + nbr + shift[i]] = value
+
+    clusterIdxs, clusterNodes = [np.int64(0)], [np.int64(0)]
+    clusterIdxs.clear()
+    clusterNodes.clear()
+    while len(heap) > 0:
+        value, a, b, idx = heapq.heappop(heap)
+        bsub = nodeSubs[b]
+        if usedNodes[b + shift[bsub]]:
+            continue
+        if idxSets[idx, bsub] >= 0:
+            continue
+        lower, upper = rgGetBounds(boundsLower, boundsUpper, baseLength, k, idx, bsub)
+        if not (b > lower and b < upper):
+            continue
+
+        rgAddBounds(boundsLower, boundsUpper, baseLength, k, idx, b, bsub)
+        clusterIdxs.append(idx)
+        clusterNodes.append(b)
+        idxSets[idx, bsub] = b
+        usedNodes[b + shift[bsub]] = True
+
+        for e in range(indptr[b], indptr[b + 1]):
+            nbr, value = np.int64(indices[e]), np.int64(weights[e])
+            i = nodeSubs[nbr]
+            if idxSets[idx, i] >= 0:
+                continue
+            lower, upper = rgGetBounds(boundsLower, boundsUpper, baseLength, k, idx, i)
+            if nbr <= lower or nbr >= upper:
+                continue
+            if usedNodes[nbr + shift[i]]:
+                continue
+            key = idx * size + nbr + shift[i]
+            weight = value + weightMap.get(key, 0)
+            weightMap[key] = weight
+            heapq.heappush(heap, (-weight, b, nbr, idx))
+
+    return np.array(clusterIdxs, dtype = np.int64), np.array(clusterNodes, dtype = np.int64)
+
+@compiled
+def rgGetBounds(boundsLower, boundsUpper, baseLength, k, idx, asub):
+    a, b = 0, baseLength - 1
+    if idx == a or idx == b:
+        return boundsLower[idx * k + asub], boundsUpper[idx * k + asub]
+
+    midpoint = (a + b) // 2
+    while midpoint * k + asub in boundsLower:
+        if idx == midpoint:
+            return boundsLower[midpoint * k + asub], boundsUpper[midpoint * k + asub]
+        elif idx > midpoint:
+            a = midpoint
+        else:
+            b = midpoint
+        midpoint = (a + b) // 2
+    return boundsLower[a * k + asub], boundsUpper[b * k + asub]
+
+@compiled
+def rgAddBounds(boundsLower, boundsUpper, baseLength, k, idx, node, asub):
+    a, b = 0, baseLength - 1
+    while True:
+        la, ua = boundsLower[a * k + asub], boundsUpper[a * k + asub]
+        lb, ub = boundsLower[b * k + asub], boundsUpper[b * k + asub]
+        if idx == a:
+            boundsLower[a * k + asub], boundsUpper[a * k + asub] = node, node
+            return
+        elif node < ua:
+            boundsUpper[a * k + asub] = node
+
+        if idx == b:
+            boundsLower[b * k + asub], boundsUpper[b * k + asub] = node, node
+            return
+        elif node > lb:
+            boundsLower[b * k + asub] = node
+
+        midpoint = (a + b) // 2
+        if idx == midpoint:
+            boundsLower[midpoint * k + asub], boundsUpper[midpoint * k + asub] = node, node
+            return
+        elif midpoint * k + asub not in boundsLower:
+            boundsLower[midpoint * k + asub], boundsUpper[midpoint * k + asub] = la, ub
+
+        if idx > midpoint:
+            a = midpoint
+        elif idx < midpoint:
+            b = midpoint
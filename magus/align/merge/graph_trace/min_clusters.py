@@ -4,61 +4,134 @@ Created on Apr 18, 2020
 @author: Vlad
 '''
 
-import heapq
+import multiprocessing
+import concurrent.futures
+import numpy as np
 
-from ....configuration import Configs
+from ....configuration import Configs, configsSnapshot, initializeWorker
+from ..cost_tracker import ClusteringCostTracker
+from .search_heap import createSearchHeap, searchDeadline, deadlinePassed, containerBytes
 
 '''
 Resolve clusters into a trace by breaking conflicting clusters apart.
 We use A* to search for the path of cluster breaks with the smallest number of clusters broken.
+The cost of the trace is updated incrementally from the cost of the clustering, as the broken pieces are split off.
+Clusters first split into independent segments, between cuts that no cluster crosses, so no break is ever needed across a cut.
+With enough clusters to search, each segment is searched separately, which keeps the search states small,
+and with multiple cores the segments are searched in worker processes.
+Search states are compact: the queue frontier and maximal cut are NumPy vectors over the subalignments (the frontier bytes are the visited key),
+and each state's cluster breaks are a shared base map plus a short chain of per-break deltas, flattened every BREAK_DELTA_LIMIT breaks.
+With the "beam" search strategy, the worst states are evicted to stay within a memory budget, instead of restarting from the last frontier.
+With a time budget, every search switches to fully greedy once the budget runs out, finishing from its best state.
 '''
 
-#todo refactoring
+SEGMENTED_MIN_CLUSTERS = 5000
+BREAK_DELTA_LIMIT = 16
+
 def minClustersSearch(graph):
     Configs.log("Finding graph trace with minimum clusters heuristic search..")
     
-    subsetClusters = {}
-    clusterPositions = {}
-    queueIdxs = {}
+    segments = findIndependentSegments(graph)
+    searchSegments = [segment for segment in segments if len(segment) > 1]
+    numSearchClusters = sum(len(segment) for segment in searchSegments)
+    Configs.log("Split {} clusters into {} independent segments, {} clusters in {} segments need searching..".format(
+        len(graph.clusters), len(segments), numSearchClusters, len(searchSegments)))
+    
+    deadline = searchDeadline()
+    if len(searchSegments) > 1 and numSearchClusters >= SEGMENTED_MIN_CLUSTERS:
+        clusterBreaks = searchIndependentSegments(graph, searchSegments, deadline)
+    else:
+        clusterBreaks = searchClusterBreaks(graph.clusters, graph.matSubPosMap, deadline = deadline)
+    graph.clusters = orderClusters(graph, clusterBreaks)
+
+def findIndependentSegments(graph):
+    subsetClusters, clusterPositions, totalPairs = buildClusterQueues(graph.clusters, graph.matSubPosMap)
+    queueIdxs = {asub : 0 for asub in subsetClusters}
+    assigned = set()
+    segments = []
+    
+    for asub in subsetClusters:
+        while queueIdxs[asub] < len(subsetClusters[asub]):
+            a = subsetClusters[asub][queueIdxs[asub]][0]
+            assigned.add(a)
+            segment, stack = [], [a]
+            while len(stack) > 0:
+                a = stack.pop()
+                segment.append(a)
+                for bsub, i in clusterPositions[a].items():
+                    while queueIdxs[bsub] <= i:
+                        c = subsetClusters[bsub][queueIdxs[bsub]][0]
+                        queueIdxs[bsub] = queueIdxs[bsub] + 1
+                        if c not in assigned:
+                            assigned.add(c)
+                            stack.append(c)
+            segments.append(sorted(segment))
+    return segments
+
+def searchIndependentSegments(graph, segments, deadline):
+    numWorkers = min(Configs.numCores, len(segments))
+    subOrder = list(buildClusterQueues(graph.clusters, graph.matSubPosMap)[0])
+    if numWorkers <= 1:
+        return searchSegmentBatch([(segment, [graph.clusters[a] for a in segment]) for segment in segments], graph.matSubPosMap, subOrder, deadline, 1)
+    
+    segments = sorted(segments, key = len, reverse = True)
+    batchSize = sum(len(segment) for segment in segments) / (numWorkers * 4)
+    batches, batch, size = [], [], 0
+    for segment in segments:
+        batch.append((segment, [graph.clusters[a] for a in segment]))
+        size = size + len(segment)
+        if size >= batchSize:
+            batches.append(batch)
+            batch, size = [], 0
+    if len(batch) > 0:
+        batches.append(batch)
+    Configs.log("Searching {} segment batches with {} worker processes..".format(len(batches), numWorkers))
+    
+    clusterBreaks = {}
+    mpContext = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers = numWorkers, mp_context = mpContext, 
+                                                initializer = initializeWorker, initargs = (configsSnapshot(),)) as pool:
+        for batchBreaks in pool.map(searchSegmentBatch, batches, [graph.matSubPosMap] * len(batches), [subOrder] * len(batches),
+                                    [deadline] * len(batches), [numWorkers] * len(batches)):
+            clusterBreaks.update(batchBreaks)
+    return clusterBreaks
+
+def searchSegmentBatch(batch, matSubPosMap, subOrder, deadline, numSearches):
     clusterBreaks = {}
-    maxFrontier = {}
-    visitedStates = set()
-    maximalCut = {}
+    for segment, clusters in batch:
+        for (a, asub), cluster in searchClusterBreaks(clusters, matSubPosMap, subOrder, deadline, numSearches).items():
+            clusterBreaks[segment[a], asub] = cluster
+    return clusterBreaks
+
+def searchClusterBreaks(clusters, matSubPosMap, subOrder = None, deadline = None, numSearches = 1):
+    subsetClusters, clusterPositions, totalPairs = buildClusterQueues(clusters, matSubPosMap, subOrder)
+    context = MinClustersContext(clusters, matSubPosMap, subsetClusters, clusterPositions)
+    numSubs = len(context.subs)
+    maxFrontier = np.full(numSubs, -1, dtype = np.int32)
     stateCounter = 0
     aggression = 1.0
     lastFrontierState = None
     greedy = False
-    totalPairs = 0
-
-    
-    for a,cluster in enumerate(graph.clusters):
-        for b in cluster:
-            bsub, bpos = graph.matSubPosMap[b] 
-            subsetClusters[bsub] = subsetClusters.get(bsub, []) + [(a, bpos)]  
-            clusterPositions[a] = {}
-            totalPairs = totalPairs + len(cluster)*(len(cluster)-1)/2
-                
+    timedOut = False
     
-    for asub in subsetClusters:
-        subsetClusters[asub].sort(key = lambda c: c[1])
-        queueIdxs[asub] = 0
-
-        maxFrontier[asub] = -1
-        maximalCut[asub] = -1
-        
-        for i in range(len(subsetClusters[asub])):            
-            a = subsetClusters[asub][i][0]
-            clusterPositions[a][asub] = i
-    
-    heap = []
+    heap = createSearchHeap(minClustersStateBytes, numSearches)
     
-    startState = (0, 0, len(graph.clusters), totalPairs, stateCounter, queueIdxs, clusterBreaks, maximalCut, [], True)
-    startState = developState(startState, graph, aggression, greedy, 0, subsetClusters, clusterPositions)
-    heapq.heappush(heap, startState)
+    startState = (0, 0, len(clusters), totalPairs, stateCounter, np.zeros(numSubs, dtype = np.int32), ClusterBreaks(), 
+                  np.full(numSubs, -1, dtype = np.int32), [], True)
+    startState = developState(startState, context, aggression, greedy, 0)
+    heap.push(startState)
     
     while len(heap) > 0:
         heapCleared = False
-        if len(heap) > Configs.searchHeapLimit:
+        if not timedOut and deadlinePassed(deadline):
+            Configs.log("Search time budget of {} sec ran out.. Finishing greedily from the best state..".format(Configs.searchTimeBudget))
+            timedOut, greedy, aggression = True, True, 1
+            bestState = developState(heap.pop(), context, aggression, greedy, 0)
+            heap.clear()
+            heap.push(bestState)
+            heapCleared = True
+        
+        elif Configs.searchStrategy != "beam" and len(heap) > Configs.searchHeapLimit:
             Configs.log("Heap limit {} reached.. Truncating heap to last frontier".format(Configs.searchHeapLimit)) 
             if aggression == 1:
                 aggression = 1.2
@@ -72,44 +145,32 @@ def minClustersSearch(graph):
                 aggression = 1    
                 
             heap.clear()
-            visitedStates = set()
-            lastFrontierState = developState(lastFrontierState, graph, aggression, greedy, 0, subsetClusters, clusterPositions)
-            heapq.heappush(heap, lastFrontierState)
+            lastFrontierState = developState(lastFrontierState, context, aggression, greedy, 0)
+            heap.push(lastFrontierState)
             heapCleared = True
 
-        state = heapq.heappop(heap)
+        state = heap.pop()
         heuristic, numOrdered, numLeft, pairsLeft, counter, queueIdxs, clusterBreaks, maximalCut, newClusterBreaks, safeFrontier = state
    
         if len(newClusterBreaks) == 0:
             break
         else:
-            stateKey = tuple([queueIdxs[sub] for sub in subsetClusters])
-            if stateKey in visitedStates:
+            if not heap.visit(queueIdxs.tobytes()):
                 continue
-            else:
-                visitedStates.add(stateKey)
-            
-
-            newSubFrontier = True
-            for asub in queueIdxs:
-                if queueIdxs[asub] <= maxFrontier[asub]:
-                    newSubFrontier = False
-                    break
                 
-            if newSubFrontier:
+            if (queueIdxs > maxFrontier).all():
                 maxFrontier = queueIdxs
                 Configs.log("Reached new search frontier")
-                Configs.log(maxFrontier)
+                Configs.log(dict(zip(context.subs, maxFrontier.tolist())))
                 lastFrontierState = state
-                greedy = False
+                greedy = timedOut
             
             if safeFrontier and not heapCleared:
                 Configs.log("Safe frontier reached.. dumping {} from heap and resetting aggression..".format(len(heap)))
                 lastFrontierState = state
                 heap.clear()
-                visitedStates = set()
                 aggression = 1.0
-                greedy = False
+                greedy = timedOut
                 
             
             nextStates = []
@@ -119,35 +180,66 @@ def minClustersSearch(graph):
                 pairsDiff = g*(g-1)/2 + b*(b-1)/2 - (g+b)*(g+b-1)/2
                 
                 stateCounter = stateCounter + 1
-                queueIdxsCopy = dict(queueIdxs)
-                clusterBreaksCopy = dict(clusterBreaks)
-                maximalCutCopy = dict(maximalCut)
-                for b in goodSide:
-                    bsub, bpos = graph.matSubPosMap[b]
-                    clusterBreaksCopy[a, bsub] = goodSide
-                    maximalCutCopy[bsub] = max(maximalCutCopy[bsub], clusterPositions[a][bsub])
-                    
-                for b in badSide:
-                    bsub, bpos = graph.matSubPosMap[b]
-                    clusterBreaksCopy[a, bsub] = badSide
-                    maximalCutCopy[bsub] = max(maximalCutCopy[bsub], clusterPositions[a][bsub])
+                clusterBreaksCopy = clusterBreaks.addBreak(a, goodSide, badSide, context.nodeSubs)
+                context.brokenClusters.add(a)
+                maximalCutCopy = maximalCut.copy()
+                for b in goodSide + badSide:
+                    bsub = context.nodeSubs[b]
+                    maximalCutCopy[bsub] = max(maximalCutCopy[bsub], context.clusterPositions[a][bsub])
                 
-                nextState = (0, numOrdered, numLeft + 1, pairsLeft + pairsDiff, stateCounter, queueIdxsCopy, clusterBreaksCopy, maximalCutCopy, [], False)
-                nextState = developState(nextState, graph, aggression, greedy, len(crossedClusters), subsetClusters, clusterPositions)
+                nextState = (0, numOrdered, numLeft + 1, pairsLeft + pairsDiff, stateCounter, queueIdxs, clusterBreaksCopy, maximalCutCopy, [], False)
+                nextState = developState(nextState, context, aggression, greedy, len(crossedClusters))
 
                 nextStates.append(nextState)
                 
             if greedy:
                 nextState = min(nextStates, key=lambda x : x[0])
-                heapq.heappush(heap, nextState)
+                heap.push(nextState)
             else:
                 for nextState in nextStates:
-                    heapq.heappush(heap, nextState)
-                
+                    heap.push(nextState)
+    
+    return {(a, context.subs[asub]) : cluster for (a, asub), cluster in clusterBreaks.toDict().items()}
+
+def minClustersStateBytes(state):
+    heuristic, numOrdered, numLeft, pairsLeft, counter, queueIdxs, clusterBreaks, maximalCut, newClusterBreaks, safeFrontier = state
+    lastDelta = clusterBreaks.deltas[-1] if len(clusterBreaks.deltas) > 0 else {}
+    numBytes = containerBytes(state, heuristic, queueIdxs, maximalCut, clusterBreaks, clusterBreaks.deltas, lastDelta, newClusterBreaks)
+    for a, goodSide, badSide, crossedClusters in newClusterBreaks:
+        numBytes = numBytes + containerBytes(goodSide, badSide, crossedClusters)
+    return numBytes
+
+def buildClusterQueues(clusters, matSubPosMap, subOrder = None):
+    subsetClusters = {}
+    clusterPositions = {}
+    totalPairs = 0
+    
+    for a,cluster in enumerate(clusters):
+        clusterPositions[a] = {}
+        for b in cluster:
+            bsub, bpos = matSubPosMap[b] 
+            subsetClusters.setdefault(bsub, []).append((a, bpos))
+            totalPairs = totalPairs + len(cluster)*(len(cluster)-1)/2
+    
+    if subOrder is not None:
+        subsetClusters = {asub : subsetClusters[asub] for asub in subOrder if asub in subsetClusters}
+    
+    for asub in subsetClusters:
+        subsetClusters[asub].sort(key = lambda c: c[1])
+        for i in range(len(subsetClusters[asub])):            
+            a = subsetClusters[asub][i][0]
+            clusterPositions[a][asub] = i
+    return subsetClusters, clusterPositions, totalPairs
+
+def orderClusters(graph, clusterBreaks):
+    subsetClusters, clusterPositions, totalPairs = buildClusterQueues(graph.clusters, graph.matSubPosMap)
     queueIdxs = {}
     for asub in subsetClusters:
         queueIdxs[asub] = 0
-        
+    
+    tracker = ClusteringCostTracker(graph, graph.clusters)
+    initialCost = tracker.cost
+    brokenClusters = set()
     orderedClusters = []
     foundGood = True
     while foundGood:
@@ -172,46 +264,47 @@ def minClustersSearch(graph):
                 
             if good:
                 orderedClusters.append(cluster)
+                if (a,asub) in clusterBreaks:
+                    brokenClusters.add(a)
+                    tracker.splitCluster(cluster)
                 for b in cluster:
                     bsub, bpos = graph.matSubPosMap[b]
                     queueIdxs[bsub] = clusterPositions[a][bsub] + 1
                 foundGood = True
                 break
                     
-    graph.clusters = orderedClusters
+    Configs.log("Broke {} clusters, trace cost went from {} to {}..".format(len(brokenClusters), initialCost, tracker.cost))
+    tracker.trackedClusters = orderedClusters
+    graph.costTracker = tracker
+    return orderedClusters
 
-def developState(state, graph, aggression, greedy, crossed, subsetClusters, clusterPositions):
+def developState(state, context, aggression, greedy, crossed):
     heuristic, numOrdered, numLeft, pairsLeft, counter, queueIdxs, clusterBreaks, maximalCut, newClusterBreaks, safeFrontier  = state
+    queues, clusterPositions, nodeSubs = context.queues, context.clusterPositions, context.nodeSubs
+    queue = queueIdxs.tolist()
     
     foundGood = True
     while foundGood:
         foundGood = False
         newClusterBreaks = []
         visited = set()
-        safeFrontier = True
         
-        for asub in queueIdxs:
-            idx = queueIdxs[asub]
-            if idx <= maximalCut[asub]:
-                safeFrontier = False
-
-            if idx == len(subsetClusters[asub]):
+        for asub in range(len(queue)):
+            idx = queue[asub]
+            if idx == len(queues[asub]):
                 continue
-            a, pos = subsetClusters[asub][idx]
+            a = queues[asub][idx]
             if (a,asub) in visited:
                 continue
             
-            if (a,asub) in clusterBreaks:
-                cluster = clusterBreaks[a,asub]
-            else:
-                cluster = graph.clusters[a]
+            cluster = context.getCluster(clusterBreaks, a, asub)
             
             goodSide, badSide, crossedClusters = [], [], set()
             for b in cluster:
-                bsub, bpos = graph.matSubPosMap[b]
+                bsub = nodeSubs[b]
                 visited.add((a, bsub))
                 bidx = clusterPositions[a][bsub]
-                diff = bidx - queueIdxs[bsub]
+                diff = bidx - queue[bsub]
                 if diff == 0:
                     goodSide.append(b)
                 else:
@@ -219,8 +312,8 @@ def developState(state, graph, aggression, greedy, crossed, subsetClusters, clus
                                    
             if len(badSide) == 0:
                 for b in cluster:
-                    bsub, bpos = graph.matSubPosMap[b]
-                    queueIdxs[bsub] = clusterPositions[a][bsub] + 1
+                    bsub = nodeSubs[b]
+                    queue[bsub] = clusterPositions[a][bsub] + 1
                 numOrdered = numOrdered + 1
                 numLeft = numLeft - 1
                 foundGood = True
@@ -233,28 +326,72 @@ def developState(state, graph, aggression, greedy, crossed, subsetClusters, clus
         for a, goodSide, badSide, crossedClusters in newClusterBreaks:
             goodSub = set()
             for b in goodSide:
-                bsub, bpos = graph.matSubPosMap[b] 
-                goodSub.add(bsub)
+                goodSub.add(nodeSubs[b])
                 
             for b in badSide:    
-                bsub, bpos = graph.matSubPosMap[b]   
-                for i in range(queueIdxs[bsub], clusterPositions[a][bsub]):
-                    c, posc = subsetClusters[bsub][i]
-                    if (c,bsub) in clusterBreaks:
-                        otherCluster = clusterBreaks[c,bsub]
-                    else:
-                        otherCluster = graph.clusters[c]
+                bsub = nodeSubs[b]   
+                for i in range(queue[bsub], clusterPositions[a][bsub]):
+                    c = queues[bsub][i]
+                    otherCluster = context.getCluster(clusterBreaks, c, bsub)
                     
                     for csite in otherCluster:
-                        csub, cpos = graph.matSubPosMap[csite]
+                        csub = nodeSubs[csite]
                         if csub in goodSub and clusterPositions[c][csub] > clusterPositions[a][csub]:
                             crossedClusters.add(c)
                             break  
-                          
-                
+    
+    queueIdxs = np.array(queue, dtype = np.int32)
+    safeFrontier = bool((queueIdxs > maximalCut).all())
     if safeFrontier or len(newClusterBreaks) == 0:
         heuristic = (numLeft + numOrdered, -numOrdered, -crossed, -pairsLeft)
     else:
         heuristic = (aggression * numLeft + numOrdered, -numOrdered, -crossed, -pairsLeft)
     state = (heuristic, numOrdered, numLeft, pairsLeft, counter, queueIdxs, clusterBreaks, maximalCut, newClusterBreaks, safeFrontier)
     return state
+
+
+class MinClustersContext:
+    
+    def __init__(self, clusters, matSubPosMap, subsetClusters, clusterPositions):
+        self.clusters = clusters
+        self.subs = list(subsetClusters)
+        subIdxs = {asub : i for i, asub in enumerate(self.subs)}
+        self.queues = [[a for a, pos in subsetClusters[asub]] for asub in self.subs]
+        self.clusterPositions = {a : {subIdxs[asub] : i for asub, i in positions.items()} for a, positions in clusterPositions.items()}
+        self.nodeSubs = {b : subIdxs[matSubPosMap[b][0]] for cluster in clusters for b in cluster}
+        self.brokenClusters = set()
+    
+    def getCluster(self, clusterBreaks, a, asub):
+        if a in self.brokenClusters:
+            cluster = clusterBreaks.get((a, asub))
+            if cluster is not None:
+                return cluster
+        return self.clusters[a]
+
+
+class ClusterBreaks:
+    
+    def __init__(self, base = None, deltas = ()):
+        self.base = {} if base is None else base
+        self.deltas = deltas
+    
+    def get(self, key):
+        for delta in reversed(self.deltas):
+            if key in delta:
+                return delta[key]
+        return self.base.get(key)
+    
+    def addBreak(self, a, goodSide, badSide, nodeSubs):
+        if len(self.deltas) >= BREAK_DELTA_LIMIT:
+            self.base, self.deltas = self.toDict(), ()
+        delta = {}
+        for side in (goodSide, badSide):
+            for b in side:
+                delta[a, nodeSubs[b]] = side
+        return ClusterBreaks(self.base, self.deltas + (delta,))
+    
+    def toDict(self):
+        clusterBreaks = dict(self.base)
+        for delta in self.deltas:
+            clusterBreaks.update(delta)
+        return clusterBreaks
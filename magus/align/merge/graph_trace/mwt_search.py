@@ -4,15 +4,17 @@ Created on Jun 25, 2020
 @author: Vlad
 '''
 
-import heapq
 from collections import deque 
 
 from ....configuration import Configs
+from .search_heap import createSearchHeap, searchDeadline, deadlinePassed, containerBytes
 
 
 '''
 Resolve clusters into a trace by looking for cycles and removing edges to break the cycles.
 We're done when there are no more cycles.
+With the "beam" search strategy, the heuristic search evicts its worst states to stay within a memory budget,
+and with a time budget, it finishes greedily from its best state once the budget runs out.
 '''
 
 def mwtGreedySearch(graph):
@@ -53,20 +55,25 @@ def mwtHeuristicSearch(graph, lowerBound, upperBound):
     startState = MwtSearchState()
     startState.frontier = list(lowerBound)
     
-    heap = []
-    visited = set()    
+    heap = createSearchHeap(mwtStateBytes)
+    deadline = searchDeadline()
     maxFrontierState = startState
-    heapq.heappush(heap, (startState.getHeuristic(), startState))
+    heap.push((startState.getHeuristic(), startState))
     
     while len(heap) > 0:
         
-        if len(heap) > Configs.searchHeapLimit:
+        if Configs.searchStrategy != "beam" and len(heap) > Configs.searchHeapLimit:
             Configs.log("Heap limit exceeded, clearing heap and moving to max frontier..")
-            heap = []
-            visited = set()
-            heapq.heappush(heap, (maxFrontierState.getHeuristic(), maxFrontierState))
+            heap.clear()
+            heap.push((maxFrontierState.getHeuristic(), maxFrontierState))
+        
+        if deadlinePassed(deadline):
+            heuristic, state = heap.pop()
+            Configs.log("Search time budget of {} sec ran out.. Finishing greedily from the best state, {} cost so far..".format(Configs.searchTimeBudget, state.cost))
+            clusters, totalCost, cycles = greedySearch(graph, state, context)
+            return clusters, totalCost
                 
-        heuristic, state = heapq.heappop(heap)
+        heuristic, state = heap.pop()
  
         newMax = False
         newFull = True
@@ -87,8 +94,7 @@ def mwtHeuristicSearch(graph, lowerBound, upperBound):
         if newFull:
             context.fullFrontier = list(state.frontier)
             #Configs.log("New full frontier {}..".format(graph.cutString(context.fullFrontier)))
-            heap = []
-            visited = set()
+            heap.clear()
          
         percent = getBoundPercent(state.frontier, context)
         if int(percent/10) > int(context.percentDone/10):
@@ -103,10 +109,8 @@ def mwtHeuristicSearch(graph, lowerBound, upperBound):
             return orderedClusters, state.cost
         
         for nextState in moves:
-            stateKey = nextState.getStateKey()
-            if stateKey not in visited:
-                visited.add(stateKey)
-                heapq.heappush(heap, (nextState.getHeuristic(), nextState))        
+            if heap.visit(nextState.getStateKey()):
+                heap.push((nextState.getHeuristic(), nextState))        
 
 
     Configs.log("Heap empty, resorting to greedy search..")
@@ -116,6 +120,10 @@ def mwtHeuristicSearch(graph, lowerBound, upperBound):
     clusters, totalCost, cycles = greedySearch(graph, state, context)
     return clusters, totalCost
 
+def mwtStateBytes(entry):
+    heuristic, state = entry
+    return containerBytes(entry, heuristic, state, state.__dict__, state.frontier, state.removed, state.frontierRemoved)
+
 def findMoves(graph, state, context, frontierSearchDepth = 3):
     if len(state.frontierRemoved) >= frontierSearchDepth:
         findGreedyProgress(graph, state, context)
@@ -255,8 +263,8 @@ def findCycleOrClusterFromNode(graph, state, context, node):
         curNode = stack.pop()
         for j in range(k):
             sibling = None
-            for nbr, value in graph.nodeEdges[curNode][j]:
-                if nbr in clusterNodes or edge(curNode, nbr) in state.removed or nbr < state.frontier[j] or nbr >= context.upperBound[j]:
+            for nbr, value in graph.nodeEdges.edgesInRange(curNode, state.frontier[j], context.upperBound[j]):
+                if nbr in clusterNodes or edge(curNode, nbr) in state.removed:
                     continue
                 if sibling is not None:
                     return True, [edge(sibling, curNode), edge(curNode, nbr)]
@@ -303,8 +311,8 @@ def findPathBFS(graph, lowerBound, upperBound, removed, nodeA, nodeB):
             if j in levels and j != bsub:
                 continue
             
-            for nbr, value in graph.nodeEdges[curNode][j]:
-                if nbr in visited or edge(curNode, nbr) in removed or nbr < lowerBound[j] or nbr >= upperBound[j]:
+            for nbr, value in graph.nodeEdges.edgesInRange(curNode, lowerBound[j], upperBound[j]):
+                if nbr in visited or edge(curNode, nbr) in removed:
                     continue
                 
                 visited.add(nbr)
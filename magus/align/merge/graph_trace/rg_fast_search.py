@@ -5,9 +5,11 @@ Created on Aug 23, 2020
 '''
 
 import heapq
+import numpy as np
 from collections import deque 
 
 from ....configuration import Configs
+from . import kernels
 
 def rgFastSearch(graph):
     Configs.log("Finding graph trace with fast region-growing search..")
@@ -48,6 +50,9 @@ def initialSplit(graph, lowerBound, upperBound, enforceTrace = True):
     return cuts
 
 def initialSplitExpansion(graph, lowerBound, upperBound, baseIdx, baseLength):
+    if kernels.kernelsEnabled():
+        return initialSplitExpansionCompiled(graph, lowerBound, upperBound, baseIdx, baseLength)
+    
     k = len(graph.context.subalignments)
     clusters = [[lowerBound[baseIdx] + i] for i in range(baseLength)]
     #idxSets = [set([baseIdx]) for i in range(baseLength)]
@@ -120,6 +125,15 @@ def initialSplitExpansion(graph, lowerBound, upperBound, baseIdx, baseLength):
 
     return clusters
 
+def initialSplitExpansionCompiled(graph, lowerBound, upperBound, baseIdx, baseLength):
+    indptr, indices, weights = graph.matrix.getCsr()
+    clusterIdxs, clusterNodes = kernels.rgInitialSplitExpansion(indptr, indices, weights, graph.nodeSubalignments, 
+                                                                np.array(lowerBound, dtype = np.int64), np.array(upperBound, dtype = np.int64), 
+                                                                baseIdx, baseLength)
+    clusters = [[lowerBound[baseIdx] + i] for i in range(baseLength)]
+    for idx, b in zip(clusterIdxs.tolist(), clusterNodes.tolist()):
+        clusters[idx].append(b)
+    return clusters
 
 def getBounds(boundsMap, baseLength, idx, asub):
     a, b = 0, baseLength - 1
@@ -184,11 +198,7 @@ def initialSplitExpansionSimple(graph, lowerBound, upperBound, baseIdx, baseLeng
     heap = []
     for node in range(lowerBound[baseIdx], upperBound[baseIdx]):
         for i in range(k):
-            for nbr, value in graph.nodeEdges[node][i]:
-                if nbr < lowerBound[i]:
-                    continue
-                if nbr >= upperBound[i]:
-                    break
+            for nbr, value in graph.nodeEdges.edgesInRange(node, lowerBound[i], upperBound[i]):
                 idx = node - lowerBound[baseIdx]
                 heapq.heappush(heap, (-1*value, node, nbr, idx)) 
                 weightMap[idx, nbr] = value
@@ -213,13 +223,9 @@ def initialSplitExpansionSimple(graph, lowerBound, upperBound, baseIdx, baseLeng
         for i in range(k):
             if (idx, i) in idxSets:
                 continue
-            for nbr, value in graph.nodeEdges[b][i]:
+            for nbr, value in graph.nodeEdges.edgesInRange(b, idxSets.get((idx-1, i), lowerBound[i]), idxSets.get((idx+1, i), upperBound[i])):
                 if nbr in usedNodes:
-                    continue                
-                if nbr <  idxSets.get((idx-1, i), lowerBound[i]):
                     continue
-                if nbr >= idxSets.get((idx+1, i), upperBound[i]):
-                    break
                 
                 #print(weightMap.get((idx, nbr), 0))
                 weight = value + weightMap.get((idx, nbr), 0)
@@ -0,0 +1,95 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import sys
+import time
+import heapq
+
+from ....configuration import Configs
+
+'''
+Heap for the best-first trace searches (minclusters and mwtsearch), with optional memory and time budgets.
+The heap also holds the search's set of visited state keys.
+With the "beam" search strategy, the heap keeps an estimate of the bytes held by its states and visited keys.
+Each state's size is estimated once, when it's pushed, and the same size is subtracted when it leaves the heap.
+When they go over the memory budget, the visited keys are dropped first, then the worst states are evicted, keeping the best ones within BEAM_KEEP_FRACTION of the budget.
+The time budget gives each trace a deadline; once it passes, the searches finish greedily from their best state.
+'''
+
+BEAM_KEEP_FRACTION = 0.75
+SET_ENTRY_BYTES = 32
+
+class SearchHeap:
+
+    def __init__(self, memoryBudget = None, stateBytes = None):
+        self.heap = []
+        self.visited = set()
+        self.memoryBudget = memoryBudget
+        self.stateBytes = stateBytes
+        self.numBytes = 0
+        self.visitedBytes = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, entry):
+        size = self.stateBytes(entry) if self.memoryBudget is not None else 0
+        heapq.heappush(self.heap, (entry, size))
+        self.numBytes = self.numBytes + size
+        if self.memoryBudget is not None and self.numBytes + self.visitedBytes > self.memoryBudget:
+            self.evictWorst()
+
+    def pop(self):
+        entry, size = heapq.heappop(self.heap)
+        self.numBytes = self.numBytes - size
+        return entry
+
+    def peek(self):
+        return self.heap[0][0]
+
+    def visit(self, key):
+        if key in self.visited:
+            return False
+        self.visited.add(key)
+        if self.memoryBudget is not None:
+            self.visitedBytes = self.visitedBytes + sys.getsizeof(key) + SET_ENTRY_BYTES
+            if self.numBytes + self.visitedBytes > self.memoryBudget:
+                self.evictWorst()
+        return True
+
+    def clear(self):
+        self.heap = []
+        self.visited = set()
+        self.numBytes = 0
+        self.visitedBytes = 0
+
+    def evictWorst(self):
+        self.visited = set()
+        self.visitedBytes = 0
+        if self.numBytes <= self.memoryBudget:
+            Configs.debug("Search visited set went over {} bytes, cleared it..".format(self.memoryBudget))
+            return
+        self.heap.sort()
+        keptBytes, limit = 0, self.memoryBudget * BEAM_KEEP_FRACTION
+        for i, (entry, size) in enumerate(self.heap):
+            if keptBytes + size > limit and i > 0:
+                del self.heap[i:]
+                break
+            keptBytes = keptBytes + size
+        self.numBytes = keptBytes
+        Configs.debug("Search heap went over {} bytes, kept the best {} states..".format(self.memoryBudget, len(self.heap)))
+
+def createSearchHeap(stateBytes, numSearches = 1):
+    if Configs.searchStrategy == "beam":
+        return SearchHeap(Configs.searchMemoryBudget * 1024 * 1024 / max(1, numSearches), stateBytes)
+    return SearchHeap()
+
+def searchDeadline():
+    return time.time() + Configs.searchTimeBudget if Configs.searchTimeBudget > 0 else None
+
+def deadlinePassed(deadline):
+    return deadline is not None and time.time() > deadline
+
+def containerBytes(*containers):
+    return sum(sys.getsizeof(c) for c in containers)
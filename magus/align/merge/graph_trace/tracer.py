@@ -26,11 +26,16 @@ Some of these options don't require an existing clustering, and can work on the
 def findTrace(graph):
     time1 = time.time() 
     
-    if os.path.exists(graph.tracePath):
+    if os.path.exists(graph.traceCheckpointPath):
+        Configs.log("Found existing trace checkpoint {}".format(graph.traceCheckpointPath))
+        graph.readClustersCheckpoint(graph.traceCheckpointPath)
+    
+    elif os.path.exists(graph.tracePath):
         Configs.log("Found existing trace file {}".format(graph.tracePath))
         graph.readClustersFromFile(graph.tracePath)
         
     else:
+        graph.costTracker = None
         purgeDuplicateClusters(graph)
         purgeClusterViolations(graph)
         
@@ -49,12 +54,13 @@ def findTrace(graph):
         elif Configs.graphTraceMethod == "naive":
             naiveClustering(graph)
         
-        graph.writeClustersToFile(graph.tracePath)
+        graph.writeClustersCheckpoint(graph.traceCheckpointPath)
     
     
     time2 = time.time()
     Configs.log("Found alignment graph trace in {} sec..".format(time2-time1))
     Configs.log("Found a trace with {} clusters and a total cost of {}".format(len(graph.clusters), graph.computeClusteringCost(graph.clusters)))
+    graph.costTracker = None
     
     
     
@@ -14,17 +14,23 @@ from .graph_trace.tracer import findTrace
 from .optimizer import optimizeTrace
 from .alignment_writer import writeAlignment
 from ...configuration import Configs
+from ...helpers import profiler
 
 
 def mergeSubalignments(context):
     Configs.log("Merging {} subaligments..".format(len(context.subalignmentPaths)))
     time1 = time.time()  
     
-    buildGraph(context)
-    clusterGraph(context.graph)
-    findTrace(context.graph)
-    optimizeTrace(context.graph)    
-    writeAlignment(context)
+    with profiler.stage("graph build", context.workingDir):
+        buildGraph(context)
+    with profiler.stage("graph clustering", context.workingDir):
+        clusterGraph(context.graph)
+    with profiler.stage("graph trace", context.workingDir):
+        findTrace(context.graph)
+    with profiler.stage("trace optimization", context.workingDir):
+        optimizeTrace(context.graph)    
+    with profiler.stage("alignment writing", context.workingDir):
+        writeAlignment(context)
     
     time2 = time.time()  
     Configs.log("Merged {} subalignments into {} in {} sec..".format(len(context.subalignmentPaths), context.outputFile, time2-time1))
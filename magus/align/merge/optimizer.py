@@ -8,12 +8,14 @@ import heapq
 import time
 
 from ...configuration import Configs
+from .cost_tracker import ClusteringCostTracker
 
 '''
 Optimizer may be used to post-process a trace to improve the MWT score by shuffling nodes between clusters.
 Disabled by default - tends to be very time-consuming with negligible improvements to accuracy.
 However, may be helpful when using inaccurate clustering and/or tracing algorithms.
 The quality of the resulting trace is usually on par with using MCL/minclusters.
+The search context tracks the cost of its current clustering incrementally, to report progress without rescanning the graph.
 '''
 
 def optimizeTrace(graph):
@@ -22,8 +24,8 @@ def optimizeTrace(graph):
     if Configs.graphTraceOptimize:
         Configs.log("Optimization pass..")
         graph.addSingletonClusters()
-        graph.clusters = optimizeClusters(graph, graph.clusters)
-        Configs.log("Optimized the trace to {} clusters with a total cost of {}".format(len(graph.clusters), graph.computeClusteringCost(graph.clusters)))
+        graph.clusters, cost = optimizeClusters(graph, graph.clusters)
+        Configs.log("Optimized the trace to {} clusters with a total cost of {}".format(len(graph.clusters), cost))
     else:
         Configs.log("Skipping optimization pass..")
     time2 = time.time()
@@ -31,14 +33,14 @@ def optimizeTrace(graph):
     
 
 def optimizeClusters(graph, clusters):
-    bestClusters, bestCost = clusters, graph.computeClusteringCost(clusters)
-    Configs.log("Starting optimization from initial cost of {}..".format(bestCost)) 
     context = SearchContext(clusters)
     context.initialize(graph)
+    bestClusters, bestCost = clusters, context.costTracker.cost
+    Configs.log("Starting optimization from initial cost of {}..".format(bestCost)) 
     
     passNum = 1
     while True:
-        Configs.log("Starting optimization pass {}..".format(passNum))
+        Configs.log("Starting optimization pass {} at a current cost of {}..".format(passNum, context.costTracker.cost))
         newClusters, gain = optimizationPass(graph, bestClusters, context)
         if gain > 0:
             bestClusters = newClusters
@@ -50,7 +52,7 @@ def optimizeClusters(graph, clusters):
         passNum = passNum + 1
     #Configs.log("Final optimized cost of {} over {} clusters..".format(graph.computeClusteringCost(bestClusters), len(bestClusters)))
     Configs.log("Final optimized cost of {} over {} clusters..".format(bestCost, len(bestClusters)))
-    return bestClusters
+    return bestClusters, bestCost
 
 def optimizationPass(graph, clusters, context):
     context.initializeHeap(graph)
@@ -59,7 +61,7 @@ def optimizationPass(graph, clusters, context):
     
     bestGain, currentGain, bestClusters = 0, 0, clusters
     
-    #move = 0
+    move = 0
     while True:
         nextMove = getNextClusterMove(graph, context)
         if nextMove is None:
@@ -82,9 +84,9 @@ def optimizationPass(graph, clusters, context):
         context.moveElements(graph, element, dest, updateList)
         context.updateMoves(graph, element, src, dest, updateList) 
         
-        #move = move + 1
-        #if move % 10000 == 0:       
-        #Configs.log("Current / best cost: {} / {}..".format(cost - currentGain, cost - bestGain))
+        move = move + 1
+        if move % 10000 == 0:       
+            Configs.log("Current / best cost after {} moves: {} / {}..".format(move, context.costTracker.cost, context.costTracker.cost + currentGain - bestGain))
     return bestClusters, bestGain
 
 def getNextClusterMove(graph, context):
@@ -133,12 +135,14 @@ class SearchContext:
         self.elementMoves = {}
         self.heap = []
         self.locked = set()
+        self.costTracker = None
         
         self.mode = "positive_moves"
         #self.mode = "adjacent_moves"
             
     def initialize(self, graph):
         Configs.log("Initializing search context data structures..")
+        self.costTracker = ClusteringCostTracker(graph, [list(c) for c in self.clusters])
         for i in range(len(self.clusters)):
             self.clusterOrders[i] = [i]
             self.clusterLL[i] = (i-1 if i > 0 else None, i+1 if i < len(self.clusters)-1 else None)
@@ -347,6 +351,7 @@ class SearchContext:
         self.clusters[src].remove(element)
         self.clusters[dest].add(element)
         self.elementClusters[element] = dest
+        self.costTracker.moveNode(element, dest)
         if self.clusterSubs[src, asub] == element:
             self.clusterSubs[src, asub] = None
         self.clusterSubs[dest, asub] = element
@@ -0,0 +1,430 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+from .alignment_graph import AlignmentGraph, clustersToArrays
+from .sparse_matrix import sumDuplicateEdges
+from .graph_build.graph_builder import BackboneMapping, backboneToPositionArrays, columnPositionsToEdges
+from .graph_cluster.clusterer import clusterGraph
+from .graph_trace.tracer import findTrace
+from .optimizer import optimizeTrace
+from .alignment_writer import writeAlignment
+from . import checkpoint
+from ..alignment_context import AlignmentContext
+from ...helpers import sequenceutils, hmmutils
+from ...tasks import task
+from ...tools import external_tools
+from ...configuration import Configs
+
+'''
+Adding new sequences to a finished MAGUS run, without redoing the decomposition, subalignments, backbones or graph.
+Each subalignment gets an HMM, and each new sequence goes to the subset whose HMM scores it best.
+New sequences are added to their subalignment with MAFFT --add, which keeps the existing alignment and only inserts gap columns.
+The inserted columns become new subalignment columns, and the existing graph and trace are renumbered around them.
+New sequences are also added to each backbone with MAFFT --add,
+so only the edges of the backbone columns the new sequences land in are recomputed.
+Finally, the trace is redone over windows around the new columns, with the configured clustering and trace methods.
+A new column can go anywhere between the trace clusters of its nearest old neighbors in its subalignment,
+so each window runs from the leftmost to the rightmost of these clusters, and overlapping windows are merged.
+Trace clusters outside the windows are kept as they are.
+Updated subalignments, subsets, backbones, graph and trace replace the old ones in the working directory, so a run can be updated repeatedly.
+Everything is written to a staging directory first, then a commit marker listing the moves is written, then the files are moved in.
+If a run dies while moving, the next run finds the marker and finishes the moves before reading anything.
+'''
+
+def preparePreviousRun(context):
+    replayCommit(context.workingDir)
+    graphDir = os.path.join(context.workingDir, "graph")
+    for checkpointFile, textFile in (("graph.bin", "graph.txt"), ("trace.bin", "trace.txt")):
+        if not os.path.exists(os.path.join(graphDir, checkpointFile)) and not os.path.exists(os.path.join(graphDir, textFile)):
+            raise Exception("Adding sequences requires a finished MAGUS run in {}, couldn't find {} or {}".format(
+                context.workingDir, checkpointFile, textFile))
+    if not Configs.constrain:
+        raise Exception("Adding sequences is only supported for constrained alignments")
+    if len(context.backbonePaths) == 0 and Configs.graphBuildMethod == "subsethmm":
+        raise Exception("Adding sequences is not supported for graphs built with subsethmm")
+    
+    for i, subalignmentPath in enumerate(context.subalignmentPaths):
+        updatedPath = os.path.join(context.workingDir, "subalignments", os.path.basename(subalignmentPath))
+        if updatedPath != subalignmentPath and os.path.exists(updatedPath):
+            Configs.log("Using previously updated subalignment {}..".format(updatedPath))
+            context.subalignmentPaths[i] = updatedPath
+
+def addSequences(context):
+    Configs.log("Adding sequences from {} to the existing alignment..".format(Configs.addSequencesPath))
+    time1 = time.time()
+
+    loadPreviousRun(context)
+    newSequences = readNewSequences(context)
+    if len(newSequences) > 0:
+        batchDir = createBatchDir(context)
+        backbones = findBackbones(context)
+        hmmPaths = buildSubalignmentHmms(context, batchDir)
+        subsetTaxa = assignNewSequences(context, newSequences, hmmPaths, batchDir)
+
+        subalignTasks = requestSubalignmentExtensionTasks(context, newSequences, subsetTaxa, batchDir)
+        backboneTasks = requestBackboneExtensionTasks(newSequences, backbones, batchDir)
+        allTasks = list(subalignTasks.values()) + list(backboneTasks.values())
+        task.submitTasks(allTasks)
+        task.awaitTasks(allTasks)
+
+        finalPaths = (list(context.subalignmentPaths), list(context.subsetPaths))
+        nodeMap = stageExtendedSubalignments(context, newSequences, subsetTaxa, subalignTasks, batchDir)
+        clusters = updateGraph(context, nodeMap, backboneTasks, newSequences, batchDir)
+        moves = stageUpdatedCheckpoints(context.graph, clusters, batchDir) + planStagedMoves(context, *finalPaths)
+        moves = moves + [(t.outputFile, backbones[backbonePath]) for backbonePath, t in backboneTasks.items()]
+        commitStagedFiles(context.workingDir, moves, [context.graph.graphPath, context.graph.clusterPath, context.graph.tracePath])
+
+    writeAlignment(context)
+    time2 = time.time()
+    Configs.log("Added {} sequences and wrote the alignment to {} in {} sec..".format(len(newSequences), context.outputFile, time2-time1))
+
+def loadPreviousRun(context):
+    context.initializeSequences()
+    context.graph = AlignmentGraph(context)
+    context.awaitSubalignments()
+    graph = context.graph
+    graph.initializeMatrix()
+
+    if os.path.exists(graph.graphCheckpointPath):
+        graph.readGraphCheckpoint(graph.graphCheckpointPath, verify = True)
+    else:
+        graph.readGraphFromFile(graph.graphPath)
+
+    if os.path.exists(graph.traceCheckpointPath):
+        graph.readClustersCheckpoint(graph.traceCheckpointPath, verify = True)
+    else:
+        graph.readClustersFromFile(graph.tracePath)
+    return graph
+
+def readNewSequences(context):
+    sequences = sequenceutils.readFromFasta(Configs.addSequencesPath, removeDashes = True)
+    newSequences = {taxon : sequence for taxon, sequence in sequences.items() if taxon not in context.unalignedSequences}
+    if len(newSequences) < len(sequences):
+        Configs.log("Skipping {} sequences that are already in the alignment..".format(len(sequences) - len(newSequences)))
+    Configs.log("Found {} new sequences to add..".format(len(newSequences)))
+    return newSequences
+
+def createBatchDir(context):
+    n = 1
+    while os.path.exists(os.path.join(context.workingDir, "add_sequences", "batch_{}".format(n))):
+        n = n + 1
+    batchDir = os.path.join(context.workingDir, "add_sequences", "batch_{}".format(n))
+    os.makedirs(os.path.join(batchDir, "staged", "subsets"))
+    return batchDir
+
+def findBackbones(context):
+    graphDir = context.graph.workingDir
+    if len(context.backbonePaths) > 0:
+        backbonePaths = list(context.backbonePaths)
+    elif Configs.graphBuildMethod == "mafft":
+        backbonePaths = [os.path.join(graphDir, "backbone_{}_mafft.txt".format(n+1)) for n in range(Configs.mafftRuns)]
+    elif Configs.graphBuildMethod == "initial":
+        backbonePaths = [os.path.join(context.workingDir, "decomposition", "initial_tree", "initial_insert_align.txt")]
+    else:
+        backbonePaths = []
+
+    backbones = {}
+    for path in backbonePaths:
+        extendedPath = os.path.join(graphDir, "extended_{}".format(os.path.basename(path)))
+        if os.path.exists(extendedPath):
+            backbones[extendedPath] = extendedPath
+        elif os.path.exists(path):
+            backbones[path] = extendedPath
+    Configs.log("Found {} backbones to extend with the new sequences..".format(len(backbones)))
+    return backbones
+
+def buildSubalignmentHmms(context, batchDir):
+    hmmPaths = []
+    buildTasks = []
+    for i, subalignmentPath in enumerate(context.subalignmentPaths):
+        hmmDir = os.path.join(batchDir, "hmm_subset_{}".format(i+1))
+        if not os.path.exists(hmmDir):
+            os.makedirs(hmmDir)
+        hmmPaths.append(os.path.join(hmmDir, "hmm_model.txt"))
+        buildTasks.append(hmmutils.buildHmmOverAlignment(subalignmentPath, hmmPaths[-1]))
+    task.submitTasks(buildTasks)
+    task.awaitTasks(buildTasks)
+    return hmmPaths
+
+def assignNewSequences(context, newSequences, hmmPaths, batchDir):
+    queriesPath = os.path.join(batchDir, "queries.txt")
+    sequenceutils.writeFasta(newSequences, queriesPath)
+    scoreFileHmmFileMap = {}
+    searchTasks = hmmutils.buildHmmScores(hmmPaths, queriesPath, scoreFileHmmFileMap)
+    task.submitTasks(searchTasks)
+    task.awaitTasks(searchTasks)
+
+    hmmSubsets = {hmmPath : i for i, hmmPath in enumerate(hmmPaths)}
+    bestScores = {}
+    for scoreFile, taxonScores in hmmutils.readHmmScores([t.outputFile for t in searchTasks]).items():
+        i = hmmSubsets[scoreFileHmmFileMap[scoreFile]]
+        for taxon, score in taxonScores.items():
+            if taxon not in bestScores or score > bestScores[taxon][0]:
+                bestScores[taxon] = (score, i)
+
+    largestSubset = max(range(len(context.subsets)), key = lambda i: len(context.subsets[i]))
+    subsetTaxa = {}
+    for taxon in newSequences:
+        if taxon not in bestScores:
+            Configs.log("No HMM scored sequence {}, adding it to the largest subset..".format(taxon))
+        i = bestScores[taxon][1] if taxon in bestScores else largestSubset
+        subsetTaxa[i] = subsetTaxa.get(i, [])
+        subsetTaxa[i].append(taxon)
+    Configs.log("Assigned {} new sequences to {} subsets..".format(len(newSequences), len(subsetTaxa)))
+    return subsetTaxa
+
+def requestSubalignmentExtensionTasks(context, newSequences, subsetTaxa, batchDir):
+    addTasks = {}
+    for i, taxa in subsetTaxa.items():
+        subalignmentPath = context.subalignmentPaths[i]
+        workingDir = os.path.join(batchDir, "hmm_subset_{}".format(i+1))
+        queriesPath = os.path.join(workingDir, "queries.txt")
+        sequenceutils.writeFasta(newSequences, queriesPath, taxa)
+        stagedPath = os.path.join(batchDir, "staged", os.path.basename(subalignmentPath))
+        addTasks[i] = external_tools.runMafftAdd(queriesPath, subalignmentPath, workingDir, stagedPath, Configs.numCores)
+    return addTasks
+
+def requestBackboneExtensionTasks(newSequences, backbones, batchDir):
+    queriesPath = os.path.join(batchDir, "queries.txt")
+    addTasks = {}
+    for backbonePath, extendedPath in backbones.items():
+        stagedPath = os.path.join(batchDir, "staged", os.path.basename(extendedPath))
+        addTasks[backbonePath] = external_tools.runMafftAdd(queriesPath, backbonePath, batchDir, stagedPath, Configs.numCores)
+    return addTasks
+
+def stageExtendedSubalignments(context, newSequences, subsetTaxa, subalignTasks, batchDir):
+    stagedDir = os.path.join(batchDir, "staged")
+    nodeMap = []
+    for i, subalignmentPath in enumerate(list(context.subalignmentPaths)):
+        if i not in subsetTaxa:
+            nodeMap.append(np.arange(context.graph.subalignmentLengths[i], dtype = np.int64))
+            continue
+
+        stagedPath = subalignTasks[i].outputFile
+        nodeMap.append(extendSubalignment(subalignmentPath, stagedPath, subsetTaxa[i]))
+
+        if context.subsetPaths[i] == subalignmentPath:
+            context.subsetPaths[i] = stagedPath
+        else:
+            stagedSubsetPath = os.path.join(stagedDir, "subsets", os.path.basename(context.subsetPaths[i]))
+            shutil.copyfile(context.subsetPaths[i], stagedSubsetPath)
+            sequenceutils.writeFasta(newSequences, stagedSubsetPath, subsetTaxa[i], True)
+            context.subsetPaths[i] = stagedSubsetPath
+        context.subalignmentPaths[i] = stagedPath
+    return nodeMap
+
+def extendSubalignment(subalignmentPath, extendedPath, taxa):
+    alignment = sequenceutils.PackedAlignment.fromFasta(subalignmentPath)
+    extended = sequenceutils.PackedAlignment.fromFasta(extendedPath)
+    rows = {tag : k for k, tag in enumerate(extended.tags)}
+    if any(tag not in rows for tag in alignment.tags + taxa):
+        raise Exception("MAFFT --add output {} is missing sequences of {}".format(extendedPath, subalignmentPath))
+
+    oldRows = extended.matrix[[rows[tag] for tag in alignment.tags]]
+    columnMap = np.flatnonzero(sequenceutils.PackedAlignment(alignment.tags, oldRows).letterCounts() > 0)
+    table = sequenceutils.PackedAlignment.lowerTable
+    if len(columnMap) != alignment.numColumns() or not np.array_equal(table[oldRows[:, columnMap]], table[alignment.matrix]):
+        raise Exception("MAFFT --add changed the existing alignment of {}".format(subalignmentPath))
+
+    matrix = np.full((alignment.numTaxa() + len(taxa), extended.numColumns()), sequenceutils.PackedAlignment.gapChar, dtype = np.uint8)
+    matrix[:alignment.numTaxa(), columnMap] = alignment.matrix
+    matrix[alignment.numTaxa():] = extended.matrix[[rows[tag] for tag in taxa]]
+    sequenceutils.PackedAlignment(alignment.tags + list(taxa), matrix).writeFasta(extendedPath)
+    Configs.log("Extended subalignment {} from {} to {} columns..".format(subalignmentPath, alignment.numColumns(), extended.numColumns()))
+    return columnMap
+
+def updateGraph(context, nodeMap, backboneTasks, newSequences, batchDir):
+    graph = context.graph
+    oldLengths = list(graph.subalignmentLengths)
+    rows, cols, weights = [np.array(array) for array in graph.matrix.getEdgeArrays()]
+    trace = graph.clusters
+    clusters = None
+    if os.path.exists(graph.clusterCheckpointPath):
+        clusters = checkpoint.checkpointArraysToClusters(checkpoint.readCheckpoint(graph.clusterCheckpointPath, "clusters", oldLengths, verify = True))
+
+    context.initializeSequences()
+    graph.initializeMatrix()
+    nodeMap = np.concatenate([graph.subsetMatrixIdx[i] + columnMap for i, columnMap in enumerate(nodeMap)])
+    graph.addEdges(nodeMap[rows], nodeMap[cols], weights)
+    graph.clusters = remapClusters(trace, nodeMap)
+    if clusters is not None:
+        clusters = remapClusters(clusters, nodeMap)
+
+    backboneAligns = readBackboneAlignments(context, backboneTasks, newSequences)
+    context.backboneTaxa = {taxon : None for baseAlign, newAlign in backboneAligns for taxon in list(baseAlign) + list(newAlign)}
+    context.initializeBackboneSequenceMapping()
+    mapping = BackboneMapping.fromContext(context)
+    for baseAlign, newAlign in backboneAligns:
+        graph.addEdges(*computeEdgeDelta(mapping, baseAlign, newAlign))
+    Configs.log("Updated the alignment graph with {} backbones..".format(len(backboneAligns)))
+
+    newNodes = np.setdiff1d(np.arange(graph.matrixSize, dtype = np.int64), nodeMap)
+    retraceWindows(graph, newNodes, batchDir)
+    return clusters
+
+def stageUpdatedCheckpoints(graph, clusters, batchDir):
+    stagedDir = os.path.join(batchDir, "staged")
+    moves = [(os.path.join(stagedDir, "graph.bin"), graph.graphCheckpointPath), (os.path.join(stagedDir, "trace.bin"), graph.traceCheckpointPath)]
+    graph.writeGraphCheckpoint(moves[0][0])
+    graph.writeClustersCheckpoint(moves[1][0])
+    if clusters is not None:
+        moves.append((os.path.join(stagedDir, "clusters.bin"), graph.clusterCheckpointPath))
+        checkpoint.writeCheckpoint(moves[-1][0], "clusters", graph.subalignmentLengths, checkpoint.clustersToCheckpointArrays(clusters))
+    return moves
+
+def remapClusters(clusters, nodeMap):
+    nodes = nodeMap[clustersToArrays(clusters)[0]].tolist()
+    sizes = [len(cluster) for cluster in clusters]
+    starts = np.cumsum([0] + sizes).tolist()
+    return [nodes[starts[i] : starts[i+1]] for i in range(len(clusters))]
+
+def readBackboneAlignments(context, backboneTasks, newSequences):
+    backboneAligns = []
+    for backbonePath, addTask in backboneTasks.items():
+        extendedAlign = sequenceutils.readFromFasta(addTask.outputFile)
+        baseAlign = {taxon : sequence for taxon, sequence in extendedAlign.items()
+                     if taxon in context.taxonSubalignmentMap and taxon not in newSequences}
+        newAlign = {taxon : sequence for taxon, sequence in extendedAlign.items() if taxon in newSequences}
+        backboneAligns.append((baseAlign, newAlign))
+    return backboneAligns
+
+def computeEdgeDelta(mapping, baseAlign, newAlign):
+    baseColumns, baseNodes = backboneToPositionArrays(mapping, baseAlign)
+    newColumns, newNodes = backboneToPositionArrays(mapping, newAlign)
+    touched = np.isin(baseColumns, newColumns)
+    baseColumns, baseNodes = baseColumns[touched], baseNodes[touched]
+
+    oldRows, oldCols, oldWeights = columnPositionsToEdges(mapping, baseColumns, baseNodes)
+    rows, cols, weights = columnPositionsToEdges(mapping, np.concatenate((baseColumns, newColumns)), np.concatenate((baseNodes, newNodes)))
+    rows, cols, weights = sumDuplicateEdges(np.concatenate((rows, oldRows)), np.concatenate((cols, oldCols)),
+                                            np.concatenate((weights, -oldWeights)), mapping.matrixSize)
+    keep = weights != 0
+    return rows[keep], cols[keep], weights[keep]
+
+def retraceWindows(graph, newNodes, batchDir):
+    windows = findRetraceWindows(graph, newNodes)
+    Configs.log("Retracing {} windows around {} new columns..".format(len(windows), len(newNodes)))
+    for n, (lo, hi) in reversed(list(enumerate(windows))):
+        windowClusters = traceWindow(graph, lo, hi, os.path.join(batchDir, "window_{}".format(n+1)))
+        graph.clusters = graph.clusters[:lo] + windowClusters + graph.clusters[hi+1:]
+    Configs.log("Updated trace has {} clusters and a total cost of {}".format(len(graph.clusters), graph.computeClusteringCost(graph.clusters)))
+
+def findRetraceWindows(graph, newNodes):
+    nodeClusters = np.full(graph.matrixSize, -1, dtype = np.int64)
+    nodes, clusterIdxs = clustersToArrays(graph.clusters)
+    nodeClusters[nodes] = clusterIdxs
+
+    intervals = []
+    for i, length in enumerate(graph.subalignmentLengths):
+        start = graph.subsetMatrixIdx[i]
+        clustered = np.flatnonzero(nodeClusters[start : start + length] >= 0)
+        subNew = newNodes[(newNodes >= start) & (newNodes < start + length)] - start
+        if len(subNew) == 0:
+            continue
+        if len(clustered) == 0:
+            intervals.append((0, len(graph.clusters) - 1))
+            continue
+        idxs = np.searchsorted(clustered, subNew)
+        clusterIdxs = nodeClusters[start + clustered]
+        left = np.where(idxs > 0, clusterIdxs[np.maximum(idxs - 1, 0)], 0)
+        right = np.where(idxs < len(clustered), clusterIdxs[np.minimum(idxs, len(clustered) - 1)], len(graph.clusters) - 1)
+        intervals.extend(zip(left.tolist(), right.tolist()))
+
+    windows = []
+    for lo, hi in sorted(intervals):
+        if len(windows) > 0 and lo <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], hi)
+        else:
+            windows.append([lo, hi])
+    return [(lo, hi) for lo, hi in windows]
+
+def traceWindow(graph, lo, hi, windowDir):
+    '''
+    Every old column between the clusters before and after the window is freed, along with the window's own clusters.
+    The clusters keep the trace order in every subalignment, so the freed columns are one contiguous range per subalignment.
+    '''
+
+    before, after = graph.clusters[:lo], graph.clusters[hi+1:]
+    starts = np.array(graph.subsetMatrixIdx, dtype = np.int64)
+    ends = starts + np.array(graph.subalignmentLengths, dtype = np.int64)
+    if len(before) > 0:
+        nodes = clustersToArrays(before)[0]
+        np.maximum.at(starts, graph.nodeSubalignments[nodes], nodes + 1)
+    if len(after) > 0:
+        nodes = clustersToArrays(after)[0]
+        np.minimum.at(ends, graph.nodeSubalignments[nodes], nodes)
+
+    subs = [i for i in range(len(starts)) if ends[i] > starts[i]]
+    windowNodes = np.concatenate([np.arange(starts[i], ends[i], dtype = np.int64) for i in subs]) if len(subs) > 0 else np.zeros(0, dtype = np.int64)
+    localNodes = np.full(graph.matrixSize, -1, dtype = np.int64)
+    localNodes[windowNodes] = np.arange(len(windowNodes))
+
+    indptr, indices, weights = graph.matrix.getCsr()
+    degrees = indptr[windowNodes + 1] - indptr[windowNodes]
+    entries = np.repeat(indptr[windowNodes] - np.cumsum(degrees) + degrees, degrees) + np.arange(int(degrees.sum()))
+    rows, cols = np.repeat(localNodes[windowNodes], degrees), localNodes[indices[entries]]
+    keep = cols >= 0
+
+    windowContext = AlignmentContext(workingDir = windowDir, outputFile = None)
+    windowContext.subalignments = [[] for i in subs]
+    windowGraph = AlignmentGraph(windowContext)
+    windowGraph.initializeMatrix([int(ends[i] - starts[i]) for i in subs])
+    windowGraph.addEdges(rows[keep], cols[keep], np.asarray(weights)[entries][keep])
+    Configs.log("Retracing trace clusters {} to {} over {} columns..".format(lo, hi, len(windowNodes)))
+
+    clusterGraph(windowGraph)
+    findTrace(windowGraph)
+    optimizeTrace(windowGraph)
+    return [sorted(windowNodes[cluster].tolist()) for cluster in windowGraph.clusters if len(cluster) > 1]
+
+def planStagedMoves(context, subalignmentPaths, subsetPaths):
+    moves = []
+    for i, (stagedPath, stagedSubsetPath) in enumerate(zip(list(context.subalignmentPaths), list(context.subsetPaths))):
+        if stagedPath == subalignmentPaths[i]:
+            continue
+        finalPath = subalignmentPaths[i]
+        if os.path.commonpath([context.workingDir, os.path.abspath(finalPath)]) != context.workingDir:
+            finalPath = os.path.join(context.workingDir, "subalignments", os.path.basename(finalPath))
+            Configs.log("Subalignment {} is outside the working directory, writing the updated copy to {}..".format(subalignmentPaths[i], finalPath))
+            Configs.log("Later runs that add sequences to this working directory will pick up the updated copy..")
+            os.makedirs(os.path.dirname(finalPath), exist_ok = True)
+        moves.append((stagedPath, finalPath))
+        context.subalignmentPaths[i] = finalPath
+
+        if stagedSubsetPath == stagedPath:
+            context.subsetPaths[i] = finalPath
+        else:
+            moves.append((stagedSubsetPath, subsetPaths[i]))
+            context.subsetPaths[i] = subsetPaths[i]
+    return moves
+
+def commitStagedFiles(workingDir, moves, stalePaths):
+    markerPath = os.path.join(workingDir, "add_sequences", "commit.json")
+    with open(markerPath + ".tmp", 'w') as file:
+        json.dump({"moves" : moves, "stale" : stalePaths}, file)
+    os.replace(markerPath + ".tmp", markerPath)
+    applyCommit(markerPath)
+
+def replayCommit(workingDir):
+    markerPath = os.path.join(workingDir, "add_sequences", "commit.json")
+    if os.path.exists(markerPath):
+        Configs.log("Found an unfinished commit from a previous run, finishing it..")
+        applyCommit(markerPath)
+
+def applyCommit(markerPath):
+    with open(markerPath) as file:
+        commit = json.load(file)
+    for stagedPath, finalPath in commit["moves"]:
+        if os.path.exists(stagedPath):
+            shutil.move(stagedPath, finalPath)
+    for stalePath in commit["stale"]:
+        if os.path.exists(stalePath):
+            os.remove(stalePath)
+    os.remove(markerPath)
@@ -0,0 +1,38 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+'''
+NumPy arrays in shared memory, to hand large read-only arrays (like the graph's CSR arrays) to worker processes without copying them.
+The owner shares the arrays and gets back picklable specs (block name, shape, dtype), workers attach to them by the specs.
+The owner releases the blocks when the workers are done. Needs Python 3.8+, check available() first.
+'''
+
+def available():
+    return shared_memory is not None
+
+def shareArrays(arrays):
+    blocks, specs = [], []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+        blocks.append(block)
+        np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+        specs.append((block.name, array.shape, array.dtype.str))
+    return blocks, specs
+
+def attachArrays(specs):
+    blocks = [shared_memory.SharedMemory(name = name) for name, shape, dtype in specs]
+    arrays = [np.ndarray(shape, dtype = np.dtype(dtype), buffer = block.buf) for block, (name, shape, dtype) in zip(blocks, specs)]
+    return blocks, arrays
+
+def releaseArrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,165 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import bisect
+import threading
+import numpy as np
+
+'''
+Compressed sparse row (CSR) storage for the alignment graph.
+Rows are nodes, and each row holds its neighbors (int32, sorted) and edge weights (int32 when they fit).
+Edges are added in COO blocks, which are summed and merged into the CSR arrays on the next read.
+Pending blocks are also merged once they hold more entries than the CSR arrays, or more than PENDING_EDGES_CAP,
+so building from many backbones never holds much more than the final graph plus one merge.
+Rows can be read like the old adjacency dicts, e.g. matrix[a].items(), matrix[a].get(b, 0), b in matrix[a].
+'''
+
+PENDING_EDGES_CAP = 50000000
+
+class SparseMatrix:
+
+    def __init__(self, size):
+        self.size = size
+        self.indptr = np.zeros(size + 1, dtype = np.int64)
+        self.indices = np.zeros(0, dtype = np.int32)
+        self.weights = np.zeros(0, dtype = np.int32)
+        self.pendingBlocks = []
+        self.pendingEdges = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if len(self.pendingBlocks) > 0:
+            self.compact()
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return SparseRow(self.indices[start : end], self.weights[start : end])
+
+    def numEdges(self):
+        if len(self.pendingBlocks) > 0:
+            self.compact()
+        return len(self.indices)
+
+    def addEdges(self, rows, cols, weights):
+        rows = np.asarray(rows, dtype = np.int32)
+        cols = np.asarray(cols, dtype = np.int32)
+        weights = compactWeights(np.asarray(weights, dtype = np.int64))
+        if len(rows) == 0:
+            return
+        with self.lock:
+            self.pendingBlocks.append((rows, cols, weights))
+            self.pendingEdges = self.pendingEdges + len(rows)
+            merge = self.pendingEdges > len(self.indices) or self.pendingEdges > PENDING_EDGES_CAP
+        if merge:
+            self.compact()
+
+    def setEdges(self, rows, cols, weights):
+        with self.lock:
+            self.pendingBlocks = []
+            self.pendingEdges = 0
+            self.indptr = np.zeros(self.size + 1, dtype = np.int64)
+            self.indices = np.zeros(0, dtype = np.int32)
+            self.weights = np.zeros(0, dtype = np.int32)
+        self.addEdges(rows, cols, weights)
+        self.compact()
+
+    def setCsr(self, indptr, indices, weights):
+        with self.lock:
+            self.pendingBlocks = []
+            self.pendingEdges = 0
+            self.indptr, self.indices, self.weights = indptr, indices, weights
+
+    def getCsr(self):
+        if len(self.pendingBlocks) > 0:
+            self.compact()
+        return self.indptr, self.indices, self.weights
+
+    def compact(self):
+        with self.lock:
+            if len(self.pendingBlocks) == 0:
+                return
+            rows, cols, weights = self.getEdgeArraysUnsafe()
+            blocks = [(rows, cols, weights)] + self.pendingBlocks
+            rows = np.concatenate([b[0] for b in blocks])
+            cols = np.concatenate([b[1] for b in blocks])
+            weights = np.concatenate([b[2].astype(np.int64) for b in blocks])
+            self.pendingBlocks = []
+            self.pendingEdges = 0
+
+            rows, cols, weights = sumDuplicateEdges(rows, cols, weights, self.size)
+            self.indptr = np.zeros(self.size + 1, dtype = np.int64)
+            np.cumsum(np.bincount(rows, minlength = self.size), out = self.indptr[1:])
+            self.indices = cols.astype(np.int32)
+            self.weights = compactWeights(weights)
+
+    def getEdgeArrays(self):
+        if len(self.pendingBlocks) > 0:
+            self.compact()
+        return self.getEdgeArraysUnsafe()
+
+    def getEdgeArraysUnsafe(self):
+        rows = np.repeat(np.arange(self.size, dtype = np.int32), np.diff(self.indptr))
+        return rows, self.indices, self.weights
+
+
+class SparseRow:
+
+    def __init__(self, cols, weights):
+        self.cols = cols
+        self.weights = weights
+        self.colList = None
+
+    def __len__(self):
+        return len(self.cols)
+
+    def __iter__(self):
+        return iter(self.cols.tolist())
+
+    def __contains__(self, col):
+        return self.find(col) is not None
+
+    def __getitem__(self, col):
+        idx = self.find(col)
+        if idx is None:
+            raise KeyError(col)
+        return int(self.weights[idx])
+
+    def get(self, col, default = None):
+        idx = self.find(col)
+        return default if idx is None else int(self.weights[idx])
+
+    def find(self, col):
+        if self.colList is None:
+            self.colList = self.cols.tolist()
+        idx = bisect.bisect_left(self.colList, col)
+        if idx < len(self.colList) and self.colList[idx] == col:
+            return idx
+        return None
+
+    def keys(self):
+        return self.cols.tolist()
+
+    def values(self):
+        return self.weights.tolist()
+
+    def items(self):
+        return list(zip(self.cols.tolist(), self.weights.tolist()))
+
+
+def sumDuplicateEdges(rows, cols, weights, size):
+    keys = rows.astype(np.int64) * size + cols
+    order = np.argsort(keys, kind = "stable")
+    keys = keys[order]
+    if len(keys) == 0:
+        return rows[:0].astype(np.int64), cols[:0].astype(np.int64), weights[:0].astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    weights = np.add.reduceat(weights[order].astype(np.int64), starts)
+    keys = keys[starts]
+    return keys // size, keys % size, weights
+
+def compactWeights(weights):
+    if len(weights) == 0 or (weights.max() <= np.iinfo(np.int32).max and weights.min() >= np.iinfo(np.int32).min):
+        return weights.astype(np.int32)
+    return weights.astype(np.int64)
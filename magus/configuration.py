@@ -6,6 +6,7 @@ Created on Apr 14, 2020
 
 import os
 import time
+import types
 from sys import stderr
 
 from .helpers import sequenceutils
@@ -27,6 +28,7 @@ class Configs:
     guideTree = "fasttree"
     outputPath = None
     dataType = None
+    addSequencesPath = None
     
     decompositionMaxNumSubsets = 25
     decompositionMaxSubsetSize = 50
@@ -40,10 +42,12 @@ class Configs:
     graphClusterMethod = "mcl" 
     graphTraceMethod = "minclusters"
     graphTraceOptimize = False
+    graphTraceKernels = True
     
     mafftRuns = 10
     mafftSize = 200
     mclInflationFactor = 4
+    mclWindowSize = 1000
     
     constrain = True
     onlyGuideTree = False
@@ -68,7 +72,11 @@ class Configs:
     debugPath = None
     
     numCores = 1
+    taskExecutor = "threads"
     searchHeapLimit = 5000
+    searchStrategy = "restart"
+    searchMemoryBudget = 1024
+    searchTimeBudget = 0
     alignmentSizeLimit = 100
     
     @staticmethod
@@ -101,6 +109,15 @@ class Configs:
             Configs.log("Data type wasn't specified. Inferred data type {} from {}".format(Configs.dataType.upper(), sequencesFile))
         return Configs.dataType 
 
+def configsSnapshot():
+    return {attr : value for attr, value in vars(Configs).items()
+            if not attr.startswith("__") and not isinstance(value, (staticmethod, classmethod, types.FunctionType))}
+
+def initializeWorker(configs):
+    for attr, value in configs.items():
+        setattr(Configs, attr, value)
+    Configs.numCores = 1
+
 def buildConfigs(args):
     Configs.outputPath = os.path.abspath(args.output) if args.output != '-' else "/dev/stdout"
     
@@ -112,6 +129,7 @@ def buildConfigs(args):
         os.makedirs(Configs.workingDir)
     
     Configs.sequencesPath = os.path.abspath(args.sequences) if args.sequences is not None else Configs.sequencesPath
+    Configs.addSequencesPath = os.path.abspath(args.addsequences) if args.addsequences is not None else None
     
     Configs.guideTree = os.path.abspath(args.guidetree) if args.guidetree is not None else Configs.guideTree
     if args.guidetree is not None:
@@ -122,7 +140,8 @@ def buildConfigs(args):
         path = os.path.abspath(p)
         if os.path.isdir(path):
             for filename in os.listdir(path):
-                Configs.subalignmentPaths.append(os.path.join(path, filename))
+                if not filename.startswith("."):
+                    Configs.subalignmentPaths.append(os.path.join(path, filename))
         else:
             Configs.subalignmentPaths.append(path)
     
@@ -131,7 +150,8 @@ def buildConfigs(args):
         path = os.path.abspath(p)
         if os.path.isdir(path):
             for filename in os.listdir(path):
-                Configs.backbonePaths.append(os.path.join(path, filename))
+                if not filename.startswith("."):
+                    Configs.backbonePaths.append(os.path.join(path, filename))
         else:
             Configs.backbonePaths.append(path)
 
@@ -139,6 +159,7 @@ def buildConfigs(args):
         Configs.numCores = args.numprocs
     else:
         Configs.numCores = os.cpu_count()
+    Configs.taskExecutor = args.taskexecutor
 
     Configs.decompositionMaxSubsetSize = args.maxsubsetsize
     Configs.decompositionMaxNumSubsets = args.maxnumsubsets
@@ -152,10 +173,15 @@ def buildConfigs(args):
     Configs.graphClusterMethod = args.graphclustermethod
     Configs.graphTraceMethod = args.graphtracemethod
     Configs.graphTraceOptimize = args.graphtraceoptimize.lower() == "true"
+    Configs.graphTraceKernels = args.graphtracekernels.lower() == "true"
+    Configs.searchStrategy = args.searchstrategy
+    Configs.searchMemoryBudget = args.searchmemory
+    Configs.searchTimeBudget = args.searchtime
 
     Configs.mafftRuns = args.mafftruns
     Configs.mafftSize = args.mafftsize
     Configs.mclInflationFactor = args.inflationfactor
+    Configs.mclWindowSize = args.mclwindowsize
     
     Configs.constrain = args.constrain.lower() == "true"
     Configs.onlyGuideTree = args.onlyguidetree.lower() == "true"
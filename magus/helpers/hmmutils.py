@@ -58,7 +58,7 @@ def buildHmmScores(hmmPaths, queriesPath, scoreFileHmmFileMap):
 def getHmmScores(hmmPath, queriesPath, scorePath):
     workingDir = os.path.dirname(hmmPath)
     #searchPath = os.path.join(workingDir, "hmm_search.txt")
-    task = external_tools.runHmmSearch(hmmPath, queriesPath, workingDir, scorePath)
+    task = external_tools.runHmmSearch(hmmPath, queriesPath, workingDir, scorePath, Configs.numCores)
     return task
 
 def readHmmScores(searchFiles):
@@ -75,7 +75,7 @@ def buildHmms(sequencesHmmsPathsMap):
     
 def buildHmmOverAlignment(sequencePath, hmmPath):
     workingDir = os.path.dirname(hmmPath)
-    task = external_tools.runHmmBuild(sequencePath, workingDir, hmmPath)
+    task = external_tools.runHmmBuild(sequencePath, workingDir, hmmPath, Configs.numCores)
     return task
 
 def combineHmmAlignments(alignFiles, outputAlignmentPath, includeInsertions):
@@ -0,0 +1,160 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import os
+import csv
+import json
+import time
+import threading
+import contextlib
+import subprocess
+
+from ..configuration import Configs
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+'''
+Lightweight instrumentation for MAGUS runs.
+Stages (decomposition, graph build, clustering, etc) and tasks are recorded with their wall time,
+CPU time of this process and of finished child processes (the external tools), and peak RSS.
+External tool calls are recorded with their duration, CPU time and peak RSS, taken from their own exit status.
+Each stage counts the process-wide usage and the calls that finished while it ran.
+Tasks run concurrently, so each task only counts its own work: the CPU time of its thread (or its worker process),
+and the tool calls it made itself. Serial tasks nested on the same thread are not counted in the outer task.
+Peak RSS is a process-wide high-water mark, so tasks don't report their own; their childPeakRssMb is the largest peak among their tool calls.
+Recursive subalignments are told apart by their working directory (tasks by their output directory), relative to the main one.
+Records from worker processes are sent back and merged, and the main process writes
+profile.json and profile.csv into the working directory when the run ends.
+'''
+
+records = []
+toolCalls = []
+recordsLock = threading.Lock()
+taskFrames = threading.local()
+
+CSV_FIELDS = ["kind", "name", "alignment", "wallSeconds", "cpuSeconds", "childCpuSeconds",
+              "peakRssMb", "childPeakRssMb", "toolCalls", "toolSeconds", "outputFile", "failed"]
+
+def readUsage():
+    if resource is None:
+        return {"cpu" : time.process_time(), "childCpu" : 0, "peakRss" : 0, "childPeakRss" : 0}
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"cpu" : own.ru_utime + own.ru_stime, "childCpu" : children.ru_utime + children.ru_stime,
+            "peakRss" : own.ru_maxrss / 1024, "childPeakRss" : children.ru_maxrss / 1024}
+
+def readThreadCpu():
+    return time.thread_time() if hasattr(time, "thread_time") else 0
+
+def runProcess(command, **kwargs):
+    process = subprocess.Popen(command, **kwargs)
+    if not hasattr(os, "wait4"):
+        stdout, stderr = process.communicate()
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr), None, None
+    with process.stdout:
+        stdout = process.stdout.read()
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, None), usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+def alignmentName(workingDir):
+    if workingDir is None or Configs.workingDir is None:
+        return "."
+    return os.path.relpath(workingDir, Configs.workingDir)
+
+@contextlib.contextmanager
+def stage(name, workingDir = None):
+    startTime, startUsage, startCalls = time.time(), readUsage(), len(toolCalls)
+    try:
+        yield
+    finally:
+        addRecord("stage", name, workingDir, startTime, startUsage, startCalls)
+
+def startTask():
+    if not hasattr(taskFrames, "stack"):
+        taskFrames.stack = []
+    taskFrames.stack.append({"calls" : [], "workerCpu" : 0, "nestedCpu" : 0})
+    return time.time(), readThreadCpu()
+
+def recordTask(t, startTime, startCpu, failed):
+    frame = taskFrames.stack.pop()
+    threadCpu = readThreadCpu() - startCpu
+    if len(taskFrames.stack) > 0:
+        taskFrames.stack[-1]["nestedCpu"] = taskFrames.stack[-1]["nestedCpu"] + threadCpu
+    calls = frame["calls"]
+    with recordsLock:
+        records.append({"kind" : "task", "name" : t.taskType, "alignment" : alignmentName(os.path.dirname(t.outputFile)),
+                        "wallSeconds" : time.time() - startTime,
+                        "cpuSeconds" : threadCpu - frame["nestedCpu"] + frame["workerCpu"],
+                        "childCpuSeconds" : sum(c["cpuSeconds"] or 0 for c in calls),
+                        "peakRssMb" : None, "childPeakRssMb" : max((c["peakRssMb"] or 0 for c in calls), default = None),
+                        "toolCalls" : len(calls), "toolSeconds" : sum(c["seconds"] for c in calls),
+                        "outputFile" : t.outputFile, "failed" : failed})
+
+def currentTaskFrame():
+    stack = getattr(taskFrames, "stack", None)
+    return stack[-1] if stack else None
+
+def recordToolCall(command, seconds, cpuSeconds = None, peakRssMb = None):
+    call = {"tool" : os.path.basename(command.split(" ", 1)[0].strip('"')), "seconds" : seconds, "cpuSeconds" : cpuSeconds, "peakRssMb" : peakRssMb}
+    frame = currentTaskFrame()
+    if frame is not None:
+        frame["calls"].append(call)
+    with recordsLock:
+        toolCalls.append(call)
+
+def addRecord(kind, name, workingDir, startTime, startUsage, startCalls):
+    usage = readUsage()
+    with recordsLock:
+        calls = toolCalls[startCalls:]
+        records.append({"kind" : kind, "name" : name, "alignment" : alignmentName(workingDir),
+                        "wallSeconds" : time.time() - startTime,
+                        "cpuSeconds" : usage["cpu"] - startUsage["cpu"],
+                        "childCpuSeconds" : usage["childCpu"] - startUsage["childCpu"],
+                        "peakRssMb" : usage["peakRss"], "childPeakRssMb" : usage["childPeakRss"],
+                        "toolCalls" : len(calls), "toolSeconds" : sum(c["seconds"] for c in calls),
+                        "outputFile" : None, "failed" : False})
+
+def takeRecords(startUsage = None):
+    global records, toolCalls
+    cpuSeconds = readUsage()["cpu"] - startUsage["cpu"] if startUsage is not None else 0
+    with recordsLock:
+        exported = {"records" : records, "toolCalls" : toolCalls, "cpuSeconds" : cpuSeconds}
+        records, toolCalls = [], []
+    return exported
+
+def mergeRecords(exported):
+    frame = currentTaskFrame()
+    if frame is not None:
+        frame["calls"].extend(exported["toolCalls"])
+        frame["workerCpu"] = frame["workerCpu"] + exported["cpuSeconds"]
+    with recordsLock:
+        records.extend(exported["records"])
+        toolCalls.extend(exported["toolCalls"])
+
+def writeReport(totalSeconds):
+    with recordsLock:
+        tools = {}
+        for call in toolCalls:
+            summary = tools.setdefault(call["tool"], {"calls" : 0, "seconds" : 0, "peakRssMb" : 0})
+            summary["calls"] = summary["calls"] + 1
+            summary["seconds"] = summary["seconds"] + call["seconds"]
+            summary["peakRssMb"] = max(summary["peakRssMb"], call.get("peakRssMb") or 0)
+        usage = readUsage()
+        report = {"wallSeconds" : totalSeconds, "cpuSeconds" : usage["cpu"], "childCpuSeconds" : usage["childCpu"],
+                  "peakRssMb" : usage["peakRss"], "childPeakRssMb" : usage["childPeakRss"],
+                  "numCores" : Configs.numCores, "tools" : tools, "records" : records}
+
+        jsonPath = os.path.join(Configs.workingDir, "profile.json")
+        with open(jsonPath, 'w') as jsonFile:
+            json.dump(report, jsonFile, indent = 1)
+
+        csvPath = os.path.join(Configs.workingDir, "profile.csv")
+        with open(csvPath, 'w', newline = '') as csvFile:
+            writer = csv.DictWriter(csvFile, fieldnames = CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    Configs.log("Wrote the profiling report to {} and {}..".format(jsonPath, csvPath))
@@ -4,8 +4,18 @@ Created on Sep 22, 2018
 @author: Vlad
 '''
 
+import os
+import mmap
+import gzip
+import bz2
+import lzma
+import socket
 from sys import stderr
 
+import numpy as np
+
+WRITE_BUFFER_SIZE = 1 << 20
+FASTA_INDEX_VERSION = 2
 
 class Sequence:
     def __init__(self, tag, seq):
@@ -15,18 +25,24 @@ class Sequence:
 def readFromFasta(filePath, removeDashes = False):
     sequences = {}
     currentSequence = None
+    lines = []
 
     with open(filePath) as f:
         for line in f:
             line = line.strip()
-            if line.startswith('>'):                    
+            if line.startswith('>'):
+                if currentSequence is not None:
+                    currentSequence.seq = "".join(lines)
                 tag = line[1:]
                 currentSequence = Sequence(tag, "")
                 sequences[tag] = currentSequence
+                lines = []
             else :
                 if(removeDashes):
                     line = line.replace("-", "")
-                currentSequence.seq = currentSequence.seq + line
+                lines.append(line)
+        if currentSequence is not None:
+            currentSequence.seq = "".join(lines)
 
     print("Read " + str(len(sequences)) + " sequences from " + filePath + " ..", file=stderr)
     return sequences
@@ -34,22 +50,48 @@ def readFromFasta(filePath, removeDashes = False):
 def readFromFastaOrdered(filePath, removeDashes = False):
     sequences = []
     currentSequence = None
+    lines = []
 
     with open(filePath) as f:
         for line in f:
             line = line.strip()
-            if line.startswith('>'):                    
+            if line.startswith('>'):
+                if currentSequence is not None:
+                    currentSequence.seq = "".join(lines)
                 tag = line[1:]
                 currentSequence = Sequence(tag, "")
                 sequences.append(currentSequence)
+                lines = []
             else :
                 if(removeDashes):
                     line = line.replace("-", "")
-                currentSequence.seq = currentSequence.seq + line
+                lines.append(line)
+        if currentSequence is not None:
+            currentSequence.seq = "".join(lines)
 
     print("Read " + str(len(sequences)) + " sequences from " + filePath + " ..", file=stderr)
     return sequences
 
+def readFromFastaIndexed(filePath, taxa = None, removeDashes = False):
+    index = FastaIndex(filePath)
+    sequences = {}
+    for tag in (index.tags if taxa is None else taxa):
+        seq = index.getSequence(tag)
+        sequences[tag] = Sequence(tag, seq.replace("-", "") if removeDashes else seq)
+    index.close()
+    
+    print("Read " + str(len(sequences)) + " sequences from " + filePath + " ..", file=stderr)
+    return sequences
+
+def iterateFasta(filePath, removeDashes = False):
+    index = FastaIndex(filePath)
+    try:
+        for tag in index.tags:
+            seq = index.getSequence(tag)
+            yield Sequence(tag, seq.replace("-", "") if removeDashes else seq)
+    finally:
+        index.close()
+
 def readFromPhylip(filePath, removeDashes = False):
     sequences = {}    
 
@@ -108,6 +150,16 @@ def writeFasta(alignment, filePath, taxa = None, append = False):
                     textFile.write('>' + tag + '\n' + alignment[tag].seq + '\n')
       
                     
+def openTextOutput(filePath, append = False):
+    mode = 'at' if append else 'wt'
+    if filePath.endswith(".gz"):
+        return gzip.open(filePath, mode)
+    elif filePath.endswith(".bz2"):
+        return bz2.open(filePath, mode)
+    elif filePath.endswith(".xz"):
+        return lzma.open(filePath, mode)
+    return open(filePath, 'a' if append else 'w', buffering = WRITE_BUFFER_SIZE)
+                    
 def writePhylip(alignment, filePath, taxa = None):
     maxChars = 0
     lines = []
@@ -122,23 +174,14 @@ def writePhylip(alignment, filePath, taxa = None):
             textFile.write(line)
 
 def cleanGapColumns(filePath, cleanFile = None):
-    align = readFromFasta(filePath, False)
-    values = list(align.values())
-    keepCols = []
-    for i in range(len(values[0].seq)):
-        for j in range(len(values)):
-            if values[j].seq[i] != '-':
-                keepCols.append(i)
-                break
+    align = PackedAlignment.fromFasta(filePath)
+    keepCols = np.flatnonzero(align.letterCounts() > 0)
             
-    print("Removing gap columns.. Kept {} out of {}..".format(len(keepCols), len(values[0].seq)), file=stderr)
-    for s in values:
-        s.seq = ''.join(s.seq[idx] for idx in keepCols)
-    
+    print("Removing gap columns.. Kept {} out of {}..".format(len(keepCols), align.numColumns()), file=stderr)
     if cleanFile is None:
         cleanFile = filePath
         
-    writeFasta(align, cleanFile)
+    align.selectColumns(keepCols).writeFasta(cleanFile)
     
 def convertRnaToDna(filePath, destFile = None):
     align = readFromFasta(filePath, False)
@@ -149,10 +192,9 @@ def convertRnaToDna(filePath, destFile = None):
     writeFasta(align, destFile)
 
 def inferDataType(filePath):
-    sequences = readFromFasta(filePath, removeDashes=True)
     acg, t, u, total = 0, 0, 0, 0
-    for taxon in sequences:
-        letters = sequences[taxon].seq.upper()
+    for sequence in iterateFasta(filePath, removeDashes=True):
+        letters = sequence.seq.upper()
         for letter in letters:
             total = total + 1
             
@@ -191,29 +233,154 @@ def readSequenceLengthFromFasta(filePath):
         return length
 
 def countGaps(alignFile):
-    counts = []
-    currentSequence = ""
+    return PackedAlignment.fromFasta(alignFile).gapCounts().tolist()
 
-    with open(alignFile) as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('>'): 
-                
-                if currentSequence is not None:
-                    if len(counts) == 0:
-                        counts = [0] * len(currentSequence)
-                    for i in range(len(counts)):
-                        if currentSequence[i] == '-':
-                            counts[i] = counts[i] + 1
-                                             
-                currentSequence = ""
-            else:
-                currentSequence = currentSequence + line
-        if currentSequence is not None:
-            if len(counts) == 0:
-                counts = [0] * len(currentSequence)
-            for i in range(len(counts)):
-                if currentSequence[i] == '-':
-                    counts[i] = counts[i] + 1
+
+class FastaIndex:
     
-    return counts
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.indexPath = os.path.join(os.path.dirname(filePath), ".{}.idx.npz".format(os.path.basename(filePath)))
+        self.file = open(filePath, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.fileStamp = np.array([FASTA_INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype = np.int64)
+        self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if stat.st_size > 0 else b""
+        
+        if not self.loadIndex():
+            self.buildIndex()
+            self.saveIndex()
+        self.tagIdxs = {tag : i for i, tag in enumerate(self.tags)}
+    
+    def __len__(self):
+        return len(self.tags)
+    
+    def __contains__(self, tag):
+        return tag in self.tagIdxs
+    
+    def __iter__(self):
+        return iter(self.tags)
+    
+    def getBytes(self, tag):
+        i = self.tagIdxs[tag]
+        chunk = self.data[self.starts[i] : self.ends[i]]
+        return b"".join(chunk.split()) if b"\n" in chunk else chunk.strip()
+    
+    def getSequence(self, tag):
+        return self.getBytes(tag).decode()
+    
+    def buildIndex(self):
+        tags, starts, ends = [], [], []
+        data, size = self.data, len(self.data)
+        pos = 0 if data[:1] == b">" else data.find(b"\n>")
+        pos = pos + 1 if pos >= 0 and data[pos : pos + 1] == b"\n" else pos
+        while 0 <= pos < size:
+            headerEnd = data.find(b"\n", pos)
+            headerEnd = size if headerEnd == -1 else headerEnd
+            nextHeader = data.find(b"\n>", headerEnd)
+            tags.append(data[pos + 1 : headerEnd].decode().rstrip())
+            starts.append(headerEnd + 1)
+            ends.append(size if nextHeader == -1 else nextHeader)
+            pos = -1 if nextHeader == -1 else nextHeader + 1
+        self.tags = tags
+        self.starts = np.array(starts, dtype = np.int64)
+        self.ends = np.array(ends, dtype = np.int64)
+    
+    def loadIndex(self):
+        if not os.path.exists(self.indexPath):
+            return False
+        try:
+            with np.load(self.indexPath) as cached:
+                if not np.array_equal(cached["fileStamp"], self.fileStamp):
+                    return False
+                tagBytes = cached["tags"].tobytes().decode()
+                self.tags = tagBytes.split("\n") if len(tagBytes) > 0 else []
+                self.starts, self.ends = cached["starts"], cached["ends"]
+            return len(self.tags) == len(self.starts)
+        except Exception:
+            return False
+    
+    def saveIndex(self):
+        tempPath = "{}.{}-{}.tmp".format(self.indexPath, socket.gethostname(), os.getpid())
+        try:
+            tagBytes = np.frombuffer("\n".join(self.tags).encode(), dtype = np.uint8)
+            with open(tempPath, 'wb') as file:
+                np.savez(file, fileStamp = self.fileStamp, tags = tagBytes, starts = self.starts, ends = self.ends)
+            os.replace(tempPath, self.indexPath)
+        except OSError:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+    
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+class PackedAlignment:
+    
+    gapChar = ord('-')
+    lowerTable = np.arange(256, dtype = np.uint8)
+    lowerTable[ord('A') : ord('Z') + 1] = lowerTable[ord('a') : ord('z') + 1]
+    bitCounts = np.array([bin(i).count("1") for i in range(256)], dtype = np.uint8)
+    columnBlockSize = 4096
+    
+    def __init__(self, tags, matrix):
+        self.tags = tags
+        self.matrix = matrix
+        self.columnMatrix = None
+        self.gaps = None
+        self.gapBitmasks = None
+    
+    @staticmethod
+    def fromFasta(filePath):
+        index = FastaIndex(filePath)
+        rows = [index.getBytes(tag) for tag in index.tags]
+        index.close()
+        
+        length = max((len(row) for row in rows), default = 0)
+        matrix = np.full((len(rows), length), PackedAlignment.gapChar, dtype = np.uint8)
+        for i, row in enumerate(rows):
+            matrix[i, :len(row)] = np.frombuffer(row, dtype = np.uint8)
+        return PackedAlignment(list(index.tags), matrix)
+    
+    def numTaxa(self):
+        return self.matrix.shape[0]
+    
+    def numColumns(self):
+        return self.matrix.shape[1]
+    
+    def columns(self):
+        if self.columnMatrix is None:
+            self.columnMatrix = np.ascontiguousarray(self.matrix.T)
+        return self.columnMatrix
+    
+    def gapMask(self):
+        if self.gaps is None:
+            self.gaps = self.matrix == PackedAlignment.gapChar
+        return self.gaps
+    
+    def gapBits(self):
+        if self.gapBitmasks is None:
+            columns = self.columns()
+            self.gapBitmasks = np.zeros((self.numColumns(), (self.numTaxa() + 7) // 8), dtype = np.uint8)
+            for i in range(0, self.numColumns(), PackedAlignment.columnBlockSize):
+                block = columns[i : i + PackedAlignment.columnBlockSize]
+                self.gapBitmasks[i : i + len(block)] = np.packbits(block == PackedAlignment.gapChar, axis = 1)
+        return self.gapBitmasks
+    
+    def gapCounts(self):
+        return PackedAlignment.bitCounts[self.gapBits()].sum(axis = 1, dtype = np.int64)
+    
+    def letterCounts(self):
+        return self.numTaxa() - self.gapCounts()
+    
+    def selectColumns(self, columns):
+        return PackedAlignment(self.tags, self.matrix[:, columns])
+    
+    def getSequence(self, i):
+        return self.matrix[i].tobytes().decode()
+    
+    def writeFasta(self, filePath, append = False):
+        with open(filePath, 'a' if append else 'w') as textFile:
+            for i, tag in enumerate(self.tags):
+                textFile.write('>' + tag + '\n' + self.getSequence(i) + '\n')
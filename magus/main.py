@@ -13,6 +13,7 @@ from . import __version__
 
 from .align.aligner import mainAlignmentTask
 from .configuration import buildConfigs, Configs
+from .helpers import profiler
 from .tasks import manager
 
 def main():   
@@ -36,6 +37,7 @@ def main():
         manager.stopTaskManager()
     
     endTime = time.time()
+    profiler.writeReport(endTime-startTime)
     Configs.log("MAGUS finished in {} seconds..".format(endTime-startTime))
     
 def parseArgs():
@@ -53,6 +55,10 @@ def parseArgs():
     parser.add_argument("-b", "--backbones", type=str, nargs="+",
                         help="Paths to input backbone alignment files", required=False, default=[])
 
+    parser.add_argument("--addsequences", type=str,
+                        help="Path to new unaligned sequences, to add to the finished run in the working directory", 
+                        required=False, default=None)
+
     parser.add_argument("-o", "--output", type=str,
                         help="Output alignment path. Will be set to /dev/stdout if '-' is passed.", required=True)
     
@@ -64,6 +70,10 @@ def parseArgs():
                         help="Number of processors to use (default: # cpus available)",
                         required=False, default=-1)
     
+    parser.add_argument("--taskexecutor", type=str,
+                        help="Backend for alignment and other Python-level tasks (threads or processes)",
+                        required=False, default="threads")
+    
     parser.add_argument("--maxsubsetsize", type=int,
                         help="Maximum subset size for divide-and-conquer",
                         required=False, default=50)
@@ -97,7 +107,7 @@ def parseArgs():
                         required=False, default="False")
     
     parser.add_argument("--graphclustermethod", type=str,
-                        help="Method for initial clustering of the alignment graph (mcl or none)",
+                        help="Method for initial clustering of the alignment graph (mcl, mclnative, mclwindowed, mlrmcl, rg or none)",
                         required=False, default="mcl")
     
     parser.add_argument("--graphtracemethod", type=str,
@@ -108,6 +118,21 @@ def parseArgs():
                         help="Run an optimization step on the graph trace (true or false)",
                         required=False, default="False")
     
+    parser.add_argument("--graphtracekernels", type=str,
+                        help="Run the graph trace inner loops as compiled kernels, if numba is installed (true or false)",
+                        required=False, default="true")
+    
+    parser.add_argument("--searchstrategy", type=str,
+                        help="How minclusters and mwtsearch handle a full search heap: restart from the last frontier (restart) or evict the worst states (beam)",
+                        required=False, default="restart")
+    
+    parser.add_argument("--searchmemory", type=float,
+                        help="Memory budget for the beam search heap, in MB", required=False, default=1024)
+    
+    parser.add_argument("--searchtime", type=float,
+                        help="Time budget for each graph trace search, in seconds, after which the search finishes greedily (0 for no limit)",
+                        required=False, default=0)
+    
     parser.add_argument("-r", "--mafftruns", type=int,
                         help="Number of MAFFT runs", required=False, default=10)
     
@@ -117,6 +142,9 @@ def parseArgs():
     parser.add_argument("-f", "--inflationfactor", type=float,
                         help="MCL inflation factor", required=False, default=4)
     
+    parser.add_argument("--mclwindowsize", type=int,
+                        help="Window size, in subalignment columns, for windowed MCL clustering", required=False, default=1000)
+    
     parser.add_argument("-c", "--constrain", type=str,
                         help="Constrain MAGUS to respect subalignments (true or false)", required=False, default="true")
     
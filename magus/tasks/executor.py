@@ -0,0 +1,59 @@
+'''
+Created on Oct 18, 2026
+'''
+
+import json
+import multiprocessing
+import concurrent.futures
+
+from ..configuration import Configs, configsSnapshot, initializeWorker
+from ..helpers import profiler
+
+'''
+Process backend for the Python-level task types (alignment tasks, induced subalignments, compression).
+With threads, these tasks can only run on the main thread, and are limited by the GIL.
+With processes, each task is sent to a spawned worker process as JSON, along with a snapshot of the Configs.
+A worker thread in the main process waits on it, so it counts against the usual thread budget.
+Alignment tasks start their own single-threaded task manager in the worker process,
+which cooperates with the main one through the shared task files, like another compute node would.
+The worker's profiling records and CPU time are sent back with the result and merged into the main process.
+'''
+
+processTaskTypes = {"runAlignmentTask", "buildInducedSubalignment", "compressSubalignment"}
+processPool = None
+
+def startProcessPool():
+    global processPool
+    if Configs.taskExecutor == "processes":
+        mpContext = multiprocessing.get_context("spawn")
+        processPool = concurrent.futures.ProcessPoolExecutor(max_workers = Configs.numCores, mp_context = mpContext)
+
+def stopProcessPool():
+    global processPool
+    if processPool is not None:
+        processPool.shutdown()
+        processPool = None
+
+def runsInProcess(taskType):
+    return Configs.taskExecutor == "processes" and taskType in processTaskTypes
+
+def runTaskInProcess(t):
+    profiler.mergeRecords(processPool.submit(runTaskFromJson, t.json, configsSnapshot()).result())
+
+def runTaskFromJson(taskJson, configs):
+    from . import task, manager
+    initializeWorker(configs)
+    Configs.taskExecutor = "threads"
+    startUsage = profiler.readUsage()
+
+    t = task.Task(**json.loads(taskJson))
+    if t.taskType != "runAlignmentTask":
+        t.run()
+        return profiler.takeRecords(startUsage)
+
+    manager.startTaskManager()
+    try:
+        t.run()
+    finally:
+        manager.stopTaskManager()
+    return profiler.takeRecords(startUsage)
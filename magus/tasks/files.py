@@ -7,43 +7,185 @@ Created on Oct 26, 2020
 import os
 import json
 import time
+import socket
+import hashlib
 import random
 
 from . import task
 
+'''
+Shared-filesystem task queue, safe for many nodes working in the same working directory.
+Each pending task is its own small JSON file, named <key>.<taskType>.<cost>.json, where the key is a hash of the output file.
+The cost estimate is in the name, so nodes can pick the longest tasks first without reading any task files.
+A node claims a task by renaming its file into the claimed directory, with the node id added to the name.
+Renames are atomic, so exactly one node wins a claim, and nobody needs a lock or reads/rewrites task lists.
+Every node submits the same tasks, so publishing first creates a per-key marker with O_EXCL, and only the node that creates it writes the task file.
+Published markers outlive their task (claimed, released, reclaimed or finished), so a task can't be published and run twice.
+Each node keeps a lease file alive while it runs.
+If a node's lease expires (or its process is gone, on the same host), its claimed tasks are put back into the pending directory.
+Finished tasks leave a done marker, which stays in place so that every node waiting on the task can see it; a task clears its old marker before running.
+Done and published markers are cleared when the last node stops, or the first node starts, in the working directory.
+'''
+
+LEASE_RENEW_INTERVAL = 10
+LEASE_DURATION = 60
+
+def taskKey(outputFile):
+    return hashlib.md5(os.path.abspath(outputFile).encode()).hexdigest()
+
+def taskCost(t):
+    return int(getattr(t, "cost", 0))
+
+def doneMarkerName(outputFile):
+    return "{}.done".format(taskKey(outputFile))
+
+def writeDoneMarker(doneDir, outputFile):
+    with open(os.path.join(doneDir, doneMarkerName(outputFile)), 'w'):
+        pass
+
+def removeDoneMarker(doneDir, outputFile):
+    try:
+        os.remove(os.path.join(doneDir, doneMarkerName(outputFile)))
+    except FileNotFoundError:
+        pass
+
+def clearDoneMarkers(doneDir):
+    for name in os.listdir(doneDir):
+        if name.endswith(".done"):
+            try:
+                os.remove(os.path.join(doneDir, name))
+            except FileNotFoundError:
+                pass
+
+class TaskQueue:
+
+    def __init__(self, tasksDir):
+        self.pendingDir = os.path.join(tasksDir, "tasks_pending")
+        self.claimedDir = os.path.join(tasksDir, "tasks_claimed")
+        self.leaseDir = os.path.join(tasksDir, "tasks_leases")
+        self.publishedDir = os.path.join(tasksDir, "tasks_published")
+        for directory in (self.pendingDir, self.claimedDir, self.leaseDir, self.publishedDir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        self.host = socket.gethostname().replace(".", "_")
+        self.nodeId = "{}-{}-{:08x}".format(self.host, os.getpid(), random.getrandbits(32))
+        self.leaseFile = os.path.join(self.leaseDir, "{}.lease".format(self.nodeId))
+        self.lastRenewTime = 0
+        self.renewLease()
+
+    def renewLease(self):
+        if time.time() - self.lastRenewTime >= LEASE_RENEW_INTERVAL:
+            with open(self.leaseFile, 'a'):
+                pass
+            os.utime(self.leaseFile)
+            self.lastRenewTime = time.time()
+
+    def close(self):
+        if os.path.exists(self.leaseFile):
+            os.remove(self.leaseFile)
+
+    def pendingPath(self, key, taskType, cost):
+        return os.path.join(self.pendingDir, "{}.{}.{}.json".format(key, taskType, cost))
+
+    def claimedPath(self, key, taskType, cost, nodeId):
+        return os.path.join(self.claimedDir, "{}.{}.{}.{}.json".format(key, taskType, cost, nodeId))
+
+    def publishTasks(self, tasks):
+        published = []
+        for t in tasks:
+            key = taskKey(t.outputFile)
+            if not self.markPublished(key):
+                continue
+            tempPath = os.path.join(self.pendingDir, ".{}.{}.tmp".format(key, self.nodeId))
+            with open(tempPath, 'w') as file:
+                file.write(t.json)
+            os.replace(tempPath, self.pendingPath(key, t.taskType, taskCost(t)))
+            published.append((key, t.taskType, taskCost(t)))
+        return published
+
+    def markPublished(self, key):
+        try:
+            os.close(os.open(os.path.join(self.publishedDir, "{}.published".format(key)), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def clearPublishedMarkers(self):
+        for name in os.listdir(self.publishedDir):
+            if name.endswith(".published"):
+                try:
+                    os.remove(os.path.join(self.publishedDir, name))
+                except FileNotFoundError:
+                    pass
+
+    def listPendingTasks(self):
+        pending = []
+        for name in os.listdir(self.pendingDir):
+            tokens = name.split(".")
+            if len(tokens) == 4 and tokens[3] == "json":
+                pending.append((tokens[0], tokens[1], int(tokens[2])))
+        return pending
+
+    def claimTask(self, key, taskType, cost):
+        claimedPath = self.claimedPath(key, taskType, cost, self.nodeId)
+        try:
+            os.rename(self.pendingPath(key, taskType, cost), claimedPath)
+        except FileNotFoundError:
+            return None
+        with open(claimedPath) as file:
+            return task.Task(**json.loads(file.read()))
+
+    def completeTask(self, t):
+        claimedPath = self.claimedPath(taskKey(t.outputFile), t.taskType, taskCost(t), self.nodeId)
+        if os.path.exists(claimedPath):
+            os.remove(claimedPath)
+
+    def releaseTask(self, t):
+        key = taskKey(t.outputFile)
+        try:
+            os.rename(self.claimedPath(key, t.taskType, taskCost(t), self.nodeId), self.pendingPath(key, t.taskType, taskCost(t)))
+        except FileNotFoundError:
+            pass
+
+    def reclaimExpiredTasks(self):
+        leaseStatus = {}
+        reclaimed = 0
+        for name in os.listdir(self.claimedDir):
+            tokens = name.split(".")
+            if len(tokens) != 5 or tokens[4] != "json":
+                continue
+            key, taskType, cost, nodeId = tokens[:4]
+            if nodeId not in leaseStatus:
+                leaseStatus[nodeId] = self.isLeaseAlive(nodeId)
+            if not leaseStatus[nodeId]:
+                try:
+                    os.rename(os.path.join(self.claimedDir, name), self.pendingPath(key, taskType, cost))
+                    reclaimed = reclaimed + 1
+                except FileNotFoundError:
+                    pass
+        return reclaimed
+
+    def otherNodesAlive(self):
+        for name in os.listdir(self.leaseDir):
+            nodeId = name[:-len(".lease")]
+            if name.endswith(".lease") and nodeId != self.nodeId and self.isLeaseAlive(nodeId):
+                return True
+        return False
 
-def writeTasksToFile(taskList, tasksFile, append = True):
-    if not append and len(taskList) == 0 and os.path.exists(tasksFile):
-        os.remove(tasksFile)
-    elif len(taskList) > 0:
-        with open(tasksFile, 'a' if append else 'w') as file:
-            for t in taskList:
-                file.write(t.json + "\n")
-
-def readTasksFromFile(tasksFile):
-    fileTasks = []
-    if os.path.exists(tasksFile):
-        with open(tasksFile) as file:
-            for line in file:
-                mapper = json.loads(line.strip())
-                fileTasks.append(task.Task(**mapper))
-    return fileTasks
-
-
-class FileLock:
-    
-    def __init__(self, filePath):
-        self.filePath = filePath
-    
-    def __enter__(self):
-        while True:
+    def isLeaseAlive(self, nodeId):
+        if nodeId == self.nodeId:
+            return True
+        host, pid, tag = nodeId.rsplit("-", 2)
+        if host == self.host:
             try:
-                lock = open(self.filePath, 'x')
-                lock.close()
-                return self
-            except:
-                time.sleep(random.random()*0.1 + 0.05)
-                #time.sleep(random.random() + 0.5)
-            
-    def __exit__(self, excType, excVal, excTb):
-        os.remove(self.filePath)
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+        try:
+            leaseTime = os.stat(os.path.join(self.leaseDir, "{}.lease".format(nodeId))).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - leaseTime < LEASE_DURATION
@@ -11,18 +11,31 @@ import time
 import concurrent.futures
 
 from ..configuration import Configs
-from . import files
+from ..helpers import profiler
+from . import files, executor
 
 '''
 Launching and awaiting tasks.
 To avoid deadlocks and stack overflows, only the main thread can submit tasks.
 Thus, only the main thread runs alignment tasks, worker threads are used for other task types (like MAFFT).
+With the process executor, alignment and other Python-level tasks run in worker processes instead.
+The manager reacts to events: task submissions and local completions wake it up immediately.
+Tasks finished by other nodes/processes leave a marker in the done directory, which is checked every EVENT_WAIT_INTERVAL. 
+Other nodes' pending task files and output files are still scanned every IDLE_WAIT_INTERVAL, as a fallback.
+Tasks are shared with other nodes through the claim-based task queue in files.py.
+Launch candidates are ordered by their estimated cost, longest first, so that long (often recursive) tasks don't end up on the tail.
+Multithreaded external tools get a thread budget at launch, which counts against the cores: 
+the free cores are split across the queued tasks, so many queued tasks run single-threaded and a lone task runs wide.
 '''
 
+EVENT_WAIT_INTERVAL = 0.05
+IDLE_WAIT_INTERVAL = 5
+
 class TaskManager():
     
-    runningTasksFile = None
-    lockTasksFile = None
+    taskQueue = None
+    doneTasksDir = None
+    doneTasksMtime = None
     
     managerPool = None
     managerFuture = None
@@ -43,6 +56,7 @@ class TaskManager():
     taskPool = None
     threadsUsed = 0
     lastFilesCheckTime = 0
+    lastPendingCheckTime = 0
     lastDebugTime = 0
     serialTaskTypes = {"runAlignmentTask", "buildInducedSubalignment", "compressSubalignment"}
     contextStack = []
@@ -51,15 +65,19 @@ def startTaskManager():
     Configs.debug("Starting up the task manager..")
     
     tasksDir = os.path.join(Configs.workingDir, "tasks")
-    TaskManager.pendingTasksDir = os.path.join(tasksDir, "tasks_pending")
-    TaskManager.runningTasksFile = os.path.join(tasksDir, "tasks_running.txt")
-    TaskManager.lockTasksFile = os.path.join(tasksDir, "tasks.lock")
-    if not os.path.exists(TaskManager.pendingTasksDir):
-        os.makedirs(TaskManager.pendingTasksDir)  
+    TaskManager.taskQueue = files.TaskQueue(tasksDir)
+    TaskManager.doneTasksDir = os.path.join(tasksDir, "tasks_done")
+    if not os.path.exists(TaskManager.doneTasksDir):
+        os.makedirs(TaskManager.doneTasksDir)
+    elif not TaskManager.taskQueue.otherNodesAlive():
+        files.clearDoneMarkers(TaskManager.doneTasksDir)
+        TaskManager.taskQueue.clearPublishedMarkers()
     
+    TaskManager.managerStopSignal = False
+    TaskManager.taskPool = concurrent.futures.ThreadPoolExecutor(max_workers = Configs.numCores)
+    executor.startProcessPool()
     TaskManager.managerPool = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
     TaskManager.managerFuture = TaskManager.managerPool.submit(runTaskManager)
-    TaskManager.taskPool = concurrent.futures.ThreadPoolExecutor(max_workers = Configs.numCores)
     Configs.debug("Task manager is up..")
 
 def stopTaskManager():
@@ -72,20 +90,34 @@ def stopTaskManager():
     finally:
         Configs.log("Waiting for {} tasks to finish..".format(len(TaskManager.runningTasks)))
         TaskManager.taskPool.shutdown()
+        executor.stopProcessPool()
         dealWithFinishedTasks()        
         TaskManager.managerPool.shutdown()
+        if not TaskManager.taskQueue.otherNodesAlive():
+            files.clearDoneMarkers(TaskManager.doneTasksDir)
+            TaskManager.taskQueue.clearPublishedMarkers()
+        TaskManager.taskQueue.close()
         Configs.debug("Task manager stopped..")
 
 def runTaskManager():
     try:
+        checkPendingFiles = True
         while not TaskManager.managerStopSignal:
             with TaskManager.managerLock:
+                TaskManager.managerSignal.clear()
+                TaskManager.taskQueue.renewLease()
                 dealWithErrors()
                 dealWithFinishedTasks()
-                dealWithPendingTasks()
+                numLaunched = dealWithPendingTasks(checkPendingFiles)
                 dealWithWaitingTasks()
-                TaskManager.managerSignal.clear()
-            TaskManager.managerSignal.wait(5)
+                canLaunchMore = numLaunched > 0 and TaskManager.threadsUsed < Configs.numCores
+            
+            if canLaunchMore:
+                checkPendingFiles = True
+            else:
+                timeout = EVENT_WAIT_INTERVAL if len(TaskManager.waitingTasks) > 0 else IDLE_WAIT_INTERVAL
+                signaled = TaskManager.managerSignal.wait(timeout)
+                checkPendingFiles = signaled or time.time() - TaskManager.lastPendingCheckTime >= IDLE_WAIT_INTERVAL
     finally:
         TaskManager.observerSignal.set()  
 
@@ -96,22 +128,17 @@ def dealWithErrors():
             task.future.result()
         
 def dealWithFinishedTasks():
-    stoppedRunning = set(t for t in TaskManager.finishedTasks | TaskManager.failedTasks if t.taskType == "runAlignmentTask")
-    if len(stoppedRunning) > 0:
-        with files.FileLock(TaskManager.lockTasksFile):
-            runningTasks = files.readTasksFromFile(TaskManager.runningTasksFile)
-            stillRunningTasks = [t for t in runningTasks if t not in stoppedRunning]
-            if len(stillRunningTasks) < len(runningTasks):
-                files.writeTasksToFile(stillRunningTasks, TaskManager.runningTasksFile, append = False)
-        
-    if len(TaskManager.failedTasks) > 0:
-        processPendingTasks(TaskManager.failedTasks, 0, None)   
+    for task in TaskManager.finishedTasks:
+        TaskManager.taskQueue.completeTask(task)
+    for task in TaskManager.failedTasks:
+        TaskManager.taskQueue.releaseTask(task)
         
     TaskManager.finishedTasks = set()
     TaskManager.failedTasks = set()
 
-def dealWithPendingTasks():
-    numToLaunch = min(1, Configs.numCores - TaskManager.threadsUsed)
+def dealWithPendingTasks(checkPendingFiles):
+    numToLaunch = 1 if TaskManager.threadsUsed < Configs.numCores or TaskManager.observerWaiting else 0
+    numLaunched = 0
     newTasks = []
     for t in TaskManager.submittedTasks:
         if os.path.exists(t.outputFile) and not Configs.overwrite:
@@ -122,30 +149,39 @@ def dealWithPendingTasks():
             newTasks.append(t)
             TaskManager.waitingTasks[t.outputFile] = t
     
-    if len(newTasks) > 0:
-        launchedTasks, remainingTasks = processPendingTasks(newTasks, numToLaunch, None)
-        numToLaunch = numToLaunch - len(launchedTasks)
+    candidates = TaskManager.taskQueue.publishTasks(newTasks) if len(newTasks) > 0 else []
+    if numToLaunch > 0 and checkPendingFiles:
+        TaskManager.lastPendingCheckTime = time.time()
+        newKeys = set(candidates)
+        candidates = candidates + [p for p in TaskManager.taskQueue.listPendingTasks() if p not in newKeys]
     if numToLaunch > 0:
-        pendingFiles = [os.path.join(TaskManager.pendingTasksDir, file) for file in os.listdir(TaskManager.pendingTasksDir) if file.endswith(".txt")]
-        random.shuffle(pendingFiles)
-        for taskFile in pendingFiles:
-            if numToLaunch <= 0:
-                break
-            launchedTasks, remainingTasks = processPendingTasks(None, numToLaunch, taskFile)
-            numToLaunch = numToLaunch - len(launchedTasks)
+        random.shuffle(candidates)
+        candidates.sort(key = lambda p: p[2], reverse = True)
+        numLaunched = launchTasks(candidates, numToLaunch)
 
     TaskManager.submittedTasks = set()
+    return numLaunched
 
 def dealWithWaitingTasks():
-    timeSinceFileCheck = time.time() - TaskManager.lastFilesCheckTime
-    if timeSinceFileCheck >= 5: 
-        for file, task in list(TaskManager.waitingTasks.items()):
-            if os.path.exists(file):
-                Configs.debug("Detected task completion: {}".format(file))
-                TaskManager.waitingTasks.pop(file)
-                task.isFinished = True
-                TaskManager.observerSignal.set()
-        TaskManager.lastFilesCheckTime = time.time()
+    if len(TaskManager.waitingTasks) > 0:
+        fullCheck = time.time() - TaskManager.lastFilesCheckTime >= IDLE_WAIT_INTERVAL
+        doneMtime = os.stat(TaskManager.doneTasksDir).st_mtime_ns
+        recentlyChanged = time.time() - doneMtime / 1e9 < 1
+        if fullCheck or recentlyChanged or doneMtime != TaskManager.doneTasksMtime:
+            TaskManager.doneTasksMtime = doneMtime
+            doneMarkers = None if fullCheck else set(os.listdir(TaskManager.doneTasksDir))
+            for file, task in list(TaskManager.waitingTasks.items()):
+                if (fullCheck or files.doneMarkerName(file) in doneMarkers) and os.path.exists(file):
+                    Configs.debug("Detected task completion: {}".format(file))
+                    TaskManager.waitingTasks.pop(file)
+                    task.isFinished = True
+                    TaskManager.observerSignal.set()
+        if fullCheck:
+            TaskManager.lastFilesCheckTime = time.time()
+            reclaimed = TaskManager.taskQueue.reclaimExpiredTasks()
+            if reclaimed > 0:
+                Configs.log("Reclaimed {} tasks from expired leases..".format(reclaimed))
+                TaskManager.managerSignal.set()
     
     timeSinceDebug = time.time() - TaskManager.lastDebugTime
     if timeSinceDebug >= 60:  
@@ -155,76 +191,71 @@ def dealWithWaitingTasks():
         for file in TaskManager.waitingTasks:
             Configs.debug("Still waiting on task {}".format(file))
 
-def processPendingTasks(tasks, numTasksToLaunch, taskFile):
-    if taskFile is None:
-        taskFile = os.path.join(TaskManager.pendingTasksDir, "task_file_{:03d}.txt".format(random.randint(0,999)))
-    
-    newTasks = True    
-    with files.FileLock(taskFile.replace(".txt", ".lock")):
-        if tasks is None:
-            tasks = files.readTasksFromFile(taskFile)
-            newTasks = False
-
-        alignTasks = [t for t in tasks if t.taskType == "runAlignmentTask"]
-        if len(alignTasks) > 0:
-            with files.FileLock(TaskManager.lockTasksFile):
-                runningTasks = set(files.readTasksFromFile(TaskManager.runningTasksFile))
-                if len(runningTasks) > 0:
-                    tasks = [t for t in tasks if t not in runningTasks]
-                launchedTasks, remainingTasks = launchTasks(tasks, numTasksToLaunch)        
-                writeRunningTasks = [t for t in launchedTasks if t.taskType == "runAlignmentTask"]
-                files.writeTasksToFile(writeRunningTasks, TaskManager.runningTasksFile, append = True)
-        else:
-            launchedTasks, remainingTasks = launchTasks(tasks, numTasksToLaunch)
-        
-        files.writeTasksToFile(remainingTasks, taskFile, append = newTasks) 
-        if len(launchedTasks) > 0:     
-            Configs.debug("Launched {} tasks and deferred {} tasks..".format(len(launchedTasks), len(remainingTasks)))   
-          
-    return launchedTasks, remainingTasks      
-
-def launchTasks(tasks, numTasksToLaunch):
-    launchedTasks = []
-    remainingTasks = []    
-    threadsAvailable = Configs.numCores - TaskManager.threadsUsed
-    toLaunch = min(numTasksToLaunch, threadsAvailable)    
-    for task in tasks:
-        if toLaunch > 0 and checkLaunchTask(task):
-            Configs.debug("Launched a new task.. {}/{} threads used, type: {}, output file: {}".format(TaskManager.threadsUsed, Configs.numCores, task.taskType, task.outputFile))
-            toLaunch = toLaunch - 1
-            launchedTasks.append(task)
-        else:
-            remainingTasks.append(task)
-    return launchedTasks, remainingTasks
+def launchTasks(candidates, numTasksToLaunch):
+    numLaunched = 0
+    numQueued = sum(1 for key, taskType, cost in candidates if not isSerialTask(taskType))
+    for key, taskType, cost in candidates:
+        if numLaunched >= numTasksToLaunch:
+            break
+        if not isSerialTask(taskType):
+            numQueued = numQueued - 1
+        if not canLaunchTask(key, taskType):
+            continue
+        task = TaskManager.taskQueue.claimTask(key, taskType, cost)
+        if task is not None:
+            launchTask(task, numQueued + 1)
+            Configs.debug("Launched a new task.. {}/{} threads used, type: {}, cost: {}, output file: {}".format(TaskManager.threadsUsed, Configs.numCores, task.taskType, cost, task.outputFile))
+            numLaunched = numLaunched + 1
+    return numLaunched
 
-def checkLaunchTask(task):
-    if task.taskType not in TaskManager.serialTaskTypes:
-        task.future = TaskManager.taskPool.submit(runTask, task)
-        return True
+def canLaunchTask(key, taskType):
+    if not isSerialTask(taskType):
+        return TaskManager.threadsUsed < Configs.numCores
     elif TaskManager.observerWaiting and TaskManager.observerTask is None:
         stack = TaskManager.contextStack
-        if task.taskType != "runAlignmentTask" or len(stack) == 0 or task in stack[-1].subalignmentTasks:
-            TaskManager.observerTask = task
-            TaskManager.observerSignal.set()
-            return True
+        return taskType != "runAlignmentTask" or len(stack) == 0 or key in set(files.taskKey(t.outputFile) for t in stack[-1].subalignmentTasks)
     return False
 
+def launchTask(task, numQueued):
+    if not isSerialTask(task.taskType):
+        task.threadBudget = allocateThreads(task, numQueued)
+        TaskManager.threadsUsed = TaskManager.threadsUsed + task.threadBudget
+        task.future = TaskManager.taskPool.submit(runTask, task)
+    else:
+        TaskManager.observerTask = task
+        TaskManager.observerSignal.set()
+
+def allocateThreads(task, numQueued):
+    if "threads" not in task.taskArgs:
+        return 1
+    freeThreads = Configs.numCores - TaskManager.threadsUsed
+    budget = max(1, min(task.taskArgs["threads"], freeThreads // max(1, numQueued)))
+    task.taskArgs["threads"] = budget
+    return budget
+
 def runTask(task):
+    serial = isSerialTask(task.taskType)
     with TaskManager.managerLock:
-        if task.taskType not in TaskManager.serialTaskTypes:
-            TaskManager.threadsUsed = TaskManager.threadsUsed + 1
         TaskManager.runningTasks.add(task)
     
     failed = False
+    files.removeDoneMarker(TaskManager.doneTasksDir, task.outputFile)
+    startTime, startCpu = profiler.startTask()
     try:
-        task.run()     
+        if executor.runsInProcess(task.taskType):
+            executor.runTaskInProcess(task)
+        else:
+            task.run()     
+        files.writeDoneMarker(TaskManager.doneTasksDir, task.outputFile)
     except:
         failed = True
         raise
     finally:
+        profiler.recordTask(task, startTime, startCpu, failed)
+        task.isFinished = True
         with TaskManager.managerLock:
-            if task.taskType not in TaskManager.serialTaskTypes:
-                TaskManager.threadsUsed = TaskManager.threadsUsed - 1
+            if not serial:
+                TaskManager.threadsUsed = TaskManager.threadsUsed - task.threadBudget
             TaskManager.runningTasks.remove(task)
             TaskManager.failedTasks.add(task) if failed else TaskManager.finishedTasks.add(task)
             if task.outputFile in TaskManager.waitingTasks:
@@ -234,3 +265,5 @@ def runTask(task):
             TaskManager.managerSignal.set()
             TaskManager.observerSignal.set()
 
+def isSerialTask(taskType):
+    return taskType in TaskManager.serialTaskTypes and not executor.runsInProcess(taskType)
@@ -17,6 +17,8 @@ For example, running MAFFT, compressing a subalignment, etc..
 Primarily used to thread-parallelize MAFFT runs and node-parallelize subalignment operations.
 Saved as JSON in task files, which are then read back by computing nodes with available threads.
 This also serves the purpose of allowing aborted MAGUS runs to pick up where they left off.
+Tasks can carry a rough cost estimate, so the task manager can launch the longest tasks first.
+Input file sizes serve as a cheap proxy for the number of sequences times their length.
 '''
 
 class Task:
@@ -87,6 +89,9 @@ class Task:
         return hash(self.outputFile)
 
 
+def estimateFileCost(*paths):
+    return sum(os.path.getsize(path) for path in paths if path is not None and os.path.exists(path))
+
 def asCompleted(tasks):
     yield from controller.asCompleted(tasks)
             
@@ -6,15 +6,29 @@ Created on Apr 14, 2020
 
 import subprocess
 import os
+import time
 import random
 import shutil
 from ..configuration import Configs
-from ..tasks.task import Task
+from ..helpers import profiler
+from ..tasks.task import Task, estimateFileCost
+
+'''
+Multithreaded tools get THREADS_TOKEN in place of their thread count, and the most threads they can use in the "threads" task argument.
+The task manager lowers "threads" to a budget that fits the free cores and the queued work, right before launching the task.
+The budget is also exported as OMP_NUM_THREADS, for OpenMP builds like FastTreeMP.
+'''
+
+THREADS_TOKEN = "%THREADS%"
 
 def runCommand(**kwargs):
-    command = kwargs["command"]
+    threads = str(kwargs.get("threads", 1))
+    command = kwargs["command"].replace(THREADS_TOKEN, threads)
+    env = dict(os.environ, OMP_NUM_THREADS = threads)
     Configs.log("Running an external tool, command: {}".format(command))
-    runner = subprocess.run(command, shell = True, cwd = kwargs["workingDir"], universal_newlines = True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    startTime = time.time()
+    runner, cpuSeconds, peakRssMb = profiler.runProcess(command, shell = True, cwd = kwargs["workingDir"], env = env, universal_newlines = True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    profiler.recordToolCall(command, time.time() - startTime, cpuSeconds, peakRssMb)
     try:    
         runner.check_returncode()
     except:
@@ -29,9 +43,9 @@ def runClustalOmegaGuideTree(fastaPath, workingDir, outputPath, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     args = [Configs.clustalPath]
     args.extend(["-i", fastaPath, "--max-hmm-iterations=-1", "--guidetree-out={}".format(tempPath)])
-    args.extend(["--threads={}".format(threads)])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    args.extend(["--threads={}".format(THREADS_TOKEN)])
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaPath))
 
 def generateMafftFilePathMap(inputPaths, outputDir):
     mafftMap = {inputPath : os.path.join(outputDir, "mafft_{}".format(os.path.basename(inputPath))) for inputPath in inputPaths}
@@ -47,22 +61,29 @@ def buildMafftAlignment(inputPath, outputPath, subtablePath = None):
 def runMafft(fastaPath, subtablePath, workingDir, outputPath, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     args = [Configs.mafftPath, "--localpair", "--maxiterate", "1000", "--ep", "0.123", 
-            "--quiet", "--thread", str(threads), "--anysymbol"]
+            "--quiet", "--thread", THREADS_TOKEN, "--anysymbol"]
     if subtablePath is not None:
         args.extend(["--merge", subtablePath])
     args.extend([fastaPath, ">", tempPath])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaPath))
+
+def runMafftAdd(fastaPath, alignmentPath, workingDir, outputPath, threads = 1):
+    tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
+    args = [Configs.mafftPath, "--localpair", "--maxiterate", "1000", "--ep", "0.123",
+            "--quiet", "--thread", THREADS_TOKEN, "--anysymbol", "--add", fastaPath, alignmentPath, ">", tempPath]
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaPath, alignmentPath))
 
 def runMafftGuideTree(fastaPath, workingDir, outputPath, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     treeFile = os.path.join(os.path.dirname(fastaPath),  "{}.tree".format(os.path.basename(fastaPath)))
     args = [Configs.mafftPath, "--retree", "0", "--treeout", "--parttree",
-            "--quiet", "--thread", str(threads), "--anysymbol"]
+            "--quiet", "--thread", THREADS_TOKEN, "--anysymbol"]
     args.extend(["--partsize", "1000"])
     args.extend([fastaPath, ">", tempPath])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {treeFile : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {treeFile : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaPath))
 
 def runMcl(matrixPath, inflation, workingDir, outputPath):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
@@ -70,7 +91,7 @@ def runMcl(matrixPath, inflation, workingDir, outputPath):
     if inflation is not None:
         args.extend(["-I", str(inflation)])
     taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(matrixPath))
 
 def runMlrMcl(matrixPath, granularity, balance, inflation, workingDir, outputPath):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
@@ -82,9 +103,9 @@ def runMlrMcl(matrixPath, granularity, balance, inflation, workingDir, outputPat
     if inflation is not None:
         args.extend(["-i", str(inflation)])
     taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(matrixPath))
 
-def runFastTree(fastaFilePath, workingDir, outputPath, mode = "normal", intree = None):
+def runFastTree(fastaFilePath, workingDir, outputPath, mode = "normal", intree = None, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     
     args = [Configs.fasttreePath]
@@ -104,8 +125,8 @@ def runFastTree(fastaFilePath, workingDir, outputPath, mode = "normal", intree =
         args.extend(["-fastest", "-nosupport", "-noml"])
     
     args.extend([fastaFilePath, ">", tempPath])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaFilePath))
 
 def runRaxmlNg(fastaFilePath, workingDir, outputPath, threads = 8):
     # raxml-ng --msa prim.phy --model GTR+G --prefix T4 --threads 2 --seed 2 --tree pars{25},rand{25}
@@ -125,25 +146,25 @@ def runRaxmlNg(fastaFilePath, workingDir, outputPath, threads = 8):
         
     args.extend(["--tree", "pars{{{}}}".format(1)])
     taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {raxmlFile : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fastaFilePath))
 
-def runHmmBuild(alignmentPath, workingDir, outputPath):
+def runHmmBuild(alignmentPath, workingDir, outputPath, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
-    args = [Configs.hmmbuildPath,'--ere', '0.59', "--cpu", "1"]
+    args = [Configs.hmmbuildPath,'--ere', '0.59', "--cpu", THREADS_TOKEN]
     args.extend(["--symfrac", "0.0", "--informat", "afa", tempPath, alignmentPath])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(alignmentPath))
 
 def runHmmAlign(hmmModelPath, fragPath, workingDir, outputPath):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
     args = [Configs.hmmalignPath, "-o", tempPath]
     args.extend([hmmModelPath, fragPath])
     taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fragPath))
 
-def runHmmSearch(hmmModelPath, fragPath, workingDir, outputPath):
+def runHmmSearch(hmmModelPath, fragPath, workingDir, outputPath, threads = 1):
     tempPath = os.path.join(os.path.dirname(outputPath), "temp_{}".format(os.path.basename(outputPath)))
-    args = [Configs.hmmsearchPath,"--noali", "--cpu", "1", "-o", tempPath, "-E", "99999999", "--max"]
+    args = [Configs.hmmsearchPath,"--noali", "--cpu", THREADS_TOKEN, "-o", tempPath, "-E", "99999999", "--max"]
     args.extend([hmmModelPath, fragPath])
-    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir}
-    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs)
+    taskArgs = {"command" : subprocess.list2cmdline(args), "fileCopyMap" : {tempPath : outputPath}, "workingDir" : workingDir, "threads" : threads}
+    return Task(taskType = "runCommand", outputFile = outputPath, taskArgs = taskArgs, cost = estimateFileCost(fragPath))